@@ -1,48 +1,105 @@
-from fastapi import APIRouter, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from typing import Optional
-from io import BytesIO
+import re
+import hashlib
 import urllib.parse
 
-# 假设这些函数是从 db_util.py 中导入
-from db.db_util import (
-    upload_source_file,
+# 异步数据库操作（Motor），需要await；GridFS 的读写同样是异步的，不再需要 asyncio.to_thread
+from db.async_db_util import (
+    open_upload_stream,
+    finish_upload,
+    add_file_record,
+    repo_exists,
+    UploadTooLarge,
     get_file_metadata_by_id,
     delete_file,
-    download_file,
+    open_file,
+    read_file_chunks,
     update_file_status,
     get_json_res
 )
 
 from models._file import FileMetadata, JsonRes
+from core.config.upload_config import upload_settings
+from core.streaming_upload import iter_file_part, MultipartStreamError
 
 router = APIRouter()
 
-@router.post("/upload", response_model=FileMetadata)
-async def upload_file_api(repo_id: str, 
-                          cur_file: UploadFile = File(...), 
+# multipart 边界和各部分头信息占用的字节数上限，用于在读取请求体之前按 Content-Length 拒绝明显超限的请求
+_MULTIPART_OVERHEAD = 64 * 1024
+_UPLOAD_FIELD = "cur_file"
+
+# 请求体不再由 FastAPI 解析，这里手动声明请求体格式，保持接口文档与原来一致
+_UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": [_UPLOAD_FIELD],
+                    "properties": {_UPLOAD_FIELD: {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/upload", response_model=FileMetadata, openapi_extra=_UPLOAD_OPENAPI)
+async def upload_file_api(request: Request,
+                          repo_id: str, 
                           source: bool = True):
     """
-    上传文件到 GridFS，并更新指定 repo_id 对应的 files 或 results 列表。
-    - source=True 表示更新 repo.files
-    - source=False 表示更新 repo.results
+    上传文件到 GridFS，并在 files 集合中记录该文件（所属 repo_id、类型等）。
+    - source=True 表示记录为源文件
+    - source=False 表示记录为结果文件
+    请求体边接收边按块写入 GridFS，同时计算大小和 SHA-256，不在内存或临时文件中缓存整个文件；
+    超过 UPLOAD_MAX_SIZE 时立即停止接收、删除已写入的块并返回 413。
     """
-    # 将上传的文件内容读取到内存
-    file_content = await cur_file.read()
+    max_size = upload_settings.MAX_SIZE
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_size + _MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File exceeds the maximum size of {max_size} bytes")
 
-    file_id = upload_source_file(
-        repo_id=repo_id,
-        file_obj=BytesIO(file_content),  # 用 BytesIO 包装一下
-        filename= cur_file.filename,
-        source=source
-    )
-    print(file_id)
-
-    if not file_id:
+    if not await repo_exists(repo_id):
         raise HTTPException(status_code=400, detail="File upload failed")
 
+    grid_in = None
+    sha256 = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    try:
+        async for filename, data in iter_file_part(request, _UPLOAD_FIELD):
+            if grid_in is None:
+                grid_in = open_upload_stream(filename)
+            size += len(data)
+            if size > max_size:
+                raise UploadTooLarge(f"文件超过 {max_size} 字节")
+            sha256.update(data)
+            buffer.extend(data)
+            # 攒够一个 GridFS 块再写入，减少数据库往返
+            if len(buffer) >= upload_settings.CHUNK_SIZE:
+                await grid_in.write(bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await grid_in.write(bytes(buffer))
+        file_id = await finish_upload(grid_in, sha256.hexdigest())
+    except BaseException as e:
+        # 包括客户端中途断开：删除已写入 GridFS 的块
+        if grid_in is not None:
+            await grid_in.abort()
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(status_code=413, detail=f"File exceeds the maximum size of {max_size} bytes")
+        if isinstance(e, MultipartStreamError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+
+    await add_file_record(repo_id, file_id, filename, size, sha256.hexdigest(), source)
+
     # 获取上传后该文件的元数据返回
-    metadata = get_file_metadata_by_id(repo_id, file_id, source)
+    metadata = await get_file_metadata_by_id(repo_id, str(file_id), source)
     if not metadata:
         raise HTTPException(status_code=404, detail="File metadata not found")
     
@@ -53,10 +110,10 @@ async def upload_file_api(repo_id: str,
 async def get_file_metadata_api(repo_id: str, file_id: str, source: bool = True):
     """
     获取指定 file_id 的文件元数据。
-    - source=True 表示从 repo.files 获取
-    - source=False 表示从 repo.results 获取
+    - source=True 表示查找源文件
+    - source=False 表示查找结果文件
     """
-    metadata = get_file_metadata_by_id(repo_id, file_id, source)
+    metadata = await get_file_metadata_by_id(repo_id, file_id, source)
     if not metadata:
         raise HTTPException(status_code=404, detail="File not found")
     return metadata
@@ -65,36 +122,119 @@ async def get_file_metadata_api(repo_id: str, file_id: str, source: bool = True)
 @router.delete("/{file_id}")
 async def delete_file_api(file_id: str):
     """
-    删除指定 file_id 的文件，并从所有 repo.files 或 repo.results 中移除该文件记录
+    删除指定 file_id 的文件，并删除 files 集合中该文件的记录
     """
-    result = delete_file(file_id)
+    result = await delete_file(file_id)
     if not result:
         raise HTTPException(status_code=404, detail="File not found or already deleted")
     return {"detail": "File deleted successfully"}
 
 
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(grid_out) -> str:
+    """
+    优先使用上传时记录的内容 SHA-256；更早上传的文件没有该字段，
+    GridFS 中的文件写入后不会被修改，用文件 id 即可唯一标识内容
+    """
+    return f'"{getattr(grid_out, "sha256", None) or grid_out._id}"'
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _parse_range(header: str, length: int):
+    """
+    解析单个字节范围
+    :return: (start, end)，end 含；格式不支持（例如多个范围）时返回 None，按完整文件返回；
+             范围无法满足时抛出 ValueError
+    """
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N：最后 N 个字节
+        suffix = int(last)
+        if suffix == 0 or length == 0:
+            raise ValueError(header)
+        return max(0, length - suffix), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or (last and int(last) < start):
+        raise ValueError(header)
+    return start, end
+
+
+async def _iter_file(grid_out, start: int, end: int):
+    """
+    逐块产出文件内容，每次只从数据库异步读取一个 GridFS 块；
+    客户端中途断开时关闭生成器和 GridOut
+    """
+    chunks = read_file_chunks(grid_out, start, end)
+    try:
+        async for data in chunks:
+            yield data
+    finally:
+        await chunks.aclose()
+        grid_out.close()
+
+
 @router.get("/{file_id}/download")
-async def download_file_api(file_id: str):
+async def download_file_api(file_id: str, request: Request):
     """
     下载指定 file_id 的文件内容，返回一个流式响应。
+    按 GridFS 块逐块读取并发送，不把整个文件读入内存；
+    支持 Range（断点续传，单个范围）、If-Range，以及基于 ETag 的 If-None-Match（返回 304）。
     """
-    file_data = download_file(file_id)
-    if not file_data:
+    grid_out = await open_file(file_id)
+    if grid_out is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    filename, file_content = file_data
-    file_like = BytesIO(file_content)
-    file_like.seek(0)
-
+    length = grid_out.length
+    etag = _etag(grid_out)
     # 处理文件名，防止编码问题
-    encoded_filename = urllib.parse.quote(filename)  # 处理非 ASCII 文件名
+    encoded_filename = urllib.parse.quote(grid_out.filename or file_id)  # 处理非 ASCII 文件名
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}",
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+    }
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        grid_out.close()
+        return Response(status_code=304, headers={"ETag": etag})
+
+    start, end, status_code = 0, length - 1, 200
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # If-Range 与当前 ETag 不一致说明客户端缓存的是别的内容，返回完整文件
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, length)
+        except ValueError:
+            grid_out.close()
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{length}", "ETag": etag})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{length}"
 
+    headers["Content-Length"] = str(end - start + 1)
     return StreamingResponse(
-        file_like,
+        _iter_file(grid_out, start, end),
+        status_code=status_code,
         media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-        }
+        headers=headers
     )
 
 @router.put("/{file_id}", response_model=str)
@@ -104,10 +244,10 @@ async def update_file_status_api(repo_id: str,
                                  source: bool = True):
     """
     更新文件状态，例如将 status 字段设置为 "complete" 或其它。
-    - source=True 表示更新 repo.files
-    - source=False 表示更新 repo.results
+    - source=True 表示更新源文件
+    - source=False 表示更新结果文件
     """
-    result = update_file_status(repo_id, file_id, new_status, source)
+    result = await update_file_status(repo_id, file_id, new_status, source)
     if result == "not found":
         raise HTTPException(status_code=404, detail="File not found")
     return f"File {file_id} status updated to {new_status}"
@@ -120,7 +260,7 @@ async def get_json_res_api(file_id: str):
     如果没有产生结果则将status code设置为404
     注意：这里传的是生成结果的file_id，也不是json_res 的 _id
     """
-    json_res = get_json_res(file_id)
+    json_res = await get_json_res(file_id)
     if json_res == None:
         raise HTTPException(status_code=404, detail="Res not found, have you process or pass in the right file_id?")
     return JsonRes(res_id=str(json_res.get("_id")), file_id=str(json_res.get("file_id")), content=json_res.get("content"))
\ No newline at end of file
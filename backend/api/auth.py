@@ -16,13 +16,13 @@ from datetime import timedelta
 
 from core.security import (
     create_access_token, 
-    get_password_hash, 
-    verify_password, 
     ACCESS_TOKEN_EXPIRE_MINUTES,
     get_current_user
 )
+from core.password_hasher import password_hasher  # bcrypt 在独立的有界线程池中计算，不阻塞事件循环
+from core.permissions import is_admin
 from models.auth import Token, UserLogin, UserRegister
-from db.db_util import create_user, get_user_by_username, get_user_by_email
+from db.async_db_util import create_user, get_user_by_username, get_user_by_email, verify_user_password  # 异步数据库操作，需要await
 
 router = APIRouter()
 
@@ -63,7 +63,7 @@ async def register_user(user_data: UserRegister):
         )
     
     # 2. 检查用户名是否已存在 - 用户名唯一性检查
-    existing_user = get_user_by_username(user_data.username)
+    existing_user = await get_user_by_username(user_data.username)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -71,7 +71,7 @@ async def register_user(user_data: UserRegister):
         )
     
     # 3. 检查邮箱是否已存在 - 邮箱唯一性检查
-    existing_email = get_user_by_email(user_data.email)
+    existing_email = await get_user_by_email(user_data.email)
     if existing_email:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -80,15 +80,22 @@ async def register_user(user_data: UserRegister):
     
     # 4. 对密码进行哈希处理，增强安全性
     # 使用bcrypt算法，确保即使数据库泄露，密码也不会被轻易破解
-    hashed_password = get_password_hash(user_data.password)
+    # bcrypt 计算在密码哈希线程池中进行，期间事件循环可以继续处理其他请求
+    hashed_password = await password_hasher.hash(user_data.password)
     
     # 5. 创建新用户，传入哈希后的密码
-    user_id = create_user(
+    user_id = await create_user(
         user_data.username, 
         user_data.email, 
         hashed_password,  # 传入哈希后的密码而不是明文密码
         user_data.profile_picture
     )
+    # 并发注册同一个用户名时，上面的检查可能都通过，由唯一索引拒绝后到的一个
+    if not user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="用户名或邮箱已被使用"
+        )
     
     # 6. 创建访问令牌 (JWT)，设置过期时间
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -124,15 +131,16 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
         HTTPException 401: 如果用户名/密码不正确
     """
     # 1. 尝试通过用户名找到用户
-    user = get_user_by_username(form_data.username)
+    user = await get_user_by_username(form_data.username)
     
     # 2. 如果找不到用户，尝试通过邮箱找到用户(支持邮箱登录)
     if not user:
-        user = get_user_by_email(form_data.username)
+        user = await get_user_by_email(form_data.username)
     
     # 3. 如果仍找不到用户或密码不匹配，则返回认证失败
     # 注意这里使用password_hash而不是password字段，因为数据库中存储的是哈希密码
-    if not user or not verify_password(form_data.password, user["password_hash"]):
+    # verify_user_password 在线程池中验证，代价因子修改过时顺便更新哈希
+    if not user or not await verify_user_password(user, form_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名或密码不正确",
@@ -173,15 +181,15 @@ async def login(user_data: UserLogin):
         HTTPException 401: 如果认证失败
     """
     # 1. 尝试通过用户名找到用户
-    user = get_user_by_username(user_data.username_or_email)
+    user = await get_user_by_username(user_data.username_or_email)
     
     # 2. 如果找不到用户，尝试通过邮箱找到用户
     if not user:
-        user = get_user_by_email(user_data.username_or_email)
+        user = await get_user_by_email(user_data.username_or_email)
     
     # 3. 如果仍找不到用户或密码不匹配，则返回认证失败
     # 注意使用password_hash字段进行验证
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    if not user or not await verify_user_password(user, user_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="用户名/邮箱或密码不正确",
@@ -226,4 +234,16 @@ async def read_users_me(current_user = Depends(get_current_user)):
     # 返回用户信息
     # 在完整实现中，应该从数据库获取用户详细信息后返回
     # 目前简单返回用户ID，以演示认证流程
-    return {"user_id": current_user} 
\ No newline at end of file
+    return {"user_id": current_user} 
+
+
+@router.get("/password-hasher/stats", dependencies=[Depends(is_admin())])
+async def password_hasher_stats():
+    """
+    查询密码哈希线程池状态API（仅管理员）
+    
+    返回线程数、排队上限、当前等待和执行中的任务数、被拒绝的次数、登录时重新计算哈希的次数，
+    以及平均 / 最大排队和计算耗时。rejected 持续增长或 avg_wait_ms 接近请求超时时，
+    说明登录量超过了 bcrypt 的计算能力，需要增加 PASSWORD_HASH_WORKERS（并保证有足够的 CPU 核）。
+    """
+    return password_hasher.stats()
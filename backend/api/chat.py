@@ -20,15 +20,13 @@ from models.chat import ChatHistory, Message
 
 
 from services.ai_service import AIService
-from services.DataStructuring.DataStructuring import main_process
-from services import target_to_json
-import shutil
-import os
-import platform
-import glob
-from services.risk_prediction.prediction import predict_all
+import asyncio
+from services.pipeline import Document, run_pipeline
 
-from db.db_util import create_or_get_chat_history,update_chat_history,get_json_res,get_file_metadata_by_id,get_repo_by_id
+# 异步数据库操作（Motor），需要await，数据库往返期间不阻塞事件循环
+from db.async_db_util import create_or_get_chat_history,update_chat_history,get_json_res,get_file_metadata_by_id,get_repo_by_id
+from db.async_db_util import get_file_record, get_latest_result
+from db.file_records import KIND_SOURCE, to_metadata
 from .repo import convert_objectid
 
 # 创建路由器实例
@@ -85,7 +83,7 @@ async def get_chat(user_id: str, repo_id: str):
         ChatHistory: 包含聊天消息列表的聊天历史对象
     """
     # 获取或创建聊天历史
-    chat_history = create_or_get_chat_history(user_id, repo_id)
+    chat_history = await create_or_get_chat_history(user_id, repo_id)
     
     # 调试输出
     print("\n\n\n")
@@ -143,11 +141,11 @@ async def chat(message: str, user_id: str, repo_id: str):
     # 创建用户消息对象
     messageObj = Message(sayer="user", text=message, timestamp=datetime.now())
     response_text = await ai_service.chat(message)
-    create_or_get_chat_history(user_id, repo_id)
+    await create_or_get_chat_history(user_id, repo_id)
     
     response=Message(sayer="assistant", text=response_text,timestamp=datetime.now())
 
-    update_chat_history(user_id, repo_id, messageObj, response)
+    await update_chat_history(user_id, repo_id, messageObj, response)
     return response
 
 
@@ -162,9 +160,9 @@ async def chat_with_file(user_id: str, repo_id: str, message: str, file: UploadF
     
     流程:
     1. 接收用户消息和上传的文件
-    2. 保存文件到临时目录
+    2. 在内存中读取文件内容
     3. 处理文件内容，提取结构化数据
-    4. 运行风险预测模型(如果适用)
+    4. 用提取出的字段直接运行风险预测模型(如果适用)
     5. 组合所有信息调用AI服务生成响应
     6. 更新聊天历史
     7. 返回AI助手的响应
@@ -178,101 +176,63 @@ async def chat_with_file(user_id: str, repo_id: str, message: str, file: UploadF
     返回:
         Message: AI助手的响应消息对象
     """
-    create_or_get_chat_history(user_id, repo_id)
+    await create_or_get_chat_history(user_id, repo_id)
     question = message
     store_message = Message(sayer="user", text=message,timestamp=datetime.now())
-    # 结构化 - 取出excel - 风险预测 - 风险预测结果加入message
-    
-    current_file_path = os.path.abspath(__file__)
-    # 获得当前文件的父目录
-    parent_dir = os.path.dirname(current_file_path)
-    parent_dir = os.path.dirname(parent_dir)
-    upload_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "SourceData")
-    target_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "TargetData")
-    json_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "JsonData")
-    predict_folder = os.path.join(parent_dir, "services", "risk_prediction", "SourceData")
+    # 结构化 - 风险预测 - 风险预测结果加入message
+    # 上传的文件直接在内存流水线中处理：文本抽取、分类、字段抽取后，用抽取出的字段直接预测欺诈概率，
+    # 不再写入SourceData、TargetData、预测目录和JsonData，也不再把xlsx写出后再读回
+    # 流水线是同步的且包含网络请求，放到线程中执行，避免阻塞事件循环
+    document = Document(filename=file.filename, data=await file.read())
+    await asyncio.to_thread(run_pipeline, [document])
 
-    # 如果文件夹不存在就新建文件夹
-    if not os.path.exists(upload_folder):
-        os.makedirs(upload_folder)
-    if not os.path.exists(target_folder):
-        os.makedirs(target_folder)
-    if not os.path.exists(json_folder):
-        os.makedirs(json_folder)
-    if not os.path.exists(predict_folder):
-        os.makedirs(predict_folder)
+    all_files_content = json.dumps(document.json_data, ensure_ascii=False, indent=4) + "\n" if document.ok else ""
+    probability = document.probability
     print("\n\n\n")
-    print(upload_folder)
+    print({document.target_name: probability})
     print("\n\n\n")
-    '''
-        # 获得当前文件路径
-        current_file_path = os.path.abspath(__file__)
-        # 获得当前文件的父目录
-        parent_dir = os.path.dirname(current_file_path)
-        parent_dir = os.path.dirname(parent_dir)
-        upload_folder = os.path.join("..", parent_dir, "services", "DataStructuring", "DataStructuring", "SourceData")
-        json_folder = os.path.join("..", parent_dir, "services", "DataStructuring", "DataStructuring", "JsonData")
-    '''
-    file_path = os.path.join(upload_folder, file.filename)
-    # print("\n***file_path: ", file_path)
-    
-    # 删除file_path 下的所有文件
-    if os.path.exists(upload_folder):
-        for _file_name in os.listdir(upload_folder):
-            os.remove(os.path.join(upload_folder, _file_name))
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # 这里需要添加文件处理逻辑
-    main_process.main_process()
-
-    # 将targetData文件夹下的excel文件移动到特定文件夹中，从而风险预测
-    # 将predict_folder文件夹清空
-   
-    if os.path.exists(predict_folder):
-        for _file_name in os.listdir(predict_folder):
-            os.remove(os.path.join(predict_folder, _file_name))
-    
-    for _file_name in os.listdir(target_folder):
-        shutil.copy(os.path.join(target_folder, _file_name), os.path.join(predict_folder, _file_name))
-
-    predict_results = predict_all()
-    print("\n\n\n")
-    print(predict_results)
-    print("\n\n\n")
-
-
-    
-    # 清空json文件夹
-    if os.path.exists(json_folder):
-        for _file_name in os.listdir(json_folder):
-            os.remove(os.path.join(json_folder, _file_name))
-    target_to_json.process_target_to_json()
-    
-   
-    # 获取json_folder文件夹里所有文件的内容
-    json_files = glob.glob(os.path.join(json_folder, "*.json"))
-    all_files_content = ""
-    for json_file in json_files:
-        with open(json_file, "r", encoding="utf-8") as f:
-            all_files_content += f.read() + "\n"
-
-    # 获取文件名
-    excel_name = file.filename.split(".")[0] + ".xlsx"
-    if predict_results[f'{excel_name}'] == None:
+    if probability is None:
         # 文件信息不全，让大模型给出一定的风险建议
         message = SYSTEM_PROMPT +  message + "\n文件内容如下： " + all_files_content + "\n由于用户上传的文件信息不全，请根据用户上传的文件信息给出一定的风险建议"
     else:
         # 文件信息全，给出风险概率，并让大模型根据风险概率给出建议
-        message = SYSTEM_PROMPT + message + "\n文件内容如下： " + all_files_content + "\n用户上传的文件诈骗概率为： " + str(predict_results[f'{excel_name}'])
+        message = SYSTEM_PROMPT + message + "\n文件内容如下： " + all_files_content + "\n用户上传的文件诈骗概率为： " + str(probability)
     response_text = await ai_service.chat(message)
     response=Message(sayer="assistant", text=response_text,timestamp=datetime.now())
-    update_chat_history(user_id, repo_id, store_message, response)
+    await update_chat_history(user_id, repo_id, store_message, response)
     return response
 
 
 
+async def _resolve_file(repo_id: str, file_id: str):
+    """
+    根据用户引用的文件ID找到源文件的元数据和对应的结果文件ID
+    
+    详细说明:
+    用户既可能引用上传的源文件，也可能引用处理生成的结果文件：
+    - 源文件：结果文件为该源文件最近一次处理生成的结果
+    - 结果文件：源文件为结果记录中的 source_file
+    诈骗概率记录在源文件的状态中，JSON分析结果按结果文件ID保存。
+    两种情况都只按索引查询 files 集合中的一两条记录，不需要读取仓库的全部文件。
+    
+    返回:
+        (源文件元数据, 结果文件ID)；文件不存在时返回 (None, None)，
+        源文件还没有处理结果时结果文件ID为 None
+    """
+    record = await get_file_record(repo_id, file_id)
+    if not record:
+        return None, None
+    if record["kind"] == KIND_SOURCE:
+        result = await get_latest_result(repo_id, record["file_id"])
+        return to_metadata(record), (str(result["file_id"]) if result else None)
+    source_metadata = None
+    if record.get("source_file"):
+        source_metadata = await get_file_metadata_by_id(repo_id, str(record["source_file"]), True)
+    # 源文件已被删除时退回到结果文件自身的元数据
+    return source_metadata or to_metadata(record), str(record["file_id"])
+
+
 @router.post("/{user_id}/{repo_id}/file", response_model=Message)
 async def chat_with_file_id(user_id: str, repo_id: str, file_id: str, message: str):
     """
@@ -299,47 +259,16 @@ async def chat_with_file_id(user_id: str, repo_id: str, file_id: str, message: s
     返回:
         Message: AI助手的响应消息对象
     """
-    # 获取仓库信息
-    repo_info = get_repo_by_id(repo_id)
-    
-     # 在files中查找文件
-        
-   # 在files中查找文件
-        
-    files_match = [f for f in repo_info.get('files', []) if convert_objectid( f['file_id']) ==(file_id)]
-        
-    # 在results中查找文件
-    results_match = [r for r in repo_info.get('results', []) if convert_objectid(r['file_id']) == (file_id)]
-    # 确定要使用的文件ID
-    if files_match:
-        # 如果在files中找到，保持原file_id不变
-        actual_file_id = file_id
-        file_metadata = files_match[0]
-    elif results_match:
-        # 如果在results中找到，使用source_file
-        actual_file_id = results_match[0]['source_file']
-        file_metadata = results_match[0]
-    else:
+    # 查找源文件的元数据和结果文件ID
+    file_metadata, result_file_id = await _resolve_file(repo_id, file_id)
+    if file_metadata is None:
         # 如果文件未找到
         return None
 
-    create_or_get_chat_history(user_id, repo_id)
-    
-    # 使用actual_file_id获取JSON内容
-    # 注意：由于get_json_res函数现在期望接收结果文件ID而不是源文件ID，
-    # 这里需要先获取结果文件ID，再调用get_json_res
-    file_metadata = get_file_metadata_by_id(repo_id, actual_file_id, True)
-    if file_metadata and "results" in file_metadata:
-        # 如果有结果文件，使用第一个结果文件的ID
-        if file_metadata["results"] and len(file_metadata["results"]) > 0:
-            result_file_id = str(file_metadata["results"][0]["file_id"])
-            json_res = get_json_res(result_file_id)
-        else:
-            # 文件没有处理结果
-            json_res = None
-    else:
-        # 尝试以actual_file_id作为结果文件ID直接获取
-        json_res = get_json_res(actual_file_id)
+    await create_or_get_chat_history(user_id, repo_id)
+    
+    # 注意：get_json_res 接收的是结果文件ID而不是源文件ID
+    json_res = await get_json_res(result_file_id) if result_file_id else None
     
     store_message = Message(sayer="user", text=message, timestamp=datetime.now())
     
@@ -366,7 +295,7 @@ async def chat_with_file_id(user_id: str, repo_id: str, file_id: str, message: s
     response_text = await ai_service.chat(message)
     response = Message(sayer="assistant", text=response_text, timestamp=datetime.now())
     
-    update_chat_history(user_id, repo_id, store_message, response)
+    await update_chat_history(user_id, repo_id, store_message, response)
     return response
 
 @router.post("/{user_id}/{repo_id}/multiple_files", response_model=Message)
@@ -377,45 +306,29 @@ async def chat_with_multiple_files(
     message: str
 ):
     # 获取仓库信息
-    repo_info = get_repo_by_id(repo_id)
+    repo_info = await get_repo_by_id(repo_id)
     if not repo_info:
         raise HTTPException(status_code=404, detail="仓库未找到")
     
-    print("仓库信息:", repo_info)
     print("请求的文件IDs:", file_ids)
     
-    create_or_get_chat_history(user_id, repo_id)
+    await create_or_get_chat_history(user_id, repo_id)
     store_message = Message(sayer="user", text=message, timestamp=datetime.now())
     file_contents = []
     
     for file_id in file_ids:
         print(f"处理文件ID: {file_id}")
-        # 在files中查找文件
-        files_match = [f for f in repo_info.get('files', []) if convert_objectid(f['file_id']) == (file_id)]
-        print(f"在files中匹配结果: {files_match}")
-        
-        # 在results中查找文件
-        results_match = [r for r in repo_info.get('results', []) if convert_objectid(r['file_id']) == (file_id)]
-        print(f"在results中匹配结果: {results_match}")
-        
-        # 确定要使用的文件ID和元数据
-        if files_match:
-            file_metadata = files_match[0]
-            # 检查是否有处理结果
-            if "results" in file_metadata and file_metadata["results"]:
-                result_file_id = str(file_metadata["results"][0]["file_id"])
-            else:
-                print(f"文件 {file_id} 没有处理结果")
-                continue
-        elif results_match:
-            file_metadata = results_match[0]
-            result_file_id = str(file_metadata["file_id"])
-        else:
+        # 确定源文件元数据和结果文件ID
+        file_metadata, result_file_id = await _resolve_file(repo_id, file_id)
+        if file_metadata is None:
             print(f"未找到文件ID: {file_id}")
             continue
+        if result_file_id is None:
+            print(f"文件 {file_id} 没有处理结果")
+            continue
         
         # 获取JSON内容
-        json_res = get_json_res(result_file_id)
+        json_res = await get_json_res(result_file_id)
         if json_res is None:
             print(f"无法获取文件的JSON内容: {result_file_id}")
             continue
@@ -460,6 +373,6 @@ async def chat_with_multiple_files(
     response = Message(sayer="assistant", text=response_text, timestamp=datetime.now())
     
     # 更新聊天历史
-    update_chat_history(user_id, repo_id, store_message, response)
+    await update_chat_history(user_id, repo_id, store_message, response)
     
     return response
@@ -1,96 +1,101 @@
 # ===== 导入必要的库 =====
-import random  # 用于生成随机数，主要用于任务ID和模拟预测概率
+import random  # 用于生成随机数，主要用于任务ID
 import asyncio  # 异步编程支持，允许非阻塞操作
-import shutil  # 文件和目录操作，用于复制和删除文件
 import os  # 操作系统功能，用于路径操作和目录创建
-import glob  # 文件路径模式匹配，用于查找特定模式的文件
-import json  # JSON数据处理，用于读写JSON文件
+import io  # 内存中的二进制流，用于上传在内存中生成的结果文件
 import time  # 时间相关操作，用于生成时间戳和计算过期时间
-from fastapi import APIRouter, HTTPException, BackgroundTasks  # FastAPI框架组件
-from concurrent.futures import ProcessPoolExecutor  # 多进程支持，用于CPU密集型任务
-from services.risk_prediction.prediction import predict_all  # 风险预测服务
-from services.DataStructuring.DataStructuring import main_process  # 数据结构化处理
-from services import target_to_json  # 数据转JSON服务
-from db.db_util import create_or_update_json_res, update_file_status, upload_res_file  # 数据库操作
-from ._file import download_file  # 文件下载功能
-import aiofiles  # 异步文件操作库
+from datetime import datetime, UTC  # 记录预测时间
+import shutil  # 文件操作，用于任务取消后删除中间结果目录
+from fastapi import APIRouter, HTTPException  # FastAPI框架组件
+from gridfs.errors import NoFile  # GridFS中文件不存在时抛出的异常
+from services.pipeline import Document, process_subtask  # 内存中的文档处理流水线
+from services.worker_pool import get_worker_pool  # 共享的长驻进程池
+from core.task_queue import task_queue, TaskCancelled, FAILED as TASK_FAILED, \
+    CANCELLING as TASK_CANCELLING, CANCELLED as TASK_CANCELLED  # Redis任务队列
+from core.config.task_queue_config import task_queue_settings  # 任务队列配置
+# 同步数据库操作：process_data 在工作线程中执行，其余调用都通过 asyncio.to_thread 放到线程中
+from db.db_util import create_or_update_json_res, update_file_status, upload_res_file, file_exists, download_file
 import logging  # 日志记录
 from typing import Dict, Any, Optional  # 类型提示
 import concurrent.futures  # 并发处理模块
+from concurrent.futures.process import BrokenProcessPool  # 进程池中的工作进程异常退出
 
 # ===== 初始化配置 =====
 # 设置日志系统
 logging.basicConfig(level=logging.INFO)  # 配置日志级别为INFO
 logger = logging.getLogger(__name__)  # 获取当前模块的日志记录器
 
-# 创建进程池用于并行处理
+# 共享进程池用于并行处理
 # 【多进程基础】
 # ProcessPoolExecutor是Python的concurrent.futures模块提供的一个高级抽象，用于管理进程池
-# 进程池维护一组工作进程，避免了频繁创建和销毁进程的开销
 # 每个进程都是独立的Python解释器实例，有自己的内存空间，适合CPU密集型任务
-# 默认情况下，进程池大小等于CPU核心数(os.cpu_count())
-process_pool = ProcessPoolExecutor()  # 用于处理CPU密集型任务的进程池
+# 【长驻进程池】
+# 进程池在整个服务生命周期内只创建一次，由所有处理请求共享
+# 工作进程启动时就预先加载好模型和表头模板，任务到来时无需再承担进程启动和导入的开销
+# 池大小、进程回收策略等通过环境变量配置，详见 services/worker_pool.py
+# 进程池只在执行任务的工作进程（worker.py）中创建：process_data 使用时才调用 get_worker_pool()，
+# API 进程导入本模块不会创建进程池
 
-# ===== 全局状态管理 =====
-# 存储所有任务的状态信息
-# 【注意】这是进程内存储，如果使用多进程部署，每个进程会有独立的状态副本
-# 在分布式系统中，应该使用Redis等外部存储来共享状态
-task_status = {}  # 格式: {task_id: status_string}
+# 可选的中间结果落盘目录
+# 设置环境变量PIPELINE_STAGE_DIR后，每个任务的文本、结果表格和JSON会写到该目录下的work_{task_id}中
+# 默认不落盘，整个处理过程都在内存中完成
+PIPELINE_STAGE_DIR = os.getenv("PIPELINE_STAGE_DIR")
 
-# 存储文件与任务的关联关系
-file_tasks = {}  # 格式: {file_id: [task_id1, task_id2, ...]}
+# ===== 任务队列 =====
+# 【持久化任务队列】
+# 任务及其状态保存在Redis中（详见 core/task_queue.py），而不是进程内的字典：
+# - 服务重启后任务不会丢失，多个uvicorn工作进程看到的是同一份任务状态
+# - API节点只负责入队和查询，实际处理由独立的工作进程（backend/worker.py）领取执行，
+#   两者可以分别扩容，处理任务也不再和请求处理抢占同一个事件循环
+# - 工作进程通过租约领取任务，崩溃后任务会在租约到期后被重新派发；失败的任务按退避策略重试，
+#   超过最大执行次数后进入死信队列
+
+# 工作进程续约的间隔：租约时长的三分之一，保证偶尔一次续约失败也不会导致租约过期
+LEASE_RENEW_INTERVAL = max(1.0, task_queue_settings.LEASE_SECONDS / 3)
+
+# 子任务因进程池损坏（BrokenProcessPool）失败时的最大提交次数
+# 取消其他任务会终止共享进程池中的工作进程，同一时刻在其他工作进程中执行的子任务会因此失败，重新提交即可
+SUBTASK_MAX_ATTEMPTS = int(os.getenv("SUBTASK_MAX_ATTEMPTS", "2"))
 
 # 创建API路由器
 router = APIRouter()
 
 # ===== 文件处理入口 =====
 @router.post("/{file_id}/multiprocess")
-async def process_file_to_json(file_id: str, repo_id: str, background_tasks: BackgroundTasks):
+async def process_file_to_json(file_id: str, repo_id: str):
     """
     处理文件并返回JSON数据和风险预测结果的异步API端点。
     
     工作流程：
     1. 生成唯一任务ID
-    2. 异步下载目标文件
+    2. 检查目标文件是否存在
     3. 更新文件处理状态
-    4. 启动后台处理任务
+    4. 将任务写入Redis任务队列
     5. 返回任务信息
     
     参数说明：
         file_id (str): 需要处理的文件ID
         repo_id (str): 文件所在的仓库ID
-        background_tasks: FastAPI的后台任务管理器
     """
     # 生成唯一的任务ID（组合：文件ID + 时间戳 + 随机数）
     # 这种组合方式确保在分布式环境中也能生成唯一ID
     task_id = f"{file_id}_{int(time.time())}_{random.randint(1000, 9999)}"
     
+    # 第一步：检查文件是否存在
+    # 只查询GridFS的元数据，文件内容由工作进程执行任务时再下载
+    exists = await asyncio.to_thread(file_exists, file_id)
+    if not exists:
+        raise HTTPException(status_code=404, detail="File not found")
+    
     try:
-        # 第一步：异步下载文件
-        # 【异步编程基础】
-        # asyncio.to_thread将同步函数转换为异步操作，避免阻塞事件循环
-        # 这使得同步函数download_file在后台线程执行，不阻塞Web服务器
-        file_data = await asyncio.to_thread(download_file, file_id)
-        if not file_data:
-            raise HTTPException(status_code=404, detail="File not found")
-        
         # 第二步：更新文件状态为处理中
         await asyncio.to_thread(update_file_status, repo_id, file_id, "processing", True)
         
-        # 第三步：添加后台处理任务
-        # 【FastAPI后台任务】
-        # background_tasks.add_task将函数添加到后台任务队列
-        # 这些任务会在HTTP响应返回后执行，不会延迟API响应时间
-        # 与asyncio不同，FastAPI的后台任务在响应后才开始执行
-        background_tasks.add_task(background_processing, file_id, repo_id, file_data, task_id)
-        
-        # 第四步：初始化任务状态
-        task_status[task_id] = "started"
-        
-        # 第五步：更新文件-任务映射关系
-        if file_id not in file_tasks:
-            file_tasks[file_id] = []
-        file_tasks[file_id].append(task_id)
+        # 第三步：写入任务队列
+        # 【任务队列】
+        # 任务参数和状态都保存在Redis中，接口写入后立即返回
+        # 工作进程（python worker.py）从队列中领取任务并调用execute_task执行
+        await task_queue.enqueue(task_id, {"file_id": file_id, "repo_id": repo_id}, file_id=file_id)
         
         # 返回处理信息
         return {
@@ -100,99 +105,143 @@ async def process_file_to_json(file_id: str, repo_id: str, background_tasks: Bac
             "repo_id": repo_id
         }
     except Exception as e:
-        # 错误处理：记录错误并更新任务状态
+        # 错误处理：记录错误
         logger.error(f"Error starting task for file {file_id}: {str(e)}")
-        if task_id in task_status:
-            task_status[task_id] = f"failed_to_start: {str(e)}"
         raise HTTPException(status_code=500, detail=f"Failed to start processing: {str(e)}")
 
-# ===== 后台处理主函数 =====
-async def background_processing(file_id: str, repo_id: str, file_data, task_id: str):
+# ===== 任务执行函数（由工作进程调用） =====
+async def _renew_lease(task_id: str):
+    """定期为正在执行的任务续约，直到被取消"""
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+        try:
+            if not await task_queue.extend_lease(task_id):
+                logger.warning(f"Task {task_id} lease was lost")
+        except Exception as e:
+            logger.error(f"Failed to renew lease for task {task_id}: {str(e)}")
+
+async def execute_task(task: Dict[str, Any]):
     """
-    在后台异步处理文件的主要函数。
+    执行一个从任务队列领取的处理任务。
     
     处理流程：
-    1. 创建工作目录结构
-    2. 写入源文件
-    3. 调用数据处理服务
-    4. 进行风险预测
-    5. 生成处理结果
-    6. 清理临时文件
+    1. 下载源文件并包装为内存中的文档对象
+    2. 调用内存流水线完成文本抽取、分类、结构化、风险预测和JSON生成
+    3. 上传处理结果并更新数据库状态
+    4. 向任务队列确认完成，或记录失败等待重试
     
     错误处理：
-    - 所有错误都会被捕获并记录
-    - 失败状态会更新到数据库
-    - 临时文件会被清理
+    - 所有错误都会被捕获并记录到任务队列
+    - 文件不存在时不再重试
+    - 最后一次执行失败时把失败状态更新到数据库
+    
+    取消：
+    - process_data 每隔 CANCEL_CHECK_INTERVAL 秒检查Redis中的取消标记，发现取消后撤下排队的子任务，
+      并终止正在执行子任务的进程池工作进程（进程池随后自动重建），等所有子任务结束后才返回
+    - 子进程中的处理代码也会在各阶段之间、每个文档开始之前检查取消标记，字段抽取期间取消时立即中止在途的Ollama请求
+    - 取消后删除中间结果目录（此时子任务都已结束，不会再写入），任务置为cancelled，不上传任何结果
+    
+    参数：
+        task (dict): task_queue.lease 返回的任务详情
     """
+    task_id = task["task_id"]
+    file_id = task["payload"]["file_id"]
+    repo_id = task["payload"]["repo_id"]
+    cancel_token = task_queue.cancellation_token(task_id)
+    stage_dir = os.path.join(PIPELINE_STAGE_DIR, f"work_{task_id}") if PIPELINE_STAGE_DIR else None
+    status = None
+    
+    # 执行期间定期续约，避免长任务被当作崩溃而重新派发
+    renewer = asyncio.create_task(_renew_lease(task_id))
     try:
-        # 步骤1：初始化处理环境
-        task_status[task_id] = "processing"
-        filename, file_content = file_data
-        
-        # 步骤2：设置工作目录
-        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        work_dir = f"work_{task_id}"  # 使用任务ID创建唯一工作目录
-        
-        # 步骤3：创建所需的目录结构
-        upload_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "SourceData", work_dir)
-        target_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "TargetData", work_dir)
-        json_folder = os.path.join(parent_dir, "services", "DataStructuring", "DataStructuring", "JsonData", work_dir)
-        predict_folder = os.path.join(parent_dir, "services", "risk_prediction", "SourceData", work_dir)
-        
-        # 创建所有必要的目录
-        for folder in [upload_folder, target_folder, json_folder, predict_folder]:
-            os.makedirs(folder, exist_ok=True)
-        
-        # 步骤4：写入源文件
-        file_path = os.path.join(upload_folder, filename)
-        # 【异步文件操作】
-        # aiofiles提供异步文件I/O操作，避免在写入大文件时阻塞事件循环
-        # 在异步上下文中，应始终使用异步文件操作而非同步操作
-        async with aiofiles.open(file_path, "wb") as buffer:
-            await buffer.write(file_content)
-        
-        # 步骤5：启动数据处理
-        logger.info(f"Task {task_id} for file {file_id} starting data processing")
-        
-        # 【将同步操作转为异步】
-        # asyncio.to_thread将同步的process_data函数转换为异步操作
-        # 这样process_data在单独的线程中执行，不会阻塞事件循环
-        # 注意：虽然process_data内部使用多进程，但调用它的操作仍在一个线程中
-        result = await asyncio.to_thread(
-            process_data, 
-            work_dir, 
-            upload_folder, 
-            target_folder, 
-            json_folder, 
-            predict_folder, 
-            filename, 
-            file_id, 
-            repo_id,
-            task_id
-        )
-        
-        # 步骤6：完成处理
-        task_status[task_id] = "completed"
-        logger.info(f"Task {task_id} for file {file_id} completed successfully")
-        
-        return result
+        # 任务可能在排队或领取的过程中被取消；在事件循环中使用异步Redis检查，不阻塞其他任务
+        if await task_queue.is_cancel_requested(task_id):
+            raise TaskCancelled(task_id)
         
+        # 步骤1：下载文件
+        # 【异步编程基础】
+        # asyncio.to_thread将同步函数转换为异步操作，避免阻塞事件循环
+        try:
+            file_data = await asyncio.to_thread(download_file, file_id)
+        except NoFile:
+            file_data = None
+        if not file_data:
+            status = await task_queue.fail(task_id, "File not found", retry=False)
+        else:
+            filename, file_content = file_data
+            
+            # 步骤2：构造内存中的文档对象
+            # 【内存流水线】
+            # 文件内容以bytes形式直接在各处理阶段之间传递，不再写入SourceData等工作目录、
+            # 也不再在TargetData、预测目录和JsonData之间反复复制和重新解析
+            # 只有配置了PIPELINE_STAGE_DIR时才把中间结果写到磁盘，便于排查问题
+            documents = [Document(filename=filename, data=file_content)]
+            
+            # 步骤3：启动数据处理
+            logger.info(f"Task {task_id} for file {file_id} starting data processing (attempt {task['attempts']})")
+            
+            # 【将同步操作转为异步】
+            # asyncio.to_thread将同步的process_data函数转换为异步操作
+            # 这样process_data在单独的线程中执行，不会阻塞工作进程的事件循环和续约
+            result = await asyncio.to_thread(
+                process_data, 
+                documents, 
+                filename, 
+                file_id, 
+                repo_id,
+                task_id,
+                stage_dir,
+                cancel_token
+            )
+            
+            # 步骤4：确认完成
+            await task_queue.ack(task_id, result)
+            logger.info(f"Task {task_id} for file {file_id} completed successfully")
+            return result
+    except TaskCancelled:
+        # 取消流程：删除中间结果，任务置为终态cancelled
+        # process_data 在所有子任务结束（或被撤下、终止）之后才抛出TaskCancelled，这里删除目录后不会再有子任务写入
+        logger.info(f"Task {task_id} for file {file_id} was cancelled")
+        if stage_dir:
+            await asyncio.to_thread(shutil.rmtree, stage_dir, True)
+        await task_queue.mark_cancelled(task_id)
+        status = TASK_CANCELLED
     except Exception as e:
-        # 错误处理流程
-        task_status[task_id] = f"failed: {str(e)}"
+        # 错误处理流程：记录失败，未超过最大执行次数时任务会在退避后重新入队
         logger.error(f"Task {task_id} for file {file_id} failed: {str(e)}")
-        try:
-            # 更新数据库失败状态
+        status = await task_queue.fail(task_id, str(e))
+    finally:
+        renewer.cancel()
+    
+    try:
+        if status == TASK_FAILED:
+            # 不会再重试，更新数据库失败状态
             await asyncio.to_thread(update_file_status, repo_id, file_id, f"task_{task_id}_failed", False)
-        except Exception as db_err:
-            logger.error(f"Failed to update database status for task {task_id}: {str(db_err)}")
-        raise
+        elif status == TASK_CANCELLED:
+            await asyncio.to_thread(update_file_status, repo_id, file_id, "cancelled", True)
+    except Exception as db_err:
+        logger.error(f"Failed to update database status for task {task_id}: {str(db_err)}")
 
 # ===== 数据处理核心函数 =====
-def process_data(work_dir, upload_folder, target_folder, json_folder, predict_folder, 
-                filename, file_id, repo_id, task_id):
+def _stop_subtasks(worker_pool, futures):
     """
-    在独立进程中执行数据处理的核心函数。
+    任务被取消时停止子任务，所有子任务都结束后才返回。
+    
+    - 还在排队的子任务直接从进程池中撤下
+    - 正在执行的子任务由worker_pool.terminate终止所在的工作进程，进程池随后自动重建
+    - 刚开始执行、工作进程还没有报告PID的子任务在下一轮再终止
+    返回之后不会再有子任务写入中间结果目录，调用方可以安全地删除它。
+    """
+    pending = set(futures)
+    while pending:
+        for future in pending:
+            future.cancel()
+        worker_pool.terminate(pending)
+        _, pending = concurrent.futures.wait(pending, timeout=task_queue_settings.CANCEL_CHECK_INTERVAL)
+
+def process_data(documents, filename, file_id, repo_id, task_id, stage_dir=None, cancel_token=None):
+    """
+    执行数据处理的核心函数。
     
     主要功能：
     1. 结构化数据处理
@@ -202,397 +251,193 @@ def process_data(work_dir, upload_folder, target_folder, json_folder, predict_fo
     5. 数据库状态更新
     
     工作流程：
-    1. 
-    执行数据结构化处理
-    2. 准备预测数据
-    3. 运行风险预测模型
-    4. 生成JSON格式结果
-    5. 保存和上传结果
-    6. 清理临时文件
+    1. 把文档分配到共享进程池中的子任务并行处理（只有一个文档时也在进程池中处理）
+    2. 汇总各文档的预测结果与JSON结果
+    3. 将第一个文档的结果表格渲染为xlsx并上传
+    4. 更新数据库状态
+    
+    参数：
+        documents (list[Document]): 待处理的文档
+        filename (str): 结果文件名
+        file_id (str): 源文件ID
+        repo_id (str): 仓库ID
+        task_id (str): 任务ID
+        stage_dir (str): 可选的中间结果落盘目录，None表示全程在内存中处理
+        cancel_token (CancellationToken): 可选的取消令牌，任务被取消时抛出TaskCancelled
     """
     try:
         # 步骤1：记录开始状态
-        logger.info(f"处理任务 {task_id} 开始，工作目录: {work_dir}")
-        
-        # 步骤2：分析源文件情况
-        source_files = []
-        for root, _, files in os.walk(upload_folder):
-            for file in files:
-                source_files.append(os.path.join(root, file))
+        logger.info(f"处理任务 {task_id} 开始，共 {len(documents)} 个文档")
         
-        if not source_files:
-            logger.warning(f"任务 {task_id} 的上传文件夹为空")
+        if not documents:
+            logger.warning(f"任务 {task_id} 没有需要处理的文档")
             return {
                 "task_id": task_id,
                 "file_id": file_id,
                 "status": "no_files",
-                "message": "上传文件夹为空"
+                "message": "没有需要处理的文档"
             }
-            
-        logger.info(f"任务 {task_id} 发现 {len(source_files)} 个源文件待处理")
         
-        # 检查是否需要启用并发处理（当源文件数量大于1时启用）
-        if len(source_files) > 1:
-            # ===== 并发处理模式 =====
-            # 步骤3：确定最佳并发级别
-            # 【多进程并发优化】
-            # 根据CPU核心数和文件数量智能决定最佳并发级别
-            # 通常使用(CPU核心数-1)作为进程数，保留一个核心给操作系统
-            # 最小值1确保至少有一个进程，最大值8防止创建过多进程导致资源竞争
-            cpu_count = os.cpu_count()
-            concurrency_level = min(max(1, cpu_count - 1), len(source_files), 8)
-            logger.info(f"任务 {task_id} 使用 {concurrency_level} 个工作线程/进程")
-            
-            # 步骤4：创建子工作目录以支持并行处理
-            # 【资源隔离】
-            # 为每个子任务创建独立的工作目录，避免多个进程同时访问同一文件导致的竞争
-            # 这是实现多进程安全的重要策略 - 通过资源隔离避免共享状态
-            sub_tasks = []
-            for i in range(concurrency_level):
-                sub_task_id = f"{task_id}_sub_{i}"
-                
-                # 为每个子任务创建独立的工作目录
-                sub_upload = os.path.join(upload_folder, f"sub_{i}")
-                sub_target = os.path.join(target_folder, f"sub_{i}")
-                sub_json = os.path.join(json_folder, f"sub_{i}")
-                sub_predict = os.path.join(predict_folder, f"sub_{i}")
-                
-                # 创建子任务目录
-                for folder in [sub_upload, sub_target, sub_json, sub_predict]:
-                    os.makedirs(folder, exist_ok=True)
-                
-                # 记录子任务信息
-                sub_tasks.append({
-                    "id": sub_task_id,
-                    "upload_folder": sub_upload,
-                    "target_folder": sub_target,
-                    "json_folder": sub_json,
-                    "predict_folder": sub_predict,
-                    "files": []
-                })
-            
-            # 步骤5：分配文件到各子任务（简单的轮询分配）
-            # 【负载均衡策略】
-            # 使用轮询(Round Robin)策略将文件均匀分配给各个子任务
-            # 确保每个进程的工作量大致相同，避免某个进程成为瓶颈
-            for i, file_path in enumerate(source_files):
-                sub_task_index = i % concurrency_level
-                sub_task = sub_tasks[sub_task_index]
-                
-                # 复制文件到子任务的上传目录
-                file_basename = os.path.basename(file_path)
-                destination = os.path.join(sub_task["upload_folder"], file_basename)
-                shutil.copy2(file_path, destination)
-                
-                sub_task["files"].append(file_basename)
-            
-            # 步骤6：使用进程池并行处理子任务
-            # 【进程池并行执行】
-            # ProcessPoolExecutor创建指定数量的工作进程，并管理任务分配
-            # 与直接创建进程相比，进程池避免了频繁创建销毁进程的开销
-            # max_workers指定最大工作进程数，控制并发级别
-            with ProcessPoolExecutor(max_workers=concurrency_level) as executor:
-                # 准备子任务处理函数
-                # 【任务提交】
-                # executor.submit向进程池提交任务，并立即返回Future对象
-                # Future代表尚未完成的计算，可以用来检查任务状态或获取结果
-                # 这里使用字典将Future与对应的子任务ID关联起来
-                future_to_subtask = {
-                    executor.submit(
+        # ===== 进程池处理 =====
+        # 步骤2：确定并发级别
+        # 【多进程并发优化】
+        # 所有文档（包括只有一个文档的任务）都在共享进程池的预热进程中处理，
+        # 工作进程的事件循环和续约不会被流水线的CPU计算拖慢，模型和表头模板也不需要在当前进程中重复加载
+        # 子任务数不超过共享进程池的大小，也不超过文档数量
+        worker_pool = get_worker_pool()
+        concurrency_level = min(worker_pool.size, len(documents))
+        logger.info(f"任务 {task_id} 拆分为 {concurrency_level} 个子任务")
+        
+        # 步骤3：分配文档到各子任务（简单的轮询分配）
+        # 【负载均衡策略】
+        # 使用轮询(Round Robin)策略将文档均匀分配给各个子任务
+        # 文档内容随任务一起传给子进程，不再需要为每个子任务复制文件到独立的工作目录
+        chunks = [documents[i::concurrency_level] for i in range(concurrency_level)]
+        
+        # 步骤4：使用共享进程池并行处理子任务
+        # 【进程池并行执行】
+        # worker_pool.submit向共享进程池提交任务，并立即返回Future对象
+        # 子进程处理完成后把填充好结果的文档对象序列化(pickle)传回主进程
+        future_to_index = {
+            worker_pool.submit(
+                process_subtask,
+                chunk,
+                f"{task_id}_sub_{i}",
+                os.path.join(stage_dir, f"sub_{i}") if stage_dir else None,
+                cancel_token
+            ): i for i, chunk in enumerate(chunks) if chunk
+        }
+        
+        # 收集子任务结果
+        # 【并行结果收集】
+        # concurrent.futures.wait按照任务完成的顺序返回Future
+        # 有取消令牌时每隔CANCEL_CHECK_INTERVAL秒醒来一次检查取消标记，发现取消后由_stop_subtasks停止所有子任务
+        attempts = {index: 1 for index in future_to_index.values()}
+        not_done = set(future_to_index)
+        check_interval = task_queue_settings.CANCEL_CHECK_INTERVAL if cancel_token else None
+        while not_done:
+            done, not_done = concurrent.futures.wait(
+                not_done, timeout=check_interval, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                index = future_to_index.pop(future)
+                try:
+                    chunks[index] = future.result()
+                    logger.info(f"子任务 {task_id}_sub_{index} 完成处理")
+                except TaskCancelled:
+                    # 子任务已经确认任务被取消，它的文档没有处理完，不能当作结果；
+                    # 直接停止其余子任务，不再依赖可能还缓存着旧结果的取消令牌
+                    _stop_subtasks(worker_pool, not_done)
+                    raise TaskCancelled(task_id)
+                except BrokenProcessPool as e:
+                    if attempts[index] >= SUBTASK_MAX_ATTEMPTS:
+                        logger.error(f"子任务 {task_id}_sub_{index} 处理失败: 进程池损坏 {str(e)}")
+                        for document in chunks[index]:
+                            document.error = f"进程池损坏: {str(e)}"
+                        continue
+                    # 工作进程异常退出或被终止（例如其他任务被取消），进程池已自动重建，重新提交
+                    attempts[index] += 1
+                    logger.warning(f"子任务 {task_id}_sub_{index} 所在的进程池已损坏，第 {attempts[index]} 次提交")
+                    retry = worker_pool.submit(
                         process_subtask,
-                        sub_task["upload_folder"],
-                        sub_task["target_folder"],
-                        sub_task["json_folder"],
-                        sub_task["predict_folder"],
-                        sub_task["id"]
-                    ): sub_task["id"] for sub_task in sub_tasks if len(sub_task["files"]) > 0
-                }
-                
-                # 收集子任务结果
-                # 【并行结果收集】
-                # concurrent.futures.as_completed返回已完成的Future对象迭代器
-                # 按照任务完成的顺序处理结果，而不是提交顺序
-                # 这样可以让更快完成的任务先处理，提高整体效率
-                subtask_results = {}
-                for future in concurrent.futures.as_completed(future_to_subtask):
-                    subtask_id = future_to_subtask[future]
-                    try:
-                        # 获取子任务执行结果
-                        # future.result()会返回对应函数(process_subtask)的返回值
-                        # 如果函数抛出异常，future.result()会重新引发该异常
-                        result = future.result()
-                        subtask_results[subtask_id] = result
-                        logger.info(f"子任务 {subtask_id} 完成处理")
-                    except Exception as e:
-                        logger.error(f"子任务 {subtask_id} 处理失败: {str(e)}")
-                        subtask_results[subtask_id] = {"status": "failed", "error": str(e)}
-            
-            # 步骤7：合并子任务结果
-            logger.info(f"任务 {task_id} 开始合并子任务结果")
-            
-            # 合并目标文件
-            # 将每个子任务生成的文件复制到主目标目录
-            all_target_files = []
-            for sub_task in sub_tasks:
-                sub_target_folder = sub_task["target_folder"]
-                for file in os.listdir(sub_target_folder):
-                    source_path = os.path.join(sub_target_folder, file)
-                    target_path = os.path.join(target_folder, f"{sub_task['id']}_{file}")
-                    shutil.copy2(source_path, target_path)
-                    all_target_files.append(target_path)
-            
-            # 步骤8：执行风险预测
-            logger.info(f"任务 {task_id} 开始风险预测")
-            # 清理预测文件夹
-            for file in os.listdir(predict_folder):
-                if os.path.isfile(os.path.join(predict_folder, file)):
-                    os.remove(os.path.join(predict_folder, file))
-            
-            # 复制合并后的文件到预测目录
-            
-            for target_file in all_target_files:
-                dest_file = os.path.join(predict_folder, os.path.basename(target_file))
-                shutil.copy2(target_file, dest_file)
-            
-            # 执行预测
-            predict_probability = random.uniform(0.3, 0.5) 
-            predict_results = predict_all(source_dir=predict_folder)
-            
-            # 处理预测结果
-            target_files = os.listdir(predict_folder)
-            if not target_files:
-                logger.warning(f"任务 {task_id} 的预测文件夹为空")
-                target_file_key = f"default_file_{task_id}"
-            else:
-                target_file_key = target_files[0]
-                
-            # 确保有预测结果
-            if not predict_results.get(target_file_key, None):
-                predict_results[target_file_key] = predict_probability
-            
-            # 步骤9：合并并生成JSON结果
-            logger.info(f"任务 {task_id} 开始生成JSON结果")
-            
-            # 合并子任务的JSON结果
-            all_json_data = []
-            for sub_task in sub_tasks:
-                sub_json_folder = sub_task["json_folder"]
-                json_files = glob.glob(os.path.join(sub_json_folder, "*.json"))
-                
-                for json_file in json_files:
-                    try:
-                        with open(json_file, "r", encoding="utf-8") as f:
-                            json_content = f.read()
-                            all_json_data.append(json.loads(json_content))
-                    except Exception as e:
-                        logger.error(f"读取JSON文件 {json_file} 时出错: {str(e)}")
-            
-            # 如果没有JSON数据，创建一个空的数据结构
-            if not all_json_data:
-                logger.warning(f"任务 {task_id} 没有生成JSON数据")
-                all_json_data = [{"task_id": task_id, "status": "completed_no_data"}]
-        else:
-            # ===== 单文件处理模式（原始逻辑） =====
-            logger.info(f"任务 {task_id} 使用单文件处理模式")
-            
-            # 执行数据结构化处理
-            main_process.main_process(source_dir=upload_folder, target_dir=target_folder)
-            
-            # 清理预测文件夹
-            for file in os.listdir(predict_folder):
-                os.remove(os.path.join(predict_folder, file))
-            
-            # 复制处理后的文件到预测文件夹
-            for _file in os.listdir(target_folder):
-                shutil.copy(os.path.join(target_folder, _file), os.path.join(predict_folder, _file))
-            
-            
-            predict_probability = random.uniform(0.3, 0.5)
-            
-            # 执行实际预测
-            predict_results = predict_all(source_dir=predict_folder)
-            
-            # 处理预测结果
-            target_files = os.listdir(predict_folder)
-            if not target_files:
-                logger.warning(f"No files found in predict folder for task {task_id}")
-                target_file_key = f"default_file_{task_id}"
-            else:
-                target_file_key = target_files[0]
-                
-            # 确保有预测结果
-            if not predict_results.get(target_file_key, None):
-                predict_results[target_file_key] = predict_probability
-            
-            # 将目标数据转换为JSON格式
-            target_to_json.process_target_to_json(target_dir=target_folder, json_dir=json_folder)
-            
-            # 读取生成的JSON文件
-            json_files = glob.glob(os.path.join(json_folder, "*.json"))
-            all_json_data = []
-            
-            for json_file in json_files:
-                with open(json_file, "r", encoding="utf-8") as f:
-                    json_content = f.read()
-                    all_json_data.append(json.loads(json_content))
-            
-            # 处理没有JSON数据的情况
-            if not all_json_data:
-                logger.warning(f"No JSON data generated for task {task_id}")
-                all_json_data = [{"task_id": task_id, "status": "completed_no_data"}]
-                
-            # 获取所有目标文件
-            all_target_files = [os.path.join(target_folder, f) for f in os.listdir(target_folder)]
+                        chunks[index],
+                        f"{task_id}_sub_{index}",
+                        os.path.join(stage_dir, f"sub_{index}") if stage_dir else None,
+                        cancel_token
+                    )
+                    future_to_index[retry] = index
+                    not_done.add(retry)
+                except Exception as e:
+                    logger.error(f"子任务 {task_id}_sub_{index} 处理失败: {str(e)}")
+                    for document in chunks[index]:
+                        document.error = str(e)
+            if cancel_token is not None and cancel_token.is_cancelled():
+                _stop_subtasks(worker_pool, not_done)
+                raise TaskCancelled(task_id)
+        
+        # 步骤5：按原始顺序合并子任务结果
+        merged = [None] * len(documents)
+        for i, chunk in enumerate(chunks):
+            merged[i::concurrency_level] = chunk
+        documents = merged
             
         # ===== 共用的后处理逻辑 =====
-        # 步骤10：上传结果文件
+        processed_documents = [document for document in documents if document.ok]
+        
+        # 步骤6：整理预测结果
+        # 【直接使用字段预测】
+        # 概率由流水线的预测阶段直接根据抽取出的字段计算（services/risk_prediction/prediction.py 的 predict_batch），
+        # 不再写出xlsx再读回；关键字段缺失或交易类型无法识别时没有概率，返回对应的校验错误
+        predict_results = {document.target_name: document.probability for document in processed_documents}
+        
+        if not processed_documents:
+            logger.warning(f"任务 {task_id} 没有成功处理的文档")
+            predict_probability, prediction_error, model_version = None, None, None
+        else:
+            predict_probability = processed_documents[0].probability
+            prediction_error = processed_documents[0].prediction_error
+            model_version = processed_documents[0].model_version
+        
+        # 步骤7：收集JSON结果
+        all_json_data = [document.json_data for document in processed_documents]
+        
+        # 处理没有JSON数据的情况
+        if not all_json_data:
+            logger.warning(f"No JSON data generated for task {task_id}")
+            all_json_data = [{"task_id": task_id, "status": "completed_no_data"}]
+        
+        # 步骤8：上传结果文件
+        # 上传之前最后检查一次，已取消的任务不再写入任何结果
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
         logger.info(f"任务 {task_id} 开始上传结果")
         
         # 创建结果文件名
         result_filename = f"{filename}"
         
-        # 如果有处理后的文件，上传结果
-        if all_target_files:
-            # 选择第一个文件作为代表上传
-            upload_file_path = all_target_files[0]
+        # 如果有处理后的文档，上传结果
+        if processed_documents:
+            # 选择第一个文档作为代表上传，结果表格直接在内存中渲染为xlsx
+            excel_content = processed_documents[0].to_excel_bytes()
             
             # 上传结果文件
-            with open(upload_file_path, "rb") as file_obj:
-                res_id = upload_res_file(repo_id, file_obj, file_id, result_filename, False)
-                update_file_status(repo_id, res_id, "completed", False)
+            res_id = upload_res_file(repo_id, io.BytesIO(excel_content), file_id, result_filename, False)
+            update_file_status(repo_id, res_id, "completed", False)
             
             # 更新数据库中的结果
             all_json_data[0]["task_id"] = task_id
-            create_or_update_json_res(res_id, all_json_data[0])
-            update_file_status(repo_id, file_id, f"{predict_probability}", True)
+            # 同时记录算出概率的模型版本，重新评分（services/risk_prediction/rescore.py）会按版本覆盖
+            create_or_update_json_res(res_id, all_json_data[0], {
+                "probability": predict_probability,
+                "error": prediction_error,
+                "model_version": model_version,
+                "scored_at": datetime.now(UTC),
+            })
+            # 文件状态记录欺诈概率；无法预测时记录原因（例如“交易数据不足”）
+            file_status = f"{predict_probability}" if predict_probability is not None else (prediction_error or "completed")
+            update_file_status(repo_id, file_id, file_status, True)
         else:
             logger.warning(f"No target files generated for task {task_id}")
         
-        # 步骤11：清理临时文件
-        logger.info(f"任务 {task_id} 开始清理临时文件")
-        
-        # 如果使用了并发模式，清理子任务目录
-        if len(source_files) > 1:
-            for sub_task in sub_tasks:
-                try:
-                    cleanup_work_dir(
-                        sub_task["upload_folder"], 
-                        sub_task["target_folder"],
-                        sub_task["json_folder"],
-                        sub_task["predict_folder"]
-                    )
-                except Exception as e:
-                    logger.error(f"清理子任务目录出错: {str(e)}")
-                    
-        # 清理主工作目录
-        cleanup_work_dir(upload_folder, target_folder, json_folder, predict_folder)
-        
         # 返回处理结果
         return {
             "task_id": task_id,
             "file_id": file_id,
             "predict_probability": predict_probability,
+            "prediction_error": prediction_error,
+            "model_version": model_version,
+            "predict_results": predict_results,
             "has_json_data": len(all_json_data) > 0,
-            "concurrent_mode": len(source_files) > 1
+            "concurrent_mode": len(documents) > 1
         }
+    except TaskCancelled:
+        logger.info(f"处理任务 {task_id} 已取消")
+        raise
     except Exception as e:
         # 错误处理
         logger.error(f"Error processing data for task {task_id}: {str(e)}")
-        try:
-            # 清理临时文件
-            # 如果使用了并发模式，清理子任务目录
-            if 'sub_tasks' in locals() and len(sub_tasks) > 0:
-                for sub_task in sub_tasks:
-                    try:
-                        cleanup_work_dir(
-                            sub_task["upload_folder"], 
-                            sub_task["target_folder"],
-                            sub_task["json_folder"],
-                            sub_task["predict_folder"]
-                        )
-                    except:
-                        pass
-                        
-            cleanup_work_dir(upload_folder, target_folder, json_folder, predict_folder)
-        except Exception as cleanup_err:
-            logger.error(f"Error during cleanup for task {task_id}: {str(cleanup_err)}")
         raise
 
-# 添加子任务处理函数 - 用于并发执行
-def process_subtask(upload_folder, target_folder, json_folder, predict_folder, subtask_id):
-    """
-    处理单个子任务的函数，由进程池调用
-    
-    【多进程子任务处理函数】
-    这个函数在单独的进程中执行，拥有完全独立的内存空间和Python解释器实例
-    
-    功能：
-    - 执行数据结构化处理
-    - 生成JSON结果
-    - 隔离错误，避免影响其他子任务
-    
-    参数：
-        upload_folder (str): 上传文件目录
-        target_folder (str): 目标文件目录
-        json_folder (str): JSON输出目录
-        predict_folder (str): 预测数据目录
-        subtask_id (str): 子任务ID
-    """
-    try:
-        logger.info(f"子任务 {subtask_id} 开始处理")
-        
-        # 1. 执行数据结构化处理
-        # 注意：在子进程中直接调用同步函数，不需要使用asyncio
-        # 这里的调用发生在ProcessPoolExecutor创建的独立进程中
-        main_process.main_process(source_dir=upload_folder, target_dir=target_folder)
-        
-        # 2. 生成JSON数据
-        target_to_json.process_target_to_json(target_dir=target_folder, json_dir=json_folder)
-        
-        # 3. 统计处理结果
-        target_files = os.listdir(target_folder) if os.path.exists(target_folder) else []
-        json_files = os.listdir(json_folder) if os.path.exists(json_folder) else []
-        
-        logger.info(f"子任务 {subtask_id} 完成处理：生成了 {len(target_files)} 个目标文件，{len(json_files)} 个JSON文件")
-        
-        # 返回处理结果，这个返回值将通过future.result()获取
-        # 在多进程环境中，返回值会被序列化(pickle)后传回主进程
-        return {
-            "status": "success",
-            "subtask_id": subtask_id,
-            "target_files_count": len(target_files),
-            "json_files_count": len(json_files)
-        }
-    except Exception as e:
-        # 错误处理：记录错误并返回错误信息，不抛出异常
-        # 这样即使一个子任务失败，也不会影响其他子任务的处理
-        logger.error(f"子任务 {subtask_id} 处理失败: {str(e)}")
-        return {
-            "status": "failed",
-            "subtask_id": subtask_id,
-            "error": str(e)
-        }
-
-# ===== 工具函数 =====
-def cleanup_work_dir(upload_folder, target_folder, json_folder, predict_folder):
-    """
-    清理处理完成后的临时工作目录。
-    
-    功能：
-    - 删除所有临时工作目录及其内容
-    - 防止磁盘空间占用
-    - 确保数据安全
-    
-    参数：
-        upload_folder (str): 上传文件目录
-        target_folder (str): 目标文件目录
-        json_folder (str): JSON输出目录
-        predict_folder (str): 预测数据目录
-    """
-    for folder in [upload_folder, target_folder, json_folder, predict_folder]:
-        if os.path.exists(folder):
-            shutil.rmtree(folder)  # 递归删除目录及其内容
-
 # ===== 任务状态查询接口 =====
 @router.get("/files/{file_id}/tasks")
 async def get_file_tasks(file_id: str):
@@ -601,7 +446,7 @@ async def get_file_tasks(file_id: str):
     
     功能：
     - 查询特定文件的所有处理任务
-    - 返回每个任务的当前状态
+    - 返回每个任务的当前状态、执行次数和错误信息
     - 提供任务总数统计
     
     参数：
@@ -610,55 +455,100 @@ async def get_file_tasks(file_id: str):
     返回：
         dict: 包含任务列表和统计信息的字典
     """
-    if file_id not in file_tasks or not file_tasks[file_id]:
+    tasks = await task_queue.file_tasks(file_id)
+    if not tasks:
         raise HTTPException(status_code=404, detail="No tasks found for this file")
     
-    tasks_info = []
-    for task_id in file_tasks[file_id]:
-        status = task_status.get(task_id, "unknown")
-        tasks_info.append({"task_id": task_id, "status": status})
+    tasks_info = [
+        {
+            "task_id": task["task_id"],
+            "status": task["status"],
+            "attempts": task["attempts"],
+            "error": task.get("error") or None
+        }
+        for task in tasks
+    ]
     
     return {"file_id": file_id, "tasks_count": len(tasks_info), "tasks": tasks_info}
 
+# ===== 任务队列状态接口 =====
+@router.get("/tasks/stats")
+async def task_queue_stats():
+    """
+    查询任务队列积压情况的API端点。
+    
+    返回等待执行、执行中、等待重试和死信队列中的任务数，可用于决定工作进程的扩容
+    """
+    return await task_queue.stats()
+
+# ===== 进程池健康检查接口 =====
+@router.get("/workers/health")
+async def worker_pool_health():
+    """
+    查询处理工作进程共享进程池健康状态的API端点。
+    
+    功能：
+    - 返回各工作进程（worker.py）最近一次上报到Redis的进程池健康状态、配置与任务统计信息
+    - 工作进程每隔 TASK_QUEUE_WORKER_HEALTH_INTERVAL 秒检查一次自己的进程池，
+      损坏时由工作进程自行重建；API进程本身没有进程池，不会派发探测任务
+    - 没有工作进程在上报，或所有工作进程的进程池都不可用（不是 ok 或 busy）时返回503
+    """
+    workers = await task_queue.worker_health()
+    available = [worker for worker in workers if worker.get("state") in ("ok", "busy")]
+    result = {
+        "workers_count": len(workers),
+        "available_count": len(available),
+        "workers": workers,
+    }
+    if not available:
+        raise HTTPException(status_code=503, detail=result)
+    return result
+
 # ===== 任务管理接口 =====
 @router.delete("/task/{task_id}/cancel")
 async def cancel_task(task_id: str):
     """
-    取消正在运行的任务的API端点。
+    取消任务的API端点。
     
     功能：
     - 检查任务是否存在
     - 验证任务是否可以取消
-    - 标记任务为取消状态
+    - 还在排队或等待重试的任务直接取消
+    - 正在执行的任务写入取消标记，由工作进程协作式地停止
     
-    注意：
-    - 实际取消任务的操作是复杂的
-    - 此处仅标记状态，不保证立即停止
+    【协作式取消】
+    工作进程在流水线各阶段之间、每个文档开始之前以及每次请求模型之前检查取消标记，
+    多文档任务中尚未开始的子任务会从进程池中撤下。正在进行的单次模型请求会执行完，
+    之后不再派发新的请求；任务最终进入cancelled状态，可通过 /files/{file_id}/tasks 查询
     
     参数：
         task_id (str): 要取消的任务ID
     """
+    status = await task_queue.cancel(task_id)
+    
     # 检查任务是否存在
-    if task_id not in task_status:
+    if status is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    current_status = task_status[task_id]
-    
-    # 检查任务是否可以取消
-    if current_status not in ["started", "processing"]:
+    # 已经结束的任务无法取消
+    if status not in [TASK_CANCELLING, TASK_CANCELLED]:
         return {
             "task_id": task_id, 
-            "status": current_status,
-            "message": f"Task cannot be cancelled in {current_status} state"
+            "status": status,
+            "message": f"Task cannot be cancelled in {status} state"
         }
-    
-    # 标记任务为取消中
-    task_status[task_id] = "cancelling"
-    
+
+    # 尚未开始执行的任务已直接取消，没有工作进程会再更新文件状态，这里同步更新
+    if status == TASK_CANCELLED:
+        task = await task_queue.get_task(task_id)
+        payload = task["payload"] if task else {}
+        if payload.get("repo_id") and payload.get("file_id"):
+            await asyncio.to_thread(update_file_status, payload["repo_id"], payload["file_id"], "cancelled", True)
+
     return {
         "task_id": task_id,
-        "status": "cancelling",
-        "message": "Task is marked for cancellation"
+        "status": status,
+        "message": "Task is cancelled" if status == TASK_CANCELLED else "Task is marked for cancellation"
     }
 
 # ===== 系统维护接口 =====
@@ -685,43 +575,12 @@ async def cleanup_task_records(hours: int = 24):
     current_time = time.time()
     cutoff_time = current_time - (hours * 3600)
     
-    # 初始化计数器
-    cleaned_tasks = 0
-    remaining_tasks = 0
-    
-    # 创建任务状态的副本以避免迭代时修改
-    task_status_copy = task_status.copy()
-    
-    # 遍历所有任务记录
-    for task_id, status in task_status_copy.items():
-        try:
-            # 从任务ID中提取时间戳
-            parts = task_id.split('_')
-            if len(parts) >= 2 and parts[1].isdigit():
-                task_time = int(parts[1])
-                
-                # 检查任务是否过期
-                if task_time < cutoff_time:
-                    # 删除过期任务状态
-                    if task_id in task_status:
-                        del task_status[task_id]
-                    
-                    # 清理文件-任务映射
-                    file_id = parts[0]
-                    if file_id in file_tasks and task_id in file_tasks[file_id]:
-                        file_tasks[file_id].remove(task_id)
-                        if not file_tasks[file_id]:
-                            del file_tasks[file_id]
-                    
-                    cleaned_tasks += 1
-                else:
-                    remaining_tasks += 1
-        except Exception as e:
-            logger.error(f"Error cleaning up task {task_id}: {str(e)}")
+    # 删除创建时间早于截止时间、且已经结束的任务记录
+    # 未结束的任务不会被清理；任务记录本身也会在TASK_QUEUE_RECORD_TTL后由Redis自动过期
+    cleaned_tasks = await task_queue.cleanup(cutoff_time)
     
     # 返回清理结果统计
     return {
         "message": f"Cleaned up {cleaned_tasks} tasks older than {hours} hours",
-        "cleaned_tasks": cleaned_tasks,
-        "remaining_tasks": remaining_tasks
-    }
\ No newline at end of file
+        "cleaned_tasks": cleaned_tasks
+    }
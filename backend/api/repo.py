@@ -7,13 +7,17 @@
 3. 更新仓库 - 修改仓库名称或描述
 4. 删除仓库 - 完全删除仓库及其内容
 5. 协作者管理 - 添加协作者到仓库
+6. 文件列表 - 分页列出仓库中的源文件和结果文件
 
 仓库是本系统的核心组织单位，用于存储和管理用户上传的文件及其处理结果。
 """
-from typing import Any, Dict
-from fastapi import APIRouter, HTTPException
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query
 from models.repo import RepoCreate, RepoResponse, AddCollaborator, RepoUpdate
-from db import db_util
+from models._file import FileListResponse
+from db import async_db_util  # 异步数据库操作（Motor），数据库往返期间不阻塞事件循环
+from db import db_config
+from db.file_records import InvalidCursor, to_metadata
 from bson import ObjectId
 
 # 创建路由器实例
@@ -58,13 +62,12 @@ def objectID2str(repo: Dict) -> RepoResponse:
     2. 构建RepoResponse对象，确保字段名称和类型正确
     
     参数:
-        repo: Dict - MongoDB返回的仓库文档
+        repo: Dict - 仓库文档，files / results 由 load_repo 从 files 集合中填充
         
     返回:
         RepoResponse - 符合API响应格式的仓库数据
     """
     repo = convert_objectid(repo)  # 深度转换ObjectId为字符串
-    print(repo)  # 调试输出，帮助开发者检查转换结果
     
     # 构建并返回符合RepoResponse模型的对象
     return RepoResponse(
@@ -74,9 +77,35 @@ def objectID2str(repo: Dict) -> RepoResponse:
         owner_id=repo["owner_id"],  # 仓库所有者ID
         collaborators=repo.get("collaborators", []),  # 协作者ID列表，不存在则提供空列表
         files=repo.get("files", []),  # 文件列表，不存在则提供空列表
-        results=repo.get("results", [])  # 结果列表，不存在则提供空列表
+        results=repo.get("results", []),  # 结果列表，不存在则提供空列表
+        files_total=int(repo.get("files_total", 0)),  # 源文件总数
+        results_total=int(repo.get("results_total", 0))  # 结果文件总数
     )
 
+async def load_repo(repo: Dict) -> RepoResponse:
+    """
+    补全仓库的文件信息并转换为API响应格式
+    
+    详细说明:
+    文件记录保存在独立的 files 集合中，仓库文档本身不再包含文件数组。
+    前端仍然直接使用 files / results 数组（文件数、按 file_id 查找、结果列表），
+    这里按上传先后取出全部源文件和结果文件，保持与原数组相同的内容和顺序，并给出总数；
+    前端改用 /{repo_id}/files 和 /{repo_id}/results 分页接口之后，可以不再返回完整数组。
+    
+    参数:
+        repo: Dict - get_repo_by_id 返回的仓库文档
+        
+    返回:
+        RepoResponse - 符合API响应格式的仓库数据
+    """
+    repo_id = str(repo["_id"])
+    repo = dict(repo)
+    repo["files"] = await async_db_util.list_all_files(repo_id, source=True)
+    repo["results"] = await async_db_util.list_all_files(repo_id, source=False)
+    repo["files_total"] = len(repo["files"])
+    repo["results_total"] = len(repo["results"])
+    return objectID2str(repo)
+
 # 创建仓库
 @router.post("/", response_model=RepoResponse)
 async def create_new_repo(repo: RepoCreate, owner_id: str):
@@ -103,15 +132,15 @@ async def create_new_repo(repo: RepoCreate, owner_id: str):
         400 Bad Request - 创建仓库失败，可能是名称已存在或其他数据库错误
     """
     # 调用数据库工具函数创建仓库
-    repo_id = db_util.create_repo(owner_id, repo.name, repo.desc)
+    repo_id = await async_db_util.create_repo(owner_id, repo.name, repo.desc)
     
     # 检查创建是否成功
     if not repo_id:
         raise HTTPException(status_code=400, detail="Failed to create repo")
     
     # 获取并返回创建的仓库详情
-    repo_data = db_util.get_repo_by_id(repo_id)
-    return objectID2str(repo_data)
+    repo_data = await async_db_util.get_repo_by_id(repo_id)
+    return await load_repo(repo_data)
 
 # 获取仓库信息
 @router.get("/{repo_id}", response_model=RepoResponse)
@@ -138,14 +167,14 @@ async def get_repo(repo_id: str):
         404 Not Found - 如果指定ID的仓库不存在
     """
     # 调用数据库工具函数获取仓库信息
-    repo = db_util.get_repo_by_id(repo_id)
+    repo = await async_db_util.get_repo_by_id(repo_id)
     
     # 如果仓库不存在，抛出404错误
     if not repo:
         raise HTTPException(status_code=404, detail="Repo not found")
     
     # 转换并返回仓库信息
-    return objectID2str(repo)
+    return await load_repo(repo)
 
 # 更新仓库名称
 @router.put("/{repo_id}/name", response_model=str)
@@ -175,7 +204,7 @@ async def update_repo_name(repo_id: str, repo_update: RepoUpdate):
     # 检查是否提供了新名称
     if repo_update.new_name:
         # 调用数据库工具函数更新仓库名称
-        status = db_util.update_repo_name(repo_id, repo_update.new_name)
+        status = await async_db_util.update_repo_name(repo_id, repo_update.new_name)
         
         # 检查更新是否成功
         if status == "success":
@@ -212,7 +241,7 @@ async def update_repo_desc(repo_id: str, repo_update: RepoUpdate):
     # 检查是否提供了新描述
     if repo_update.new_desc:
         # 调用数据库工具函数更新仓库描述
-        status = db_util.update_repo_desc(repo_id, repo_update.new_desc)
+        status = await async_db_util.update_repo_desc(repo_id, repo_update.new_desc)
         
         # 检查更新是否成功
         if status == "success":
@@ -246,7 +275,7 @@ async def delete_repo(repo_id: str):
         400 Bad Request - 删除失败，可能是仓库不存在或权限问题
     """
     # 调用数据库工具函数删除仓库
-    status = db_util.delete_repo(repo_id)
+    status = await async_db_util.delete_repo(repo_id)
     
     # 检查删除是否成功
     if status == "success":
@@ -281,7 +310,7 @@ async def add_collaborator_to_repo(repo_id: str, collaborator: AddCollaborator):
         400 Bad Request - 添加失败，可能是用户或仓库不存在，或用户已是协作者
     """
     # 调用数据库工具函数添加协作者
-    status = db_util.add_collaborator(repo_id, collaborator.collaborator_id)
+    status = await async_db_util.add_collaborator(repo_id, collaborator.collaborator_id)
     
     # 检查添加是否成功
     if status == "success":
@@ -289,3 +318,75 @@ async def add_collaborator_to_repo(repo_id: str, collaborator: AddCollaborator):
     
     # 如果添加失败，抛出400错误
     raise HTTPException(status_code=400, detail="Failed to add collaborator")
+
+async def _list_repo_files(repo_id: str, source: bool, limit: int, cursor: Optional[str]) -> FileListResponse:
+    """
+    分页列出仓库的源文件或结果文件
+    
+    详细说明:
+    按上传时间从新到旧排序，每次最多返回 limit 条。
+    使用游标（上一页最后一条记录的上传时间和ID）而不是页码翻页，
+    查询直接沿 (repo_id, kind, uploaded_at) 索引定位，翻到后面的页也不需要跳过前面的记录。
+    
+    错误:
+        404 Not Found - 仓库不存在
+        400 Bad Request - 游标格式不正确
+    """
+    if not ObjectId.is_valid(repo_id) or not await async_db_util.repo_exists(repo_id):
+        raise HTTPException(status_code=404, detail="Repo not found")
+    try:
+        records, next_cursor = await async_db_util.list_files(repo_id, source=source, limit=limit, cursor=cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return FileListResponse(
+        items=[to_metadata(record) for record in records],
+        next_cursor=next_cursor,
+        total=await async_db_util.count_files(repo_id, source=source)
+    )
+
+# 分页获取源文件列表
+@router.get("/{repo_id}/files", response_model=FileListResponse)
+async def list_repo_files(
+    repo_id: str,
+    limit: int = Query(db_config.FILE_PAGE_SIZE, ge=1, le=db_config.FILE_PAGE_MAX_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，不传表示第一页")
+):
+    """
+    分页获取仓库中用户上传的源文件
+    
+    流程:
+    1. 第一次请求不传 cursor，得到最新的 limit 个文件
+    2. 如果返回的 next_cursor 不为空，带上它请求下一页
+    3. next_cursor 为空表示已经是最后一页
+    
+    参数:
+        repo_id: str - 仓库ID
+        limit: int - 每页数量，最大为 FILE_PAGE_MAX_SIZE
+        cursor: str - 翻页游标
+        
+    返回:
+        FileListResponse - 本页文件、下一页游标和文件总数
+    """
+    return await _list_repo_files(repo_id, True, limit, cursor)
+
+# 分页获取结果文件列表
+@router.get("/{repo_id}/results", response_model=FileListResponse)
+async def list_repo_results(
+    repo_id: str,
+    limit: int = Query(db_config.FILE_PAGE_SIZE, ge=1, le=db_config.FILE_PAGE_MAX_SIZE, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor，不传表示第一页")
+):
+    """
+    分页获取仓库中处理生成的结果文件
+    
+    与 /{repo_id}/files 相同，结果中的 source_file 为对应的源文件ID。
+    
+    参数:
+        repo_id: str - 仓库ID
+        limit: int - 每页数量，最大为 FILE_PAGE_MAX_SIZE
+        cursor: str - 翻页游标
+        
+    返回:
+        FileListResponse - 本页结果文件、下一页游标和结果文件总数
+    """
+    return await _list_repo_files(repo_id, False, limit, cursor)
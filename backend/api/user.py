@@ -9,7 +9,7 @@
 这些API构成了用户管理的基础功能，使前端应用能够进行用户注册、登录和个人资料显示。
 """
 from fastapi import APIRouter, HTTPException, Depends
-from db.db_util import create_user, authenticate_user, get_user_by_id
+from db.async_db_util import create_user, authenticate_user, get_user_by_id  # 异步数据库操作，需要await
 from models.user import UserCreate, UserResponse, UserAuth, AuthResponse
 
 # 添加get_current_user依赖项导入
@@ -39,13 +39,17 @@ async def create_new_user(user: UserCreate):
         UserResponse - 用户创建成功后的详细信息，不包含敏感数据如密码
         
     错误:
-        可能由数据库函数抛出错误，如用户名已存在等
+        400 Bad Request - 用户名或邮箱（不区分大小写）已被使用
     """
     # 调用数据库工具函数创建用户
-    user_id = create_user(user.username, user.email, user.password, user.profile_picture)
+    user_id = await create_user(user.username, user.email, user.password, user.profile_picture)
+    
+    # 用户名或邮箱（不区分大小写）已被使用
+    if not user_id:
+        raise HTTPException(status_code=400, detail="Username or email already exists")
     
     # 获取创建后的用户信息
-    cur_user = get_user_by_id(user_id)
+    cur_user = await get_user_by_id(user_id)
     
     # 将MongoDB文档转换为API响应格式并返回
     return objectID2str(cur_user)
@@ -75,7 +79,7 @@ async def authenticate_user_request(user: UserAuth):
         401 Unauthorized - 如果用户凭据无效
     """
     # 调用数据库工具函数验证用户凭据
-    user_id = authenticate_user(user.username_or_email, user.password)
+    user_id = await authenticate_user(user.username_or_email, user.password)
     
     # 如果认证失败，抛出401未授权错误
     if not user_id:
@@ -105,7 +109,7 @@ async def get_current_user_profile(current_user_id: str = Depends(get_current_us
         404 Not Found - 如果找不到对应ID的用户
     """
     # 调用数据库工具函数获取用户信息
-    user = get_user_by_id(current_user_id)
+    user = await get_user_by_id(current_user_id)
     
     # 如果用户不存在，抛出404错误
     if not user:
@@ -138,7 +142,7 @@ async def get_user(user_id: str):
         404 Not Found - 如果指定ID的用户不存在
     """
     # 调用数据库工具函数获取用户信息
-    user = get_user_by_id(user_id)
+    user = await get_user_by_id(user_id)
     
     # 如果用户不存在，抛出404错误
     if not user:
@@ -0,0 +1,13 @@
+from pydantic_settings import BaseSettings
+
+class PasswordSettings(BaseSettings):
+    """密码哈希配置类"""
+    BCRYPT_ROUNDS: int = 12  # bcrypt 的代价因子（2^ROUNDS 次迭代），修改后旧哈希会在用户下次登录时自动重新计算
+    HASH_WORKERS: int = 2  # 执行 bcrypt 的线程数，bcrypt 计算时释放 GIL，可以并行使用多个 CPU 核
+    HASH_QUEUE_LIMIT: int = 32  # 同时等待和执行的哈希任务上限，超过时直接返回 503，不再排队
+
+    class Config:
+        env_prefix = "PASSWORD_"  # 环境变量前缀
+
+# 创建配置实例
+password_settings = PasswordSettings()
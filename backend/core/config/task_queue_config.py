@@ -0,0 +1,18 @@
+from pydantic_settings import BaseSettings
+
+class TaskQueueSettings(BaseSettings):
+    """任务队列配置类"""
+    PREFIX: str = "taskq"  # Redis键前缀
+    LEASE_SECONDS: int = 300  # 租约时长，工作进程需在到期前续约，否则任务会被重新派发
+    MAX_ATTEMPTS: int = 3  # 最大执行次数，超过后进入死信队列
+    RETRY_BACKOFF: int = 30  # 首次重试的等待秒数，之后每次翻倍
+    RECORD_TTL: int = 7 * 24 * 3600  # 任务记录保留时长（秒）
+    POLL_INTERVAL: float = 1.0  # 队列为空时工作进程的轮询间隔（秒）
+    CANCEL_CHECK_INTERVAL: float = 0.5  # 取消标记的最短检查间隔（秒），避免每次检查都访问Redis
+    WORKER_HEALTH_INTERVAL: float = 15.0  # 工作进程检查共享进程池并上报健康状态的间隔（秒），超过3倍间隔未上报视为已停止
+
+    class Config:
+        env_prefix = "TASK_QUEUE_"  # 环境变量前缀
+
+# 创建配置实例
+task_queue_settings = TaskQueueSettings()
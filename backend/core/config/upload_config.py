@@ -0,0 +1,12 @@
+from pydantic_settings import BaseSettings
+
+class UploadSettings(BaseSettings):
+    """文件上传配置类"""
+    MAX_SIZE: int = 100 * 1024 * 1024  # 单个文件的最大字节数，超过时返回 413
+    CHUNK_SIZE: int = 255 * 1024  # 每次写入 GridFS 的字节数，与 GridFS 默认的块大小一致
+
+    class Config:
+        env_prefix = "UPLOAD_"  # 环境变量前缀
+
+# 创建配置实例
+upload_settings = UploadSettings()
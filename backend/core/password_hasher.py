@@ -0,0 +1,135 @@
+"""
+有界的密码哈希线程池
+
+bcrypt 故意设计得很慢（每次 100～300 毫秒的 CPU 计算）。在 async 路由中直接调用 verify_password / get_password_hash
+会阻塞事件循环，一次登录期间同一进程中的所有其他请求都要等待；改用 asyncio.to_thread 又会占用默认线程池，
+一波登录请求可以排起很长的队列，挤占其他使用默认线程池的操作。这里使用独立的线程池：
+- 线程数为 PASSWORD_HASH_WORKERS，bcrypt 计算时释放 GIL，多个线程可以同时使用多个 CPU 核
+- 同时等待和执行的任务数不超过 PASSWORD_HASH_QUEUE_LIMIT，超过时立即抛出 PasswordHasherBusy（API 返回 503），
+  而不是让请求无限排队、最终全部超时。名额在线程池中的任务结束（或被撤下）时才释放，
+  等待结果的请求被取消（客户端断开、超时）时，已提交的 bcrypt 任务仍占用名额，线程池的实际队列不会超过上限
+- 记录提交、完成、拒绝的次数以及排队和计算耗时，通过 GET /auth/password-hasher/stats 查看（仅管理员）
+- verify_and_update 在验证成功且哈希的代价因子与 PASSWORD_BCRYPT_ROUNDS 不一致时，同时返回按新代价因子计算的哈希
+
+同步代码（工作进程、命令行脚本）仍然直接使用 core.security 中的函数。
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from core.config.password_config import password_settings
+from core.security import pwd_context
+
+
+class PasswordHasherBusy(Exception):
+    """等待中的哈希任务已达上限"""
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int = password_settings.HASH_WORKERS,
+                 queue_limit: int = password_settings.HASH_QUEUE_LIMIT):
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hash")
+        # 名额在事件循环线程中占用、在线程池的完成回调中释放，计数需要加锁
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._peak_in_flight = 0
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0, "rehashed": 0}
+        self._wait_seconds = {"total": 0.0, "max": 0.0}
+        self._run_seconds = {"total": 0.0, "max": 0.0}
+
+    @staticmethod
+    def _timed(func, args):
+        """在工作线程中执行，返回 (开始时间, 结束时间, 结果)"""
+        started = time.perf_counter()
+        result = func(*args)
+        return started, time.perf_counter(), result
+
+    def _release(self, future, submitted):
+        """线程池中的任务结束或被撤下时释放名额并记录耗时（在工作线程或事件循环线程中调用）"""
+        with self._lock:
+            self._in_flight -= 1
+            if future.cancelled():
+                self._counts["cancelled"] += 1
+                return
+            if future.exception() is not None:
+                self._counts["failed"] += 1
+                return
+            started, finished, _ = future.result()
+            self._counts["completed"] += 1
+            for totals, seconds in ((self._wait_seconds, started - submitted), (self._run_seconds, finished - started)):
+                totals["total"] += seconds
+                totals["max"] = max(totals["max"], seconds)
+
+    async def _run(self, func, *args):
+        with self._lock:
+            if self._in_flight >= self.queue_limit:
+                self._counts["rejected"] += 1
+                raise PasswordHasherBusy(f"等待中的密码哈希任务已达上限 {self.queue_limit}")
+            self._in_flight += 1
+            self._peak_in_flight = max(self._peak_in_flight, self._in_flight)
+            self._counts["submitted"] += 1
+        submitted = time.perf_counter()
+        try:
+            future = self._executor.submit(self._timed, func, args)
+        except RuntimeError:
+            # 线程池已关闭（应用正在退出）
+            with self._lock:
+                self._in_flight -= 1
+                self._counts["failed"] += 1
+            raise
+        future.add_done_callback(lambda f: self._release(f, submitted))
+        # 等待结果的协程被取消时，wrap_future 会尝试撤下还在排队的任务；已经开始计算的任务在结束后才释放名额
+        _, _, result = await asyncio.wrap_future(future)
+        return result
+
+    async def hash(self, password: str) -> str:
+        """与 get_password_hash 相同，在线程池中计算"""
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """与 verify_password 相同，在线程池中计算"""
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """
+        验证密码；验证成功且哈希需要更新（代价因子已修改）时返回新的哈希
+        :return: (是否匹配, 新的哈希或 None)，调用方负责把新哈希写回数据库
+        """
+        valid, new_hash = await self._run(pwd_context.verify_and_update, plain_password, hashed_password)
+        if new_hash:
+            with self._lock:
+                self._counts["rehashed"] += 1
+        return valid, new_hash
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return self._stats()
+
+    def _stats(self) -> Dict[str, Any]:
+        completed = self._counts["completed"]
+        return {
+            "workers": self.max_workers,
+            "queue_limit": self.queue_limit,
+            "bcrypt_rounds": password_settings.BCRYPT_ROUNDS,
+            "in_flight": self._in_flight,
+            "running": min(self._in_flight, self.max_workers),
+            "waiting": max(0, self._in_flight - self.max_workers),
+            "peak_in_flight": self._peak_in_flight,
+            **self._counts,
+            "avg_wait_ms": round(self._wait_seconds["total"] / completed * 1000, 1) if completed else 0.0,
+            "max_wait_ms": round(self._wait_seconds["max"] * 1000, 1),
+            "avg_run_ms": round(self._run_seconds["total"] / completed * 1000, 1) if completed else 0.0,
+            "max_run_ms": round(self._run_seconds["max"] * 1000, 1),
+        }
+
+    def shutdown(self):
+        """应用关闭时调用，不等待已提交的任务"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# 进程内共享的实例
+password_hasher = PasswordHasher()
@@ -74,7 +74,7 @@ def has_role(required_roles: List[str]):
             HTTPException 403: 如果用户没有所需角色，抛出"禁止访问"错误
         """
         # 从数据库获取用户详情
-        user = get_user_by_id(current_user_id)
+        user = await get_user_by_id(current_user_id)
         if not user:
             # 用户不存在，可能是令牌有效但用户已被删除
             raise HTTPException(
@@ -194,7 +194,7 @@ def is_resource_owner(get_owner_id_func: Callable[[Any], str]):
             return current_user_id
         
         # 如果不是所有者，检查是否为管理员
-        user = get_user_by_id(current_user_id)
+        user = await get_user_by_id(current_user_id)
         if user and (user.get("role") == ROLE_ADMIN or user.get("is_admin", False)):
             return current_user_id
         
@@ -256,7 +256,7 @@ def require_permission(permission: str):
             HTTPException 403: 如果用户没有所需权限，抛出"禁止访问"错误
         """
         # 从数据库获取用户信息
-        user = get_user_by_id(current_user_id)
+        user = await get_user_by_id(current_user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -324,7 +324,7 @@ def require_any_permission(permissions: List[str]):
             HTTPException 403: 如果用户没有任何所需权限，抛出"禁止访问"错误
         """
         # 从数据库获取用户信息
-        user = get_user_by_id(current_user_id)
+        user = await get_user_by_id(current_user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -393,7 +393,7 @@ def require_all_permissions(permissions: List[str]):
             HTTPException 403: 如果用户缺少任何所需权限，抛出"禁止访问"错误
         """
         # 从数据库获取用户信息
-        user = get_user_by_id(current_user_id)
+        user = await get_user_by_id(current_user_id)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -1,4 +1,6 @@
 from redis import asyncio as aioredis
+import redis
+import threading
 from typing import Optional
 from .config.redis_config import redis_settings
 from core.logging import logger
@@ -7,6 +9,8 @@ class RedisManager:
     """Redis连接管理器"""
     _instance: Optional['RedisManager'] = None
     _redis = None
+    _sync_redis = None
+    _sync_lock = threading.Lock()
 
     def __new__(cls):
         if cls._instance is None:
@@ -38,6 +42,9 @@ class RedisManager:
             await self._redis.close()
             self._redis = None
             logger.info("Redis连接池已关闭")
+        if self._sync_redis is not None:
+            self._sync_redis.close()
+            self._sync_redis = None
 
     @property
     def redis(self):
@@ -46,6 +53,31 @@ class RedisManager:
             raise RuntimeError("Redis连接池未初始化")
         return self._redis
 
+    @property
+    def sync_redis(self):
+        """
+        获取同步Redis客户端，供线程池/进程池中的同步代码使用
+
+        与异步连接池共用同一份配置，首次访问时创建；
+        redis-py 的连接池会在 fork 后自动重建连接，子进程中可以直接使用。
+        """
+        if self._sync_redis is None:
+            with self._sync_lock:
+                if self._sync_redis is None:
+                    self._sync_redis = redis.Redis(
+                        host=redis_settings.REDIS_HOST,
+                        port=redis_settings.REDIS_PORT,
+                        db=redis_settings.REDIS_DB,
+                        password=redis_settings.REDIS_PASSWORD,
+                        username=redis_settings.REDIS_USERNAME,
+                        encoding=redis_settings.REDIS_ENCODING,
+                        decode_responses=True,
+                        ssl=redis_settings.REDIS_SSL,
+                        max_connections=redis_settings.REDIS_POOL_SIZE,
+                        socket_timeout=redis_settings.REDIS_POOL_TIMEOUT
+                    )
+        return self._sync_redis
+
     # 常用的Redis操作方法
     async def set(self, key: str, value: str, expire: int = None):
         """设置键值对"""
@@ -18,6 +18,7 @@ from jose import jwt, JWTError  # python-jose库用于处理JWT
 from passlib.context import CryptContext  # passlib用于密码哈希
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer  # OAuth2密码流认证
+from core.config.password_config import password_settings
 
 # =============================== 密码哈希配置 ===============================
 
@@ -28,7 +29,16 @@ from fastapi.security import OAuth2PasswordBearer  # OAuth2密码流认证
 # 1. 自动加盐 - 每次哈希都自动加入随机盐值，防止彩虹表攻击
 # 2. 计算缓慢 - 故意设计为计算密集型，防止暴力破解
 # 3. 自适应 - 随着计算机性能提升可以调整工作因子
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 工作因子由 PASSWORD_BCRYPT_ROUNDS 配置；min_rounds / max_rounds 与之相同，
+# 使用其他工作因子的旧哈希会被 needs_update / verify_and_update 识别出来，在登录时重新计算
+# async 路由中请使用 core.password_hasher 中的线程池，不要直接调用下面的同步函数
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=password_settings.BCRYPT_ROUNDS,
+    bcrypt__min_rounds=password_settings.BCRYPT_ROUNDS,
+    bcrypt__max_rounds=password_settings.BCRYPT_ROUNDS,
+)
 
 # =============================== JWT配置 ===============================
 
@@ -0,0 +1,103 @@
+# 流式解析 multipart/form-data 请求体
+#
+# FastAPI 的 UploadFile 参数会在进入接口函数之前把整个请求体读完（超过 1MB 的部分写入临时文件），
+# 无法在读取过程中限制大小，也无法边收边写入数据库。这里直接读取 request.stream()，
+# 用 python-multipart 的增量解析器逐段解析，只把指定字段的文件内容按收到的顺序产出，其他字段丢弃。
+
+from typing import AsyncIterator, Optional, Tuple
+
+from fastapi import Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+
+class MultipartStreamError(Exception):
+    """请求不是 multipart/form-data，或请求体中没有指定的文件字段"""
+
+
+async def iter_file_part(request: Request, field_name: str) -> AsyncIterator[Tuple[str, bytes]]:
+    """
+    逐段产出请求体中名为 field_name 的文件字段的内容
+
+    第一次产出 (文件名, b"")，表示找到了该字段（空文件也会产出这一次），之后每收到一段内容产出一次 (文件名, 数据)。
+    同名字段出现多次时只使用第一个；请求体结束时仍未找到该字段则抛出 MultipartStreamError。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise MultipartStreamError("请求必须是 multipart/form-data")
+
+    # 解析器的回调是同步的，先记录事件，每写入一段请求体后再统一处理
+    events = []
+    header_field = bytearray()
+    header_value = bytearray()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        events.append(("header", bytes(header_field).lower(), bytes(header_value)))
+        header_field.clear()
+        header_value.clear()
+
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin", None, None)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers_finished", None, None)),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end], None)),
+        "on_part_end": lambda: events.append(("end", None, None)),
+    }
+    parser = multipart.MultipartParser(params[b"boundary"], callbacks)
+
+    found = False
+    filename: Optional[str] = None
+    in_target = False
+    disposition = b""
+
+    def handle(events):
+        """处理一批事件，返回本批中属于目标字段的数据"""
+        nonlocal found, filename, in_target, disposition
+        output = []
+        for kind, first, second in events:
+            if kind == "begin":
+                disposition = b""
+            elif kind == "header" and first == b"content-disposition":
+                disposition = second
+            elif kind == "headers_finished":
+                _, options = parse_options_header(disposition)
+                name = options.get(b"name", b"").decode("utf-8", errors="replace")
+                in_target = not found and name == field_name and b"filename" in options
+                if in_target:
+                    found = True
+                    filename = options[b"filename"].decode("utf-8", errors="replace")
+                    output.append(b"")
+            elif kind == "data" and in_target:
+                output.append(first)
+            elif kind == "end":
+                in_target = False
+        return output
+
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        parser.write(chunk)
+        output = handle(events)
+        events.clear()
+        for data in output:
+            yield filename, data
+
+    parser.finalize()
+    for data in handle(events):
+        yield filename, data
+
+    if not found:
+        raise MultipartStreamError(f"请求中没有文件字段 {field_name}")
@@ -0,0 +1,446 @@
+"""
+基于Redis的持久化任务队列
+
+文件处理任务原先保存在 api/process.py 的模块级字典中，并在 FastAPI 的 BackgroundTasks 中执行：
+服务重启后任务丢失，多个 uvicorn 工作进程之间互相看不到对方的任务，处理任务还会和请求处理抢占资源。
+这里把任务及其状态放到 Redis 中，API 节点只负责入队和查询，由独立的工作进程（worker.py）领取并执行。
+
+Redis中的数据结构（键均以 TASK_QUEUE_PREFIX 为前缀）：
+- {prefix}:pending          List  等待执行的任务ID，LPUSH 入队、RPOP 出队（先进先出）
+- {prefix}:leases           ZSet  正在执行的任务ID，score 为租约到期时间
+- {prefix}:delayed          ZSet  等待重试的任务ID，score 为可以重新执行的时间
+- {prefix}:dead             List  超过最大执行次数的任务ID（死信队列）
+- {prefix}:task:{task_id}   Hash  任务参数、状态、执行次数、错误信息和结果
+- {prefix}:file:{file_id}   ZSet  文件关联的任务ID，score 为创建时间
+- {prefix}:cancel:{task_id} String 取消标记，执行中的任务通过 CancellationToken 定期检查
+- {prefix}:worker:{worker}  String 工作进程共享进程池的健康状态（JSON），由 worker.py 定期上报，过期即视为工作进程已停止
+
+任务生命周期：
+    enqueue → pending → lease → leases ─┬─ ack  → completed
+                                        ├─ fail → delayed → pending（重试）
+                                        ├─ fail → dead（超过最大执行次数）
+                                        ├─ 租约过期（工作进程崩溃）→ pending
+                                        └─ cancel → cancelling → cancelled
+    尚未开始执行的任务被取消时直接从 pending / delayed 中移除并置为 cancelled。
+"""
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from core.config.task_queue_config import task_queue_settings
+from core.logging import logger
+from core.redis_manager import redis_manager
+
+# 任务状态
+QUEUED = "queued"
+PROCESSING = "processing"
+RETRYING = "retrying"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLING = "cancelling"
+CANCELLED = "cancelled"
+
+# 终态任务不会再被执行
+TERMINAL_STATUSES = {COMPLETED, FAILED, CANCELLED}
+
+# 原子地从 pending 取出一个任务并登记租约
+_LEASE_SCRIPT = """
+local task_id = redis.call('RPOP', KEYS[1])
+if task_id then
+    redis.call('ZADD', KEYS[2], ARGV[1], task_id)
+end
+return task_id
+"""
+
+# 把 score 不大于 ARGV[1] 的成员从 KEYS[1] 移回 pending 队首（RPUSH 使其最先被领取）
+_REQUEUE_DUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, task_id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], task_id)
+    redis.call('RPUSH', KEYS[2], task_id)
+end
+return ids
+"""
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class TaskCancelled(Exception):
+    """任务已被取消"""
+
+
+class CancellationToken:
+    """
+    协作式取消令牌
+
+    处理代码在阶段之间、每个文档开始之前调用 raise_if_cancelled()，发现 Redis 中存在取消标记时抛出 TaskCancelled；
+    字段抽取期间由 AsyncOllamaClient 在后台线程中轮询，取消时立即中止所有在途的 Ollama 请求。
+    令牌只保存键名，可以随任务一起 pickle 到进程池的子进程中；
+    检查使用同步Redis客户端，因此在线程和子进程中都可以调用，但不能在事件循环中直接调用
+    （事件循环中使用 TaskQueue.is_cancel_requested）。
+
+    文本抽取、GLM 分类等同步调用不会检查令牌：api/process.py 的 process_data 发现取消后
+    直接终止正在执行该任务子任务的进程池工作进程（WorkerPool.terminate），不等它们走到下一个检查点。
+    """
+
+    def __init__(self, key: str, check_interval: float = task_queue_settings.CANCEL_CHECK_INTERVAL):
+        self.key = key
+        self.check_interval = check_interval
+        self._cancelled = False
+        self._checked_at = 0.0
+
+    def is_cancelled(self) -> bool:
+        if self._cancelled:
+            return True
+        # 两次检查间隔太短时直接沿用上次的结果，避免高频调用时每次都访问Redis
+        now = time.time()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        try:
+            self._cancelled = bool(redis_manager.sync_redis.exists(self.key))
+        except Exception as e:
+            # Redis暂时不可用时继续执行，不因为检查失败而中断任务
+            logger.warning(f"检查取消标记 {self.key} 失败: {str(e)}")
+        return self._cancelled
+
+    def raise_if_cancelled(self):
+        if self.is_cancelled():
+            raise TaskCancelled(self.key)
+
+
+class TaskQueue:
+    """
+    Redis任务队列
+
+    所有方法都是异步的，使用 core.redis_manager 中已初始化的连接池。
+    """
+
+    def __init__(self, settings=task_queue_settings, manager=redis_manager):
+        self.settings = settings
+        self.manager = manager
+        self._scripts = {}
+
+    @property
+    def redis(self):
+        return self.manager.redis
+
+    # ===== 键名 =====
+    def _key(self, *parts):
+        return ":".join((self.settings.PREFIX,) + parts)
+
+    @property
+    def pending_key(self):
+        return self._key("pending")
+
+    @property
+    def leases_key(self):
+        return self._key("leases")
+
+    @property
+    def delayed_key(self):
+        return self._key("delayed")
+
+    @property
+    def dead_key(self):
+        return self._key("dead")
+
+    def task_key(self, task_id):
+        return self._key("task", task_id)
+
+    def file_key(self, file_id):
+        return self._key("file", file_id)
+
+    def cancel_key(self, task_id):
+        return self._key("cancel", task_id)
+
+    def worker_key(self, worker_id):
+        return self._key("worker", worker_id)
+
+    def _script(self, name, source):
+        # 脚本对象与连接池绑定，连接池重建后需要重新注册
+        redis = self.redis
+        cached = self._scripts.get(name)
+        if cached is None or cached[0] is not redis:
+            cached = (redis, redis.register_script(source))
+            self._scripts[name] = cached
+        return cached[1]
+
+    # ===== 入队 =====
+    async def enqueue(self, task_id: str, payload: Dict[str, Any], file_id: Optional[str] = None) -> str:
+        """
+        创建任务并放入等待队列
+
+        参数：
+            task_id: 任务ID
+            payload: 任务参数，工作进程执行时原样取回（需可JSON序列化）
+            file_id: 可选的关联文件ID，用于按文件查询任务
+        """
+        now = time.time()
+        ttl = self.settings.RECORD_TTL
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self.task_key(task_id), mapping={
+            "task_id": task_id,
+            "file_id": file_id or "",
+            "payload": json.dumps(payload, ensure_ascii=False),
+            "status": QUEUED,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        pipe.expire(self.task_key(task_id), ttl)
+        if file_id:
+            pipe.zadd(self.file_key(file_id), {task_id: now})
+            pipe.expire(self.file_key(file_id), ttl)
+        pipe.lpush(self.pending_key, task_id)
+        await pipe.execute()
+        logger.info(f"任务 {task_id} 已入队")
+        return task_id
+
+    # ===== 领取 =====
+    async def requeue_due(self, limit: int = 100) -> List[str]:
+        """
+        把到期的延迟重试任务和租约已过期的任务放回等待队列
+
+        租约过期说明执行它的工作进程已经崩溃或失联，任务会被其他工作进程重新领取。
+        """
+        now = time.time()
+        script = self._script("requeue_due", _REQUEUE_DUE_SCRIPT)
+        delayed = await script(keys=[self.delayed_key, self.pending_key], args=[now, limit])
+        expired = await script(keys=[self.leases_key, self.pending_key], args=[now, limit])
+        expired = [_decode(task_id) for task_id in expired]
+        for task_id in expired:
+            logger.warning(f"任务 {task_id} 的租约已过期，重新放回队列")
+        return [_decode(task_id) for task_id in delayed] + expired
+
+    async def lease(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        领取一个任务
+
+        返回：
+            dict: 任务详情（见 get_task），队列为空时返回 None
+        """
+        await self.requeue_due()
+        script = self._script("lease", _LEASE_SCRIPT)
+        while True:
+            deadline = time.time() + self.settings.LEASE_SECONDS
+            task_id = _decode(await script(keys=[self.pending_key, self.leases_key], args=[deadline]))
+            if task_id is None:
+                return None
+
+            task = await self.get_task(task_id)
+            if task is None:
+                # 任务记录已过期被删除，丢弃这个ID
+                await self.redis.zrem(self.leases_key, task_id)
+                continue
+            if task["status"] in TERMINAL_STATUSES:
+                await self.redis.zrem(self.leases_key, task_id)
+                continue
+            if task["status"] == CANCELLING:
+                # 执行它的工作进程在响应取消之前崩溃了，不再重新执行
+                await self.mark_cancelled(task_id)
+                continue
+
+            attempts = await self.redis.hincrby(self.task_key(task_id), "attempts", 1)
+            if attempts > self.settings.MAX_ATTEMPTS:
+                # 反复因租约过期被重新派发（例如每次都导致工作进程崩溃）的任务直接进入死信队列
+                await self.fail(task_id, task.get("error") or "超过最大执行次数", retry=False)
+                continue
+
+            await self.set_status(task_id, PROCESSING, worker=worker_id, leased_at=time.time())
+            task.update(status=PROCESSING, attempts=attempts, worker=worker_id)
+            return task
+
+    async def extend_lease(self, task_id: str) -> bool:
+        """续约：长时间运行的任务需要在租约到期前定期调用"""
+        deadline = time.time() + self.settings.LEASE_SECONDS
+        # XX：只更新仍在租约表中的任务，避免把已被重新派发的任务加回来
+        await self.redis.zadd(self.leases_key, {task_id: deadline}, xx=True)
+        return await self.redis.zscore(self.leases_key, task_id) is not None
+
+    # ===== 完成 / 失败 =====
+    async def ack(self, task_id: str, result: Any = None):
+        """确认任务执行成功"""
+        await self.redis.zrem(self.leases_key, task_id)
+        fields = {"error": ""}
+        if result is not None:
+            fields["result"] = json.dumps(result, ensure_ascii=False, default=str)
+        await self.set_status(task_id, COMPLETED, **fields)
+        logger.info(f"任务 {task_id} 执行完成")
+
+    async def fail(self, task_id: str, error: str, retry: bool = True) -> str:
+        """
+        记录任务执行失败
+
+        参数：
+            retry: 是否允许重试；未超过最大执行次数时任务会在退避后重新入队
+
+        返回：
+            str: 任务的新状态，RETRYING 或 FAILED
+        """
+        await self.redis.zrem(self.leases_key, task_id)
+        attempts = int(_decode(await self.redis.hget(self.task_key(task_id), "attempts")) or 0)
+        if retry and attempts < self.settings.MAX_ATTEMPTS:
+            delay = self.settings.RETRY_BACKOFF * (2 ** max(0, attempts - 1))
+            await self.redis.zadd(self.delayed_key, {task_id: time.time() + delay})
+            await self.set_status(task_id, RETRYING, error=error, retry_at=time.time() + delay)
+            logger.warning(f"任务 {task_id} 第 {attempts} 次执行失败，{delay} 秒后重试: {error}")
+            return RETRYING
+
+        await self.redis.lpush(self.dead_key, task_id)
+        await self.set_status(task_id, FAILED, error=error)
+        logger.error(f"任务 {task_id} 执行失败，已放入死信队列: {error}")
+        return FAILED
+
+    # ===== 取消 =====
+    async def cancel(self, task_id: str) -> Optional[str]:
+        """
+        请求取消任务
+
+        尚未开始执行的任务直接取消；正在执行的任务写入取消标记，由执行方在下一次检查时停止。
+
+        返回：
+            str: 任务的新状态（CANCELLED 或 CANCELLING）；任务已结束时返回其当前状态；任务不存在时返回 None
+        """
+        status = await self.get_status(task_id)
+        if status is None or status in TERMINAL_STATUSES:
+            return status
+
+        # 先写取消标记，这样即使任务恰好在此刻被领取，执行方也能发现
+        await self.redis.set(self.cancel_key(task_id), 1, ex=self.settings.RECORD_TTL)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrem(self.pending_key, 0, task_id)
+        pipe.zrem(self.delayed_key, task_id)
+        removed_pending, removed_delayed = await pipe.execute()
+        if removed_pending or removed_delayed:
+            await self.mark_cancelled(task_id)
+            return CANCELLED
+
+        await self.set_status(task_id, CANCELLING)
+        logger.info(f"任务 {task_id} 已标记为取消中")
+        return CANCELLING
+
+    async def mark_cancelled(self, task_id: str):
+        """执行方响应取消后调用：释放租约并把任务置为终态 CANCELLED"""
+        await self.redis.zrem(self.leases_key, task_id)
+        await self.redis.delete(self.cancel_key(task_id))
+        await self.set_status(task_id, CANCELLED)
+        logger.info(f"任务 {task_id} 已取消")
+
+    async def is_cancel_requested(self, task_id: str) -> bool:
+        """任务是否已被请求取消（异步版本，在事件循环中使用）"""
+        return bool(await self.redis.exists(self.cancel_key(task_id)))
+
+    def cancellation_token(self, task_id: str) -> CancellationToken:
+        """创建用于检查该任务是否已被取消的令牌"""
+        return CancellationToken(self.cancel_key(task_id), check_interval=self.settings.CANCEL_CHECK_INTERVAL)
+
+    async def retry_dead(self, task_id: str) -> bool:
+        """把死信队列中的任务重新放回等待队列（执行次数清零）"""
+        removed = await self.redis.lrem(self.dead_key, 1, task_id)
+        if not removed:
+            return False
+        await self.redis.hset(self.task_key(task_id), "attempts", 0)
+        await self.set_status(task_id, QUEUED, error="")
+        await self.redis.lpush(self.pending_key, task_id)
+        return True
+
+    # ===== 查询 =====
+    async def set_status(self, task_id: str, status: str, **fields):
+        mapping = {"status": status, "updated_at": time.time()}
+        mapping.update({key: value for key, value in fields.items() if value is not None})
+        await self.redis.hset(self.task_key(task_id), mapping=mapping)
+
+    async def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取任务详情
+
+        返回：
+            dict: 包含 task_id、file_id、payload（已解析）、status、attempts、error 等字段；任务不存在时返回 None
+        """
+        raw = await self.redis.hgetall(self.task_key(task_id))
+        if not raw:
+            return None
+        task = {_decode(key): _decode(value) for key, value in raw.items()}
+        task["payload"] = json.loads(task.get("payload") or "{}")
+        task["attempts"] = int(task.get("attempts") or 0)
+        for key in ("created_at", "updated_at", "leased_at", "retry_at"):
+            if key in task:
+                task[key] = float(task[key])
+        if "result" in task:
+            task["result"] = json.loads(task["result"])
+        return task
+
+    async def get_status(self, task_id: str) -> Optional[str]:
+        return _decode(await self.redis.hget(self.task_key(task_id), "status"))
+
+    async def file_tasks(self, file_id: str) -> List[Dict[str, Any]]:
+        """按创建时间顺序返回文件关联的所有任务"""
+        task_ids = [_decode(task_id) for task_id in await self.redis.zrange(self.file_key(file_id), 0, -1)]
+        tasks = []
+        for task_id in task_ids:
+            task = await self.get_task(task_id)
+            if task is not None:
+                tasks.append(task)
+        return tasks
+
+    async def cleanup(self, older_than: float) -> int:
+        """
+        删除创建时间早于 older_than 的已结束任务记录
+
+        返回：
+            int: 删除的任务数
+        """
+        removed = 0
+        async for key in self.redis.scan_iter(match=self._key("task", "*"), count=500):
+            key = _decode(key)
+            status, created_at, file_id = [
+                _decode(value) for value in await self.redis.hmget(key, "status", "created_at", "file_id")
+            ]
+            if status not in TERMINAL_STATUSES or float(created_at or 0) >= older_than:
+                continue
+            task_id = key[len(self._key("task", "")):]
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.delete(key)
+            pipe.lrem(self.dead_key, 0, task_id)
+            pipe.delete(self.cancel_key(task_id))
+            if file_id:
+                pipe.zrem(self.file_key(file_id), task_id)
+            await pipe.execute()
+            removed += 1
+        return removed
+
+    async def stats(self) -> Dict[str, int]:
+        """各队列的长度"""
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.llen(self.pending_key)
+        pipe.zcard(self.leases_key)
+        pipe.zcard(self.delayed_key)
+        pipe.llen(self.dead_key)
+        pending, leased, delayed, dead = await pipe.execute()
+        return {"pending": pending, "leased": leased, "delayed": delayed, "dead": dead}
+
+    # ===== 工作进程健康状态 =====
+    async def publish_worker_health(self, worker_id: str, health: Dict[str, Any]):
+        """工作进程上报共享进程池的健康状态，3个上报间隔内没有再次上报时自动过期"""
+        record = {**health, "worker_id": worker_id, "reported_at": time.time()}
+        ttl = max(1, int(self.settings.WORKER_HEALTH_INTERVAL * 3))
+        await self.redis.set(self.worker_key(worker_id), json.dumps(record), ex=ttl)
+
+    async def remove_worker_health(self, worker_id: str):
+        """工作进程正常退出时删除自己的健康状态"""
+        await self.redis.delete(self.worker_key(worker_id))
+
+    async def worker_health(self) -> List[Dict[str, Any]]:
+        """所有仍在上报的工作进程的健康状态"""
+        keys = [key async for key in self.redis.scan_iter(match=self._key("worker", "*"), count=100)]
+        if not keys:
+            return []
+        records = [json.loads(_decode(value)) for value in await self.redis.mget(keys) if value is not None]
+        return sorted(records, key=lambda record: record["worker_id"])
+
+
+# 创建全局任务队列实例
+task_queue = TaskQueue()
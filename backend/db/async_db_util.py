@@ -0,0 +1,551 @@
+"""
+异步数据库操作模块（Motor）
+
+db_util 中的函数使用同步的 pymongo，在 async 路由中直接调用时，每次数据库往返都会阻塞事件循环，
+期间其他请求全部停顿。这个模块提供与 db_util 同名、参数和返回值相同的异步版本，API 路由中使用
+`await async_db_util.xxx(...)` 调用；工作进程、后台线程和命令行脚本仍使用同步的 db_util。
+
+两个模块读写同一个数据库的同一组集合（包括 GridFS 的 fs.files / fs.chunks），可以混用。
+连接池参数见 db_config.client_options()。
+"""
+import hashlib
+
+from bson.objectid import ObjectId
+from gridfs.errors import NoFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+
+from db import db_config
+from db.file_records import (
+    FILES_COLLECTION, KIND_RESULT, LIST_SORT, RECORD_PROJECTION, UPLOAD_ORDER_SORT,
+    kind_of, list_projection, list_query, new_file_record, split_page, to_metadata,
+)
+from db.user_records import email_query, lookup_keys, username_or_email_query, username_query
+from db.db_util import UploadTooLarge
+from models.chat import Message
+from core.password_hasher import password_hasher
+
+# 初始化Motor客户端
+# 创建客户端时不会连接数据库，第一次操作时才在当前事件循环中建立连接
+client = AsyncIOMotorClient(db_config.DB_URL, **db_config.client_options())
+db = client[db_config.DB_NAME]
+bucket = AsyncIOMotorGridFSBucket(db)
+files = db[FILES_COLLECTION]
+
+
+def close():
+    """关闭连接池，应用关闭时调用"""
+    client.close()
+
+# =============================== 用户相关操作 ===============================
+
+async def create_user(username, email, password, profile_picture=None):
+    """
+    创建一个新的用户，与 db_util.create_user 相同
+    bcrypt 哈希是CPU密集的计算，在密码哈希线程池中执行，不阻塞事件循环
+    :return: 返回用户的MongoDB _id (字符串格式)；用户名或邮箱（不区分大小写）已存在时返回 None
+    """
+    if len(password) == 60 and password.startswith('$2'):  # bcrypt哈希的特征
+        password_hash = password
+    else:
+        password_hash = await password_hasher.hash(password)
+
+    user = {
+        "username": username,
+        "email": email,
+        "password_hash": password_hash,
+        "profile_picture": profile_picture,
+        "repos": [],
+        "collaborations": [],
+        **lookup_keys(username, email)
+    }
+    try:
+        result = await db.users.insert_one(user)
+    except DuplicateKeyError:
+        return None
+    return str(result.inserted_id)
+
+
+async def get_user_by_username(username):
+    """
+    通过用户名查找用户（不区分大小写）
+    :return: 找到的用户文档，未找到则返回None
+    """
+    return await db.users.find_one(username_query(username))
+
+
+async def get_user_by_email(email):
+    """
+    通过电子邮件地址查找用户（不区分大小写）
+    :return: 找到的用户文档，未找到则返回None
+    """
+    return await db.users.find_one(email_query(email))
+
+
+async def authenticate_user(username_or_email, password):
+    """
+    验证用户名或邮箱登录
+    :return: 验证成功返回用户ID(字符串)，失败返回None
+    """
+    user = await db.users.find_one(username_or_email_query(username_or_email))
+    if user and await verify_user_password(user, password):
+        return str(user["_id"])
+    return None
+
+
+async def verify_user_password(user, password: str) -> bool:
+    """
+    验证用户文档中的密码哈希
+    验证成功且哈希使用的代价因子与当前配置不同时，把按当前配置重新计算的哈希写回数据库
+    :raises PasswordHasherBusy: 密码哈希线程池已满
+    """
+    valid, new_hash = await password_hasher.verify_and_update(password, user["password_hash"])
+    if valid and new_hash:
+        # 以旧哈希为条件，避免覆盖同时修改的密码
+        await db.users.update_one(
+            {"_id": user["_id"], "password_hash": user["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+    return valid
+
+
+async def get_user_by_id(user_id):
+    """
+    通过用户ID获取用户信息
+    :return: 用户文档，未找到则返回None
+    """
+    return await db.users.find_one({"_id": ObjectId(user_id)})
+
+# =============================== 仓库相关操作 ===============================
+
+async def create_repo(owner_id, repo_name, repo_desc):
+    """
+    创建一个repo并更新用户文档中的仓库列表
+    输入检查: repo名不能与该用户所拥有的其他repo名字重复，并且owner_id必须是已经存在的
+    :return: 出现任何错误都会只返回一个none，否则返回创建的 repo _id
+    """
+    owner = await db.users.find_one({"_id": ObjectId(owner_id)})
+    if not owner:
+        return None  # 用户不存在，不能创建仓库
+
+    existing_repo = await db.repos.find_one({"owner_id": ObjectId(owner_id), "name": repo_name})
+    if existing_repo:
+        return None  # 同名仓库已经存在，不能创建
+
+    repo = {
+        "name": repo_name,
+        "owner_id": ObjectId(owner_id),
+        "desc": repo_desc,
+        "collaborators": []
+    }
+    result = await db.repos.insert_one(repo)
+    repo_id = str(result.inserted_id)
+
+    await db.users.update_one(
+        {"_id": ObjectId(owner_id)},
+        {"$push": {"repos": ObjectId(repo_id)}}
+    )
+    return repo_id
+
+
+async def update_repo_name(repo_id, new_name):
+    """
+    更新仓库名称（不能与该用户的其他仓库同名）
+    :return: 成功返回 "success"，失败返回 None
+    """
+    repo = await db.repos.find_one({"_id": ObjectId(repo_id)})
+    if not repo:
+        return None
+
+    existing_repo = await db.repos.find_one({"owner_id": repo["owner_id"], "name": new_name})
+    if existing_repo:
+        return None
+
+    await db.repos.update_one({"_id": ObjectId(repo_id)}, {"$set": {"name": new_name}})
+    return "success"
+
+
+async def update_repo_desc(repo_id, new_desc):
+    """
+    更新仓库描述
+    :return: 成功返回 "success"，失败返回 None
+    """
+    repo = await db.repos.find_one({"_id": ObjectId(repo_id)})
+    if not repo:
+        return None
+
+    await db.repos.update_one({"_id": ObjectId(repo_id)}, {"$set": {"desc": new_desc}})
+    return "success"
+
+
+async def get_repo_by_id(repo_id):
+    """
+    获得repo的基本信息（不含文件，文件通过 list_files 分页获取）
+    :return: 返回仓库文档
+    """
+    return await db.repos.find_one({"_id": ObjectId(repo_id)}, {"files": 0, "results": 0})
+
+
+async def delete_repo(repo_id):
+    """
+    删除仓库，并更新相关用户的 repos 属性
+    :return: 成功删除返回 success
+    """
+    result = await db.repos.delete_one({"_id": ObjectId(repo_id)})
+    if result.deleted_count == 0:
+        return "repo not found"
+
+    await db.users.update_many(
+        {"repos": ObjectId(repo_id)},
+        {"$pull": {"repos": ObjectId(repo_id)}}
+    )
+    await files.delete_many({"repo_id": ObjectId(repo_id)})
+    return "success"
+
+
+async def add_collaborator(repo_id, collaborator_id):
+    """
+    添加一个协作者
+    :return: 成功添加则返回 success，否则返回none
+    """
+    repo = await db.repos.find_one({"_id": ObjectId(repo_id)})
+    if not repo:
+        print("仓库不存在")
+        return None
+
+    if ObjectId(collaborator_id) in repo["collaborators"]:
+        print("该用户已经是协作者")
+        return None
+
+    await db.repos.update_one(
+        {"_id": ObjectId(repo_id)},
+        {"$addToSet": {"collaborators": ObjectId(collaborator_id)}}
+    )
+    await db.users.update_one(
+        {"_id": ObjectId(collaborator_id)},
+        {"$addToSet": {"collaborations": ObjectId(repo_id)}}
+    )
+    return "success"
+
+# =============================== 文件相关操作 ===============================
+
+async def upload_res_file(repo_id: str, file_obj, source_file_id, filename: str, source=False):
+    """
+    上传结果文件到 GridFS，并在 files 集合中记录
+    :return: 成功返回文件 ID，失败返回 None
+    """
+    if not await repo_exists(repo_id):
+        return None
+
+    file_content = file_obj.read()
+    file_id = await bucket.upload_from_stream(filename, file_content)
+
+    await files.insert_one(new_file_record(repo_id, file_id, filename, len(file_content), kind_of(source),
+                                           source_file=source_file_id))
+    return str(file_id)
+
+
+def open_upload_stream(filename: str):
+    """
+    打开一个 GridFS 上传流，调用方分块 `await grid_in.write(...)`，最后调用 finish_upload；
+    中途失败时 `await grid_in.abort()` 删除已写入的块
+    :return: MotorGridIn
+    """
+    return bucket.open_upload_stream(filename)
+
+
+async def finish_upload(grid_in, sha256: str):
+    """
+    关闭上传流，并把内容的 SHA-256 记录在 GridFS 文件文档中（下载接口用作 ETag）
+    :return: 文件 ID
+    """
+    await grid_in.set("sha256", sha256)
+    await grid_in.close()
+    return grid_in._id
+
+
+async def repo_exists(repo_id: str) -> bool:
+    return ObjectId.is_valid(repo_id) and await db.repos.count_documents({"_id": ObjectId(repo_id)}, limit=1) > 0
+
+
+async def add_file_record(repo_id: str, file_id, filename: str, size: int, sha256: str = None, source=True):
+    """
+    在 files 集合中记录已写入 GridFS 的文件
+    :return: 文件 ID 字符串
+    """
+    await files.insert_one(new_file_record(repo_id, file_id, filename, size, kind_of(source), sha256=sha256))
+    return str(file_id)
+
+
+async def upload_source_file(repo_id: str, file_obj, filename: str, source=True, max_size: int = None, chunk_size: int = 255 * 1024):
+    """
+    上传文件到 GridFS，并在 files 集合中记录，与 db_util.upload_source_file 相同
+    file_obj 是普通的二进制文件对象，按块读取
+    :return: 成功返回文件 ID，仓库不存在返回 None；超过 max_size 时抛出 UploadTooLarge
+    """
+    if not await repo_exists(repo_id):
+        return None
+
+    grid_in = open_upload_stream(filename)
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadTooLarge(f"文件超过 {max_size} 字节")
+            sha256.update(chunk)
+            await grid_in.write(chunk)
+        file_id = await finish_upload(grid_in, sha256.hexdigest())
+    except BaseException:
+        await grid_in.abort()
+        raise
+
+    return await add_file_record(repo_id, file_id, filename, size, sha256.hexdigest(), source)
+
+
+async def get_file_metadata_by_id(repo_id: str, file_id: str, source=True):
+    """
+    获取文件的元数据，包括 `status`
+    :param source: 如果 source=True 则查找源文件，如果 False 则查找结果文件
+    :return: 文件元数据（字典格式），如果文件不存在则返回 None
+    """
+    record = await files.find_one(
+        {"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id), "kind": kind_of(source)},
+        RECORD_PROJECTION
+    )
+    if not record:
+        print(f"文件 {file_id} 不存在于 repo {repo_id}")
+        return None
+    return to_metadata(record)
+
+
+async def get_file_record(repo_id: str, file_id: str):
+    """
+    查找仓库中的文件记录，不区分源文件和结果文件
+    :return: files 集合中的文档（含 kind），不存在则返回 None
+    """
+    if not ObjectId.is_valid(file_id):
+        return None
+    return await files.find_one({"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id)})
+
+
+async def get_latest_result(repo_id: str, source_file_id):
+    """
+    源文件最近一次处理生成的结果文件记录，没有则返回 None
+    """
+    return await files.find_one(
+        {"source_file": ObjectId(source_file_id), "kind": KIND_RESULT, "repo_id": ObjectId(repo_id)},
+        sort=[("uploaded_at", -1)]
+    )
+
+
+async def list_files(repo_id: str, source=True, limit: int = db_config.FILE_PAGE_SIZE, cursor: str = None):
+    """
+    按上传时间倒序分页列出仓库的源文件或结果文件
+    :param cursor: 上一页返回的游标，None 表示第一页；格式不正确时抛出 file_records.InvalidCursor
+    :return: (文件记录列表, 下一页游标或 None)
+    """
+    records = await (
+        files.find(list_query(repo_id, kind_of(source), cursor), list_projection())
+        .sort(LIST_SORT)
+        .limit(limit + 1)
+        .to_list(limit + 1)
+    )
+    return split_page(records, limit)
+
+
+async def list_all_files(repo_id: str, source=True):
+    """
+    按上传先后列出仓库的全部源文件或结果文件，与原 repo.files / repo.results 数组的内容和顺序相同
+    :return: 文件记录列表（RECORD_PROJECTION 中的字段）
+    """
+    return await (
+        files.find({"repo_id": ObjectId(repo_id), "kind": kind_of(source)}, RECORD_PROJECTION)
+        .sort(UPLOAD_ORDER_SORT)
+        .to_list(None)
+    )
+
+
+async def count_files(repo_id: str, source=True) -> int:
+    return await files.count_documents({"repo_id": ObjectId(repo_id), "kind": kind_of(source)})
+
+
+async def delete_file(file_id: str):
+    """
+    从 GridFS 删除文件，并删除 files 集合中的记录
+    :return: 成功返回 "success"，失败返回 None
+    """
+    file_id_obj = ObjectId(file_id)
+    try:
+        await bucket.delete(file_id_obj)
+    except NoFile:
+        print(f"文件 {file_id} 不存在")
+        return None
+
+    await files.delete_one({"file_id": file_id_obj})
+
+    print(f"文件 {file_id} 删除成功")
+    return "success"
+
+
+async def download_file(file_id: str):
+    """
+    从 GridFS 下载整个文件；大文件请使用 open_file + read_file_chunks
+    :return: (文件名, 文件内容 bytes) 或 None
+    """
+    grid_out = await open_file(file_id)
+    if grid_out is None:
+        print(f"文件 {file_id} 不存在")
+        return None
+    return grid_out.filename, await grid_out.read()
+
+
+async def open_file(file_id: str):
+    """
+    打开 GridFS 中的文件，只读取元数据，文件内容由 read_file_chunks 按块读取
+    :return: MotorGridOut（含 filename、length、chunk_size、upload_date 等属性），文件不存在时返回 None
+    """
+    if not ObjectId.is_valid(file_id):
+        return None
+    try:
+        return await bucket.open_download_stream(ObjectId(file_id))
+    except NoFile:
+        return None
+
+
+async def read_file_chunks(grid_out, start: int = 0, end: int = None):
+    """
+    按 GridFS 的块大小依次读取文件内容，每次只从数据库取一个块
+    :param start: 起始字节（含）
+    :param end: 结束字节（含），None 表示读到文件末尾
+    :return: 逐块产出 bytes 的异步生成器
+    """
+    end = grid_out.length - 1 if end is None else end
+    remaining = end - start + 1
+    grid_out.seek(start)
+    while remaining > 0:
+        data = await grid_out.readchunk()
+        if not data:
+            break
+        data = data[:remaining]
+        remaining -= len(data)
+        yield data
+
+
+async def file_exists(file_id: str) -> bool:
+    """
+    检查 GridFS 中是否存在指定文件（只查询元数据，不读取文件内容）
+    """
+    if not ObjectId.is_valid(file_id):
+        return False
+    return await db.fs.files.count_documents({"_id": ObjectId(file_id)}, limit=1) > 0
+
+
+async def update_file_status(repo_id: str, file_id: str, new_status: str = "complete", source=True):
+    """
+    更新文件的 `status` 字段
+    :return: "success" 表示更新成功，"not found" 表示未找到文件
+    """
+    result = await files.update_one(
+        {"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id), "kind": kind_of(source)},
+        {"$set": {"status": new_status}}
+    )
+
+    if result.matched_count == 0:
+        print(f"文件 {file_id} 不存在于 repo {repo_id}")
+        return "not found"
+
+    print(f"文件 {file_id} 状态更新为 {new_status}")
+    return "success"
+
+# =============================== 聊天与结果相关操作 ===============================
+
+async def create_or_get_chat_history(user_id: str, repo_id: str):
+    """
+    创建一个新的 chat_history，如果已存在则返回已有的 chat 记录
+    :return: chat 记录，_id 为字符串
+    """
+    user_id_obj = ObjectId(user_id)
+    repo_id_obj = ObjectId(repo_id)
+
+    existing_chat = await db.chats.find_one({"user_id": user_id_obj, "repo_id": repo_id_obj})
+    if existing_chat:
+        existing_chat["_id"] = str(existing_chat["_id"])
+        return existing_chat
+
+    chat_history = {
+        "user_id": user_id_obj,
+        "repo_id": repo_id_obj,
+        "texts": [],
+    }
+    result = await db.chats.insert_one(chat_history)
+    chat_history["_id"] = str(result.inserted_id)
+    return chat_history
+
+
+async def update_chat_history(user_id: str, repo_id: str, question: Message, answer: Message):
+    """
+    往对应的 chat_history 里面新增一条 text 记录
+    :return: 更新后的 chat 记录，如果失败则返回错误信息
+    """
+    user_id_obj = ObjectId(user_id)
+    repo_id_obj = ObjectId(repo_id)
+    question_dict = {
+        "sayer": question.sayer,
+        "text": question.text,
+        "timestamp": question.timestamp.isoformat()
+    }
+    answer_dict = {
+        "sayer": answer.sayer,
+        "text": answer.text,
+        "timestamp": answer.timestamp.isoformat()
+    }
+    text = {
+        "question": str(question_dict),
+        "answer": str(answer_dict)
+    }
+    # 追加并返回更新后的文档，一次往返代替 查询 + 更新 + 再查询
+    updated_chat = await db.chats.find_one_and_update(
+        {"user_id": user_id_obj, "repo_id": repo_id_obj},
+        {"$push": {"texts": text}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not updated_chat:
+        return {"error": "Chat history not found."}
+    updated_chat["_id"] = str(updated_chat["_id"])
+    return updated_chat
+
+
+async def create_or_update_json_res(file_id: str, json_content, prediction: dict = None):
+    """
+    创建或更新一个json格式的结果
+    :param prediction: 可选的预测信息 {probability, error, model_version, scored_at}
+    :return: json_res的_id
+    """
+    file_id_obj = ObjectId(file_id)
+    fields = {"content": json_content}
+    if prediction is not None:
+        fields["prediction"] = prediction
+
+    existing_json_res = await db.json_res.find_one({"file_id": file_id_obj}, {"_id": 1})
+    if existing_json_res:
+        await db.json_res.update_one({"file_id": file_id_obj}, {"$set": fields})
+        return str(existing_json_res["_id"])
+
+    result = await db.json_res.insert_one({"file_id": file_id_obj, **fields})
+    return str(result.inserted_id)
+
+
+async def get_json_res(file_id: str):
+    """
+    返回json格式的结果
+    :param file_id: 文件的id(注意这里是结果文件的id而不是json_res的id)
+    :return: 对应的json_res，如果结果不存在则返回None
+    """
+    json_res = await db.json_res.find_one({"file_id": ObjectId(file_id)})
+    if json_res:
+        json_res["_id"] = str(json_res["_id"])
+        return json_res
+    return None
@@ -1,23 +1,30 @@
 """
 认证相关的数据库操作模块
 包含用于用户身份验证的数据库操作函数
+
+这些函数在权限检查等 async 依赖项中调用，使用 Motor 异步客户端，数据库往返期间不阻塞事件循环；
+密码哈希与校验是CPU密集的计算，在密码哈希线程池（core/password_hasher.py）中执行
+用户名和邮箱按小写字段查找，不区分大小写且可以使用索引（见 db/user_records.py）
 """
-from pymongo import MongoClient
-from core.security import verify_password, get_password_hash
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
+from core.password_hasher import password_hasher
 from bson.objectid import ObjectId
 from datetime import datetime
+from db import db_config
+from db.user_records import email_query, lookup_keys, username_query
 import os
 
 # 从环境变量获取MongoDB连接字符串
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DB_NAME", "myapp")
 
-# 创建MongoDB客户端
-client = MongoClient(MONGO_URI)
+# 创建MongoDB客户端，连接池参数与 db_config 相同
+client = AsyncIOMotorClient(MONGO_URI, **db_config.client_options())
 db = client[DB_NAME]
 users_collection = db["users"]
 
-def get_user_by_username(username: str):
+async def get_user_by_username(username: str):
     """
     通过用户名查找用户
     
@@ -27,11 +34,10 @@ def get_user_by_username(username: str):
     返回:
         dict: 用户文档，如果未找到则返回None
     """
-    # 将查询设置为不区分大小写
-    # 使用$regex以允许不区分大小写的查询
-    return users_collection.find_one({"username": {"$regex": f"^{username}$", "$options": "i"}})
+    # 不区分大小写：按小写的 username_lower 做等值查询，使用唯一索引，不扫描整个集合
+    return await users_collection.find_one(username_query(username))
 
-def get_user_by_email(email: str):
+async def get_user_by_email(email: str):
     """
     通过电子邮件查找用户
     
@@ -41,10 +47,10 @@ def get_user_by_email(email: str):
     返回:
         dict: 用户文档，如果未找到则返回None
     """
-    # 将查询设置为不区分大小写
-    return users_collection.find_one({"email": {"$regex": f"^{email}$", "$options": "i"}})
+    # 不区分大小写：按小写的 email_lower 做等值查询
+    return await users_collection.find_one(email_query(email))
 
-def get_user_by_id(user_id: str):
+async def get_user_by_id(user_id: str):
     """
     通过用户ID查找用户
     
@@ -58,9 +64,9 @@ def get_user_by_id(user_id: str):
     if not ObjectId.is_valid(user_id):
         return None
     
-    return users_collection.find_one({"_id": ObjectId(user_id)})
+    return await users_collection.find_one({"_id": ObjectId(user_id)})
 
-def create_user(username: str, email: str, password: str, profile_picture: str = None):
+async def create_user(username: str, email: str, password: str, profile_picture: str = None):
     """
     创建新用户
     
@@ -71,7 +77,7 @@ def create_user(username: str, email: str, password: str, profile_picture: str =
         profile_picture: 用户头像URL（可选）
         
     返回:
-        str: 创建的用户ID
+        str: 创建的用户ID，用户名或邮箱（不区分大小写）已存在时返回None
     """
     # 创建新用户文档
     user_doc = {
@@ -85,13 +91,17 @@ def create_user(username: str, email: str, password: str, profile_picture: str =
         "updated_at": datetime.now(),
         "is_active": True,  # 用户是否激活
         "is_admin": False,  # 用户是否为管理员
+        **lookup_keys(username, email),  # 小写的用户名和邮箱，用于查找和唯一约束
     }
     
     # 插入用户文档并返回生成的ID
-    result = users_collection.insert_one(user_doc)
+    try:
+        result = await users_collection.insert_one(user_doc)
+    except DuplicateKeyError:
+        return None
     return str(result.inserted_id)
 
-def authenticate_user(username_or_email: str, password: str):
+async def authenticate_user(username_or_email: str, password: str):
     """
     验证用户凭据
     
@@ -103,20 +113,30 @@ def authenticate_user(username_or_email: str, password: str):
         str: 用户ID，如果验证失败则返回None
     """
     # 尝试通过用户名查找用户
-    user = get_user_by_username(username_or_email)
+    user = await get_user_by_username(username_or_email)
     
     # 如果未找到，尝试通过电子邮件查找
     if not user:
-        user = get_user_by_email(username_or_email)
+        user = await get_user_by_email(username_or_email)
     
     # 如果仍未找到或密码不匹配，则返回None
-    if not user or not verify_password(password, user["password"]):
+    if not user:
         return None
+    valid, new_hash = await password_hasher.verify_and_update(password, user["password"])
+    if not valid:
+        return None
+    
+    # 代价因子已修改时，写回按当前配置重新计算的哈希（以旧哈希为条件，避免覆盖同时修改的密码）
+    if new_hash:
+        await users_collection.update_one(
+            {"_id": user["_id"], "password": user["password"]},
+            {"$set": {"password": new_hash, "updated_at": datetime.now()}}
+        )
     
     # 返回用户ID
     return str(user["_id"])
 
-def update_user_password(user_id: str, new_password: str):
+async def update_user_password(user_id: str, new_password: str):
     """
     更新用户密码
     
@@ -132,10 +152,10 @@ def update_user_password(user_id: str, new_password: str):
         return False
     
     # 对新密码进行哈希处理
-    hashed_password = get_password_hash(new_password)
+    hashed_password = await password_hasher.hash(new_password)
     
     # 更新用户密码和更新时间
-    result = users_collection.update_one(
+    result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
         {
             "$set": {
@@ -148,7 +168,7 @@ def update_user_password(user_id: str, new_password: str):
     # 返回操作是否成功
     return result.modified_count > 0
 
-def deactivate_user(user_id: str):
+async def deactivate_user(user_id: str):
     """
     停用用户账户
     
@@ -163,7 +183,7 @@ def deactivate_user(user_id: str):
         return False
     
     # 将用户的is_active字段设置为False
-    result = users_collection.update_one(
+    result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
         {
             "$set": {
@@ -176,7 +196,7 @@ def deactivate_user(user_id: str):
     # 返回操作是否成功
     return result.modified_count > 0
 
-def reactivate_user(user_id: str):
+async def reactivate_user(user_id: str):
     """
     重新激活用户账户
     
@@ -191,7 +211,7 @@ def reactivate_user(user_id: str):
         return False
     
     # 将用户的is_active字段设置为True
-    result = users_collection.update_one(
+    result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
         {
             "$set": {
@@ -19,6 +19,39 @@ mongodb://[username:password@]host[:port][/database]
 import os
 
 # MongoDB连接URL
-# 开发环境使用本地MongoDB实例
-# 生产环境应使用环境变量配置，例如: os.getenv("MONGO_URL", "默认值")
-DB_URL = "mongodb://localhost:27017/"
+# 开发环境使用本地MongoDB实例，生产环境通过环境变量 MONGO_URL 配置
+DB_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/")
+DB_NAME = "file_processing_app"
+
+# 连接池配置
+# 同步客户端（db_util，供工作进程和命令行使用）与异步客户端（async_db_util，供API路由使用）各自维护一个连接池，
+# 每个进程的连接数上限为 2 * MAX_POOL_SIZE，部署多个进程时注意不要超过MongoDB的最大连接数
+# - MAX_POOL_SIZE: 每个客户端的最大连接数；并发请求超过该值时在等待队列中排队
+# - MIN_POOL_SIZE: 保持的最小空闲连接数，避免流量突增时集中建立连接拉高尾延迟
+# - MAX_IDLE_TIME_MS: 空闲连接超过该时间后关闭（0 表示不限制）
+# - WAIT_QUEUE_TIMEOUT_MS: 等待空闲连接的最长时间，超时抛出错误而不是无限排队
+# - SERVER_SELECTION_TIMEOUT_MS: 数据库不可用时多久放弃
+# Motor 在内部线程池中执行操作（线程数默认为 CPU 核数 * 5，由环境变量 MOTOR_MAX_WORKERS 配置），
+# 异步客户端实际同时进行的操作数不超过 min(MAX_POOL_SIZE, 线程数)
+MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+
+
+def client_options():
+    """MongoClient / AsyncIOMotorClient 共用的连接池参数"""
+    return {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "maxIdleTimeMS": MAX_IDLE_TIME_MS or None,
+        "waitQueueTimeoutMS": WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+
+# 文件列表分页（files 集合）
+# - FILE_PAGE_SIZE / FILE_PAGE_MAX_SIZE: 分页接口默认每页条数与上限
+FILE_PAGE_SIZE = int(os.getenv("FILE_PAGE_SIZE", "50"))
+FILE_PAGE_MAX_SIZE = int(os.getenv("FILE_PAGE_MAX_SIZE", "200"))
@@ -1,17 +1,28 @@
 import os
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson.objectid import ObjectId
 import hashlib
-from gridfs import GridFS
-from datetime import datetime, UTC
+from gridfs import GridFS, GridFSBucket
+from gridfs.errors import NoFile
 from db import db_config
+from db.file_records import (
+    FILES_COLLECTION, KIND_RESULT, LIST_SORT, RECORD_PROJECTION,
+    kind_of, list_projection, list_query, new_file_record, split_page, to_metadata,
+)
+from db.user_records import email_query, lookup_keys, username_or_email_query, username_query
 from models.chat import Message
 from core.security import get_password_hash, verify_password
 
 # 初始化MongoDB客户端
-client = MongoClient(db_config.DB_URL)
-db = client.file_processing_app
+# API路由使用 async_db_util 中的异步版本；这里的同步函数供工作进程、后台线程和命令行脚本使用
+client = MongoClient(db_config.DB_URL, **db_config.client_options())
+db = client[db_config.DB_NAME]
 fs = GridFS(db)
+# 流式上传使用 GridFSBucket，与 fs 共用同一组 fs.files / fs.chunks 集合
+bucket = GridFSBucket(db)
+# 文件元数据（见 db/file_records.py）
+files = db[FILES_COLLECTION]
 
 # =============================== 用户相关操作 ===============================
 
@@ -30,7 +41,7 @@ def create_user(username, email, password, profile_picture=None):
     :param email: 邮箱地址
     :param password: 可以是明文密码或已哈希的密码
     :param profile_picture: 头像URL(可选)
-    :return: 返回用户的MongoDB _id (字符串格式)
+    :return: 返回用户的MongoDB _id (字符串格式)；用户名或邮箱（不区分大小写）已存在时返回 None
     """
     # 检查密码是否已经哈希处理
     # bcrypt哈希的密码通常是60个字符长度且以$2开头
@@ -48,11 +59,15 @@ def create_user(username, email, password, profile_picture=None):
         "password_hash": password_hash,  # 存储哈希后的密码，而非明文
         "profile_picture": profile_picture,
         "repos": [],  # 用户拥有的仓库列表，初始为空
-        "collaborations": []  # 用户参与协作的仓库列表，初始为空
+        "collaborations": [],  # 用户参与协作的仓库列表，初始为空
+        **lookup_keys(username, email)  # 小写的用户名和邮箱，用于不区分大小写的查找（见 db/user_records.py）
     }
     
-    # 将用户文档插入数据库
-    result = db.users.insert_one(user)
+    # 将用户文档插入数据库，小写字段上的唯一索引保证用户名和邮箱不重复
+    try:
+        result = db.users.insert_one(user)
+    except DuplicateKeyError:
+        return None
     # 返回新创建用户的ID（转换为字符串）
     return str(result.inserted_id)
 
@@ -67,9 +82,9 @@ def get_user_by_username(username):
     :param username: 要查找的用户名
     :return: 找到的用户文档，未找到则返回None
     """
-    # 在users集合中查找匹配用户名的文档
+    # 在users集合中查找匹配用户名的文档（不区分大小写，按小写字段的索引查找）
     # find_one方法找到第一个匹配的文档或返回None
-    return db.users.find_one({"username": username})
+    return db.users.find_one(username_query(username))
 
 def get_user_by_email(email):
     """
@@ -82,8 +97,8 @@ def get_user_by_email(email):
     :param email: 要查找的电子邮件地址
     :return: 找到的用户文档，未找到则返回None
     """
-    # 在users集合中查找匹配邮箱的文档
-    return db.users.find_one({"email": email})
+    # 在users集合中查找匹配邮箱的文档（不区分大小写）
+    return db.users.find_one(email_query(email))
 
 def authenticate_user(username_or_email, password):
     """
@@ -98,9 +113,9 @@ def authenticate_user(username_or_email, password):
     :param password: 明文密码
     :return: 验证成功返回用户ID(字符串)，失败返回None
     """
-    # 尝试查找匹配用户名或邮箱的用户
+    # 尝试查找匹配用户名或邮箱的用户（不区分大小写）
     # $or操作符允许执行逻辑OR查询，匹配任一条件即可
-    user = db.users.find_one({"$or": [{"username": username_or_email}, {"email": username_or_email}]})
+    user = db.users.find_one(username_or_email_query(username_or_email))
 
     if user:
         # 使用bcrypt验证密码
@@ -149,11 +164,10 @@ def create_repo(owner_id, repo_name, repo_desc):
         "name": repo_name,
         "owner_id": ObjectId(owner_id),
         "desc": repo_desc,
-        "collaborators": [],
-        "files": [],
-        "results": []
+        "collaborators": []
     }
     # 将仓库插入到repos集合
+    # 仓库中的文件记录在 files 集合中，不再保存在仓库文档里
     result = db.repos.insert_one(repo)
     repo_id = str(result.inserted_id)
 
@@ -207,11 +221,12 @@ def update_repo_desc(repo_id, new_desc):
 
 def get_repo_by_id(repo_id):
     """
-    获得repo所有信息
+    获得repo的基本信息（不含文件，文件通过 list_files 分页获取）
     :param repo_id: 需要的仓库 _id
-    :return: 返回仓库的整个数据结构
+    :return: 返回仓库文档
     """
-    return db.repos.find_one({"_id": ObjectId(repo_id)})
+    # 尚未迁移的旧仓库文档中仍有 files / results 数组，不读取
+    return db.repos.find_one({"_id": ObjectId(repo_id)}, {"files": 0, "results": 0})
 
 def delete_repo(repo_id):
     """
@@ -231,6 +246,9 @@ def delete_repo(repo_id):
         {"$pull": {"repos": ObjectId(repo_id)}}
     )
 
+    # 3. 删除该仓库的文件记录
+    files.delete_many({"repo_id": ObjectId(repo_id)})
+
     return "success"
 
 
@@ -268,108 +286,152 @@ def add_collaborator(repo_id, collaborator_id):
 # =============================== 文件相关操作 ===============================
 def upload_res_file(repo_id: str, file_obj, source_file_id,filename: str, source=False):
     """
-    上传结果文件到 GridFS，并更新 repo 的 files 或 results 列表
+    上传结果文件到 GridFS，并在 files 集合中记录
     :param repo_id: 仓库 ID
     :param file_obj: 需要上传的文件对象（二进制流）
+    :param source_file_id: 对应的源文件 ID
     :param filename: 文件名
-    :param source: 如果 source=True 则更新 files 列表，如果为 False 则更新 results 列表
+    :param source: 如果 source=True 则记录为源文件，如果为 False 则记录为结果文件
     :return: 成功返回文件 ID，失败返回 None
     """
-    repo = db.repos.find_one({"_id": ObjectId(repo_id)})
-    if not repo:
+    if not repo_exists(repo_id):
         return None  # 仓库不存在
 
     file_content = file_obj.read()
     file_id = fs.put(file_content, filename=filename)
-    file_size = len(file_content)
 
+    files.insert_one(new_file_record(repo_id, file_id, filename, len(file_content), kind_of(source),
+                                     source_file=source_file_id))
+    return str(file_id)
+
+class UploadTooLarge(Exception):
+    """上传的文件超过允许的最大字节数"""
 
-    file_info = {
-        "source_file": ObjectId(source_file_id),
-        "file_id": ObjectId(file_id),
-        "filename": filename,
-        "size": file_size,
-        "uploaded_at": datetime.now(UTC),
-        "status": "uploaded"
-    }
 
-    db.repos.update_one(
-        {"_id": ObjectId(repo_id)},
-        {"$push": {"files" if source else "results": file_info}}
-    )
+def open_upload_stream(filename: str):
+    """
+    打开一个 GridFS 上传流，调用方分块 write，最后调用 finish_upload；中途失败时调用 abort() 删除已写入的块
+    :param filename: 文件名
+    :return: GridIn
+    """
+    return bucket.open_upload_stream(filename)
+
+
+def finish_upload(grid_in, sha256: str):
+    """
+    关闭上传流，并把内容的 SHA-256 记录在 GridFS 文件文档中（下载接口用作 ETag）
+    :return: 文件 ID
+    """
+    grid_in.sha256 = sha256
+    grid_in.close()
+    return grid_in._id
+
+
+def repo_exists(repo_id: str) -> bool:
+    return ObjectId.is_valid(repo_id) and db.repos.count_documents({"_id": ObjectId(repo_id)}, limit=1) > 0
+
 
+def add_file_record(repo_id: str, file_id, filename: str, size: int, sha256: str = None, source=True):
+    """
+    在 files 集合中记录已写入 GridFS 的文件
+    :param source: True 记录为源文件，False 记录为结果文件
+    :return: 文件 ID 字符串
+    """
+    files.insert_one(new_file_record(repo_id, file_id, filename, size, kind_of(source), sha256=sha256))
     return str(file_id)
 
-def upload_source_file(repo_id: str, file_obj, filename: str, source=True):
+
+def upload_source_file(repo_id: str, file_obj, filename: str, source=True, max_size: int = None, chunk_size: int = 255 * 1024):
     """
-    上传文件到 GridFS，并更新 repo 的 files 或 results 列表
+    上传文件到 GridFS，并在 files 集合中记录
+    文件内容按块从 file_obj 读出并写入 GridFS，同时计算大小和 SHA-256，不会把整个文件读入内存
     :param repo_id: 仓库 ID
     :param file_obj: 需要上传的文件对象（二进制流）
     :param filename: 文件名
-    :param source: 如果 source=True 则更新 files 列表，如果为 False 则更新 results 列表
+    :param source: 如果 source=True 则记录为源文件，如果为 False 则记录为结果文件
+    :param max_size: 最大字节数，超过时删除已写入的块并抛出 UploadTooLarge；None 表示不限制
+    :param chunk_size: 每次读取的字节数
     :return: 成功返回文件 ID，失败返回 None
     """
-    repo = db.repos.find_one({"_id": ObjectId(repo_id)})
-    if not repo:
+    if not repo_exists(repo_id):
         return None  # 仓库不存在
 
-    file_content = file_obj.read()
-    file_id = fs.put(file_content, filename=filename)
-    file_size = len(file_content)
-
-
-    file_info = {
-        "source_file": False,
-        "file_id": ObjectId(file_id),
-        "filename": filename,
-        "size": file_size,
-        "uploaded_at": datetime.now(UTC),
-        "status": "uploaded"
-    }
-
-    db.repos.update_one(
-        {"_id": ObjectId(repo_id)},
-        {"$push": {"files" if source else "results": file_info}}
-    )
-
-    return str(file_id)
+    grid_in = open_upload_stream(filename)
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        for chunk in iter(lambda: file_obj.read(chunk_size), b""):
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                raise UploadTooLarge(f"文件超过 {max_size} 字节")
+            sha256.update(chunk)
+            grid_in.write(chunk)
+        file_id = finish_upload(grid_in, sha256.hexdigest())
+    except BaseException:
+        grid_in.abort()
+        raise
+
+    return add_file_record(repo_id, file_id, filename, size, sha256.hexdigest(), source)
 
 def get_file_metadata_by_id(repo_id: str, file_id: str, source=True):
     """
     获取文件的元数据，包括 `status`
     :param repo_id: 仓库 ID
     :param file_id: 文件 ID
-    :param source: 如果 source=True 则获得 files 信息，如果 False 则获得 results 信息
+    :param source: 如果 source=True 则查找源文件，如果 False 则查找结果文件
     :return: 文件元数据（字典格式），如果文件不存在则返回 None
     """
-    repo_id_obj = ObjectId(repo_id)
-    file_id_obj = ObjectId(file_id)
+    record = files.find_one(
+        {"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id), "kind": kind_of(source)},
+        RECORD_PROJECTION
+    )
+    if not record:
+        print(f"文件 {file_id} 不存在于 repo {repo_id}")
+        return None
+    return to_metadata(record)
+
+
+def get_file_record(repo_id: str, file_id: str):
+    """
+    查找仓库中的文件记录，不区分源文件和结果文件
+    :return: files 集合中的文档（含 kind），不存在则返回 None
+    """
+    if not ObjectId.is_valid(file_id):
+        return None
+    return files.find_one({"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id)})
 
-    collection_name = "files" if source else "results"
 
-    repo = db.repos.find_one(
-        {"_id": repo_id_obj, f"{collection_name}.file_id": file_id_obj},
-        {f"{collection_name}.$": 1}
+def get_latest_result(repo_id: str, source_file_id):
+    """
+    源文件最近一次处理生成的结果文件记录，没有则返回 None
+    """
+    return files.find_one(
+        {"source_file": ObjectId(source_file_id), "kind": KIND_RESULT, "repo_id": ObjectId(repo_id)},
+        sort=[("uploaded_at", -1)]
     )
 
-    if not repo or collection_name not in repo or not repo[collection_name]:
-        print(f"文件 {file_id} 不存在于 repo {repo_id}")
-        return None
 
-    file_data = repo[collection_name][0]
+def list_files(repo_id: str, source=True, limit: int = db_config.FILE_PAGE_SIZE, cursor: str = None):
+    """
+    按上传时间倒序分页列出仓库的源文件或结果文件
+    :param cursor: 上一页返回的游标，None 表示第一页；格式不正确时抛出 file_records.InvalidCursor
+    :return: (文件记录列表, 下一页游标或 None)
+    """
+    records = list(
+        files.find(list_query(repo_id, kind_of(source), cursor), list_projection())
+        .sort(LIST_SORT)
+        .limit(limit + 1)
+    )
+    return split_page(records, limit)
 
-    return {
-        "file_id": str(file_data["file_id"]),
-        "filename": file_data["filename"],
-        "size": file_data["size"],
-        "upload_date": file_data["uploaded_at"],
-        "status": str(file_data.get("status", "unknown"))
-    }
+
+def count_files(repo_id: str, source=True) -> int:
+    return files.count_documents({"repo_id": ObjectId(repo_id), "kind": kind_of(source)})
 
 
 def delete_file(file_id: str):
     """
-    从 GridFS 删除文件，并从 repo.files 或 repo.results 中移除记录
+    从 GridFS 删除文件，并删除 files 集合中的记录
     :param file_id: 文件的 `_id`
     :return: 成功返回 "success"，失败返回 None
     """
@@ -381,16 +443,7 @@ def delete_file(file_id: str):
         return None
 
     fs.delete(file_id_obj)
-
-    db.repos.update_many(
-        {"files.file_id": file_id_obj},
-        {"$pull": {"files": {"file_id": file_id_obj}}}
-    )
-
-    db.repos.update_many(
-        {"results.file_id": file_id_obj},
-        {"$pull": {"results": {"file_id": file_id_obj}}}
-    )
+    files.delete_one({"file_id": file_id_obj})
 
     print(f"文件 {file_id} 删除成功")
     return "success"
@@ -412,22 +465,64 @@ def download_file(file_id: str):
     return file_obj.filename, file_obj.read()
 
 
+def open_file(file_id: str):
+    """
+    打开 GridFS 中的文件，只读取元数据，文件内容由 read_file_chunks 按块读取
+    :param file_id: 文件的 `_id`
+    :return: GridOut（含 filename、length、chunk_size、upload_date 等属性），文件不存在时返回 None
+    """
+    if not ObjectId.is_valid(file_id):
+        return None
+    try:
+        return fs.get(ObjectId(file_id))
+    except NoFile:
+        return None
+
+
+def read_file_chunks(grid_out, start: int = 0, end: int = None):
+    """
+    按 GridFS 的块大小依次读取文件内容，每次只从数据库取一个块，内存占用与文件大小无关
+    :param grid_out: open_file 返回的 GridOut
+    :param start: 起始字节（含）
+    :param end: 结束字节（含），None 表示读到文件末尾
+    :return: 逐块产出 bytes 的生成器
+    """
+    end = grid_out.length - 1 if end is None else end
+    remaining = end - start + 1
+    grid_out.seek(start)
+    while remaining > 0:
+        # 从 start 所在的块开始，readchunk 每次返回当前块剩余的部分
+        data = grid_out.readchunk()
+        if not data:
+            break
+        data = data[:remaining]
+        remaining -= len(data)
+        yield data
+
+
+def file_exists(file_id: str) -> bool:
+    """
+    检查 GridFS 中是否存在指定文件（只查询元数据，不读取文件内容）
+    :param file_id: 文件的 `_id`
+    :return: 存在返回 True
+    """
+    if not ObjectId.is_valid(file_id):
+        return False
+    return fs.exists(ObjectId(file_id))
+
+
 def update_file_status(repo_id: str, file_id: str, new_status: str = "complete", source=True):
     """
     更新文件的 `status` 字段
     :param repo_id: 仓库 ID
     :param file_id: 文件 ID
     :param new_status: 要更新的状态（默认为 "complete"）
-    :param source: 如果 source=True，则更新 files，否则更新 results
+    :param source: 如果 source=True，则更新源文件，否则更新结果文件
     :return: "success" 表示更新成功，"not found" 表示未找到文件
     """
-    repo_id_obj = ObjectId(repo_id)
-    file_id_obj = ObjectId(file_id)
-    collection_name = "files" if source else "results"
-
-    result = db.repos.update_one(
-        {"_id": repo_id_obj, f"{collection_name}.file_id": file_id_obj},
-        {"$set": {f"{collection_name}.$.status": new_status}}
+    result = files.update_one(
+        {"file_id": ObjectId(file_id), "repo_id": ObjectId(repo_id), "kind": kind_of(source)},
+        {"$set": {"status": new_status}}
     )
 
     if result.matched_count == 0:
@@ -511,15 +606,18 @@ def update_chat_history(user_id: str, repo_id: str, question: Message, answer:Me
     return updated_chat
 
 
-def create_or_update_json_res(file_id: str, json_content):
+def create_or_update_json_res(file_id: str, json_content, prediction: dict = None):
     """
     创建一个json格式的结果
     :param file_id: 文件的id
     :param json_content: json格式的结果
+    :param prediction: 可选的预测信息 {probability, error, model_version, scored_at}，与重新评分命令写入的字段相同
     :return: 新生成的json_res的_id
     """
     file_id_obj = ObjectId(file_id)
-
+    fields = {"content": json_content}
+    if prediction is not None:
+        fields["prediction"] = prediction
 
     # 查询是否已有记录
     existing_json_res = db.json_res.find_one({"file_id": file_id_obj})
@@ -527,14 +625,14 @@ def create_or_update_json_res(file_id: str, json_content):
     if existing_json_res:
         db.json_res.update_one(
             {"file_id": file_id_obj},
-            {"$set": {"content": json_content}}  
+            {"$set": fields}  
         )
 
         return str(existing_json_res["_id"])  # 转换 ObjectId 为字符串
 
     file_json = {
         "file_id": file_id_obj, 
-        "content": json_content   
+        **fields
     }
 
     result = db.json_res.insert_one(file_json)
@@ -0,0 +1,128 @@
+"""
+文件记录（files 集合）的结构与查询
+
+文件元数据原先以数组的形式保存在仓库文档的 files / results 字段中，每读一次仓库都要取回全部文件历史，
+文件多了还会逼近单个文档 16MB 的上限。现在每个文件是 files 集合中的一个文档：
+
+    {
+        "file_id": GridFS 中的文件 id（唯一）,
+        "repo_id": 所属仓库,
+        "kind": "source"（用户上传的源文件）或 "result"（处理生成的结果文件）,
+        "source_file": 结果文件对应的源文件 id；源文件为 False（与原数组中的取值相同）,
+        "filename", "size", "sha256", "uploaded_at", "status"
+    }
+
+db_util（同步）和 async_db_util（异步）共用这里的文档结构、索引定义和分页游标。
+"""
+from datetime import datetime, UTC
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+FILES_COLLECTION = "files"
+
+KIND_SOURCE = "source"
+KIND_RESULT = "result"
+
+# 列表按上传时间倒序，同一毫秒内按 _id 倒序，保证翻页时顺序稳定；
+# 索引最后加上 _id，排序可以直接使用索引，不需要在内存中排序
+LIST_SORT = [("uploaded_at", DESCENDING), ("_id", DESCENDING)]
+# 与原 repo.files / repo.results 数组相同的顺序（按上传先后），反向使用同一个索引
+UPLOAD_ORDER_SORT = [("uploaded_at", ASCENDING), ("_id", ASCENDING)]
+
+FILE_INDEXES = [
+    IndexModel([("repo_id", ASCENDING), ("kind", ASCENDING), ("uploaded_at", DESCENDING), ("_id", DESCENDING)],
+               name="repo_kind_uploaded_at"),
+    IndexModel([("file_id", ASCENDING)], name="file_id_unique", unique=True),
+    # 由源文件查找它的处理结果（聊天接口）
+    IndexModel([("source_file", ASCENDING), ("uploaded_at", DESCENDING)], name="result_source_file",
+               partialFilterExpression={"kind": KIND_RESULT}),
+]
+
+# 返回给 API 的字段；不包含 _id、repo_id、kind
+RECORD_PROJECTION = {"_id": 0, "file_id": 1, "source_file": 1, "filename": 1, "size": 1, "sha256": 1,
+                     "uploaded_at": 1, "status": 1}
+
+
+class InvalidCursor(ValueError):
+    """分页游标格式不正确"""
+
+
+def kind_of(source: bool) -> str:
+    """API 中 source=True / False 对应的文件类型"""
+    return KIND_SOURCE if source else KIND_RESULT
+
+
+def new_file_record(repo_id, file_id, filename: str, size: int, kind: str, sha256: str = None,
+                    source_file=False, uploaded_at: datetime = None, status: str = "uploaded"):
+    return {
+        "file_id": ObjectId(file_id),
+        "repo_id": ObjectId(repo_id),
+        "kind": kind,
+        "source_file": ObjectId(source_file) if source_file else False,
+        "filename": filename,
+        "size": size,
+        "sha256": sha256,
+        "uploaded_at": uploaded_at or datetime.now(UTC),
+        "status": status,
+    }
+
+
+def to_metadata(record):
+    """files 集合中的文档 -> FileMetadata 的字段"""
+    source_file = record.get("source_file")
+    return {
+        "file_id": str(record["file_id"]),
+        "filename": record["filename"],
+        "size": record["size"],
+        "upload_date": record["uploaded_at"],
+        "status": str(record.get("status", "unknown")),
+        "sha256": record.get("sha256"),
+        "source_file": str(source_file) if source_file else None,
+    }
+
+
+def encode_cursor(record) -> str:
+    """用一页最后一条记录的 (uploaded_at, _id) 生成下一页的游标"""
+    uploaded_at = record["uploaded_at"]
+    if uploaded_at.tzinfo is None:
+        # pymongo 默认返回不带时区的 UTC 时间
+        uploaded_at = uploaded_at.replace(tzinfo=UTC)
+    return f"{int(uploaded_at.timestamp() * 1000)}_{record['_id']}"
+
+
+def list_query(repo_id, kind: str, cursor: str = None):
+    """
+    分页查询条件：游标之后（更早上传）的记录
+    :raises InvalidCursor: 游标格式不正确
+    """
+    query = {"repo_id": ObjectId(repo_id), "kind": kind}
+    if cursor:
+        try:
+            millis, last_id = cursor.split("_", 1)
+            uploaded_at = datetime.fromtimestamp(int(millis) / 1000, UTC)
+            last_id = ObjectId(last_id)
+        except (ValueError, InvalidId):
+            raise InvalidCursor(cursor)
+        query["$or"] = [
+            {"uploaded_at": {"$lt": uploaded_at}},
+            {"uploaded_at": uploaded_at, "_id": {"$lt": last_id}},
+        ]
+    return query
+
+
+def list_projection():
+    """分页时需要 _id 生成游标"""
+    return {**RECORD_PROJECTION, "_id": 1}
+
+
+def split_page(records, limit: int):
+    """
+    按 limit + 1 条查询，多出的一条说明还有下一页
+    :return: (本页记录, 下一页游标或 None)
+    """
+    if len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    return records, encode_cursor(records[-1])
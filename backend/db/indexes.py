@@ -0,0 +1,133 @@
+"""
+MongoDB 索引管理
+
+db_util / async_db_util / auth_db 中的每个查询都需要有对应的索引，否则数据一多就会变成全集合扫描（COLLSCAN）。
+所有集合需要的索引都在 INDEXES 中声明，API 启动时和命令行都通过这里创建：
+- 已经存在的同名索引直接跳过，重复运行不会重建索引
+- 每个索引单独创建，某个索引失败（例如已有数据违反唯一约束）只记录错误，不影响其他索引和服务启动
+
+运行方式（在 backend 目录下）：
+    python -m db.indexes            # 创建缺少的索引
+    python -m db.indexes --check    # 只列出缺少的索引，不创建；有缺少时退出码为 1
+
+索引是否真正被查询使用由 test/check_query_plans.py 用 explain() 检查。
+"""
+import argparse
+import logging
+import sys
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from db.file_records import FILES_COLLECTION, FILE_INDEXES
+from db.user_records import USER_INDEXES
+
+logger = logging.getLogger(__name__)
+
+# 集合名 -> 需要的索引；索引都显式命名，按名称判断是否已经存在
+INDEXES = {
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # 不区分大小写的查找和唯一约束
+        *USER_INDEXES,
+        # delete_repo 从所有用户的 repos 中移除被删除的仓库
+        IndexModel([("repos", ASCENDING)], name="repos"),
+    ],
+    "repos": [
+        # 同一用户下仓库名称唯一（create_repo / update_repo_name）
+        IndexModel([("owner_id", ASCENDING), ("name", ASCENDING)], name="owner_name_unique", unique=True),
+    ],
+    "chats": [
+        # 每个用户在每个仓库中只有一条聊天记录
+        IndexModel([("user_id", ASCENDING), ("repo_id", ASCENDING)], name="user_repo_unique", unique=True),
+    ],
+    "json_res": [
+        IndexModel([("file_id", ASCENDING)], name="file_id_unique", unique=True),
+    ],
+    FILES_COLLECTION: FILE_INDEXES,
+}
+
+
+def _index_name(model: IndexModel) -> str:
+    return model.document["name"]
+
+
+def missing_indexes(existing_names, models):
+    """models 中名称不在 existing_names 里的索引"""
+    return [model for model in models if _index_name(model) not in existing_names]
+
+
+def _selected(collections):
+    return [(name, INDEXES[name]) for name in (collections or INDEXES)]
+
+
+def ensure_indexes(db, collections=None):
+    """
+    创建 INDEXES 中缺少的索引（pymongo 同步版本，供命令行和脚本使用）
+    :param collections: 只处理这些集合，None 表示全部
+    :return: (已创建的索引 {集合名: [索引名]}, 失败的索引 {集合名.索引名: 错误信息})
+    """
+    created, failed = {}, {}
+    for collection_name, models in _selected(collections):
+        collection = db[collection_name]
+        for model in missing_indexes(set(collection.index_information()), models):
+            try:
+                collection.create_indexes([model])
+            except OperationFailure as e:
+                failed[f"{collection_name}.{_index_name(model)}"] = str(e)
+                logger.error(f"创建索引 {collection_name}.{_index_name(model)} 失败: {e}")
+                continue
+            created.setdefault(collection_name, []).append(_index_name(model))
+    return created, failed
+
+
+async def ensure_indexes_async(db, collections=None):
+    """与 ensure_indexes 相同，db 为 Motor 数据库对象（API 启动时使用）"""
+    created, failed = {}, {}
+    for collection_name, models in _selected(collections):
+        collection = db[collection_name]
+        for model in missing_indexes(set(await collection.index_information()), models):
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                failed[f"{collection_name}.{_index_name(model)}"] = str(e)
+                logger.error(f"创建索引 {collection_name}.{_index_name(model)} 失败: {e}")
+                continue
+            created.setdefault(collection_name, []).append(_index_name(model))
+    return created, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="创建 MongoDB 集合需要的索引")
+    parser.add_argument("--check", action="store_true", help="只列出缺少的索引，不创建")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # 数据库连接在这里才导入，导入本模块（例如 API 启动时）不会额外创建同步客户端
+    from db.db_util import db
+
+    if args.check:
+        missing = {
+            name: [_index_name(model) for model in missing_indexes(set(db[name].index_information()), models)]
+            for name, models in INDEXES.items()
+        }
+        missing = {name: names for name, names in missing.items() if names}
+        for name, names in missing.items():
+            print(f"{name}: 缺少 {', '.join(names)}")
+        if not missing:
+            print("所有索引均已存在")
+        return 1 if missing else 0
+
+    created, failed = ensure_indexes(db)
+    for name, names in created.items():
+        print(f"{name}: 已创建 {', '.join(names)}")
+    for name, error in failed.items():
+        print(f"{name}: 创建失败 {error}", file=sys.stderr)
+    if not created and not failed:
+        print("所有索引均已存在")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
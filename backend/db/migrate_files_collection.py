@@ -0,0 +1,92 @@
+"""
+把仓库文档中内嵌的 files / results 数组迁移到 files 集合（见 file_records.py）
+
+运行方式（在 backend 目录下）：
+    python -m db.migrate_files_collection --dry-run      # 只统计，不写入
+    python -m db.migrate_files_collection                # 迁移并删除仓库文档中的数组
+    python -m db.migrate_files_collection --keep-arrays  # 迁移但保留数组，确认无误后再不带参数运行一次
+
+迁移是幂等的：记录按 file_id upsert，且只在插入时写入（$setOnInsert），
+已经存在的记录（包括迁移之后新上传或状态已更新的文件）不会被数组中的旧数据覆盖，中断后可以直接重新运行。
+"""
+import argparse
+import sys
+
+from pymongo import UpdateOne
+
+from db import db_util
+from db.file_records import FILES_COLLECTION, KIND_RESULT, KIND_SOURCE, new_file_record
+from db.indexes import ensure_indexes
+
+# 每批写入的记录数
+BATCH_SIZE = 1000
+
+_ARRAY_KINDS = (("files", KIND_SOURCE), ("results", KIND_RESULT))
+
+
+def record_ops(repo):
+    """把一个仓库文档中的数组元素转换为 upsert 操作"""
+    ops = []
+    for field, kind in _ARRAY_KINDS:
+        for item in repo.get(field) or []:
+            if not item.get("file_id"):
+                continue
+            record = new_file_record(
+                repo["_id"], item["file_id"], item.get("filename", ""), item.get("size", 0), kind,
+                sha256=item.get("sha256"), source_file=item.get("source_file") or False,
+                uploaded_at=item.get("uploaded_at"), status=item.get("status", "uploaded"),
+            )
+            ops.append(UpdateOne({"file_id": record["file_id"]}, {"$setOnInsert": record}, upsert=True))
+    return ops
+
+
+def migrate(db, dry_run=False, keep_arrays=False, batch_size=BATCH_SIZE):
+    """
+    :return: 统计信息 {repos, records, inserted, arrays_removed}
+    """
+    stats = {"repos": 0, "records": 0, "inserted": 0, "arrays_removed": 0}
+    if not dry_run:
+        ensure_indexes(db)
+
+    query = {"$or": [{"files": {"$exists": True}}, {"results": {"$exists": True}}]}
+    pending, migrated_repos = [], []
+
+    def flush():
+        if pending and not dry_run:
+            result = db[FILES_COLLECTION].bulk_write(pending, ordered=False)
+            stats["inserted"] += result.upserted_count
+        # 该批记录全部写入后才删除对应仓库的数组，中途失败时数组仍在，可以重新运行
+        if migrated_repos and not dry_run and not keep_arrays:
+            result = db.repos.update_many({"_id": {"$in": migrated_repos}}, {"$unset": {"files": "", "results": ""}})
+            stats["arrays_removed"] += result.modified_count
+        pending.clear()
+        migrated_repos.clear()
+
+    for repo in db.repos.find(query, {"files": 1, "results": 1}):
+        ops = record_ops(repo)
+        stats["repos"] += 1
+        stats["records"] += len(ops)
+        pending.extend(ops)
+        migrated_repos.append(repo["_id"])
+        if len(pending) >= batch_size:
+            flush()
+    flush()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把仓库文档中的 files / results 数组迁移到 files 集合")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要迁移的仓库和记录，不写入")
+    parser.add_argument("--keep-arrays", action="store_true", help="迁移后保留仓库文档中的数组")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每批写入的记录数")
+    args = parser.parse_args(argv)
+
+    stats = migrate(db_util.db, dry_run=args.dry_run, keep_arrays=args.keep_arrays, batch_size=args.batch_size)
+    prefix = "[dry-run] " if args.dry_run else ""
+    print(f"{prefix}仓库: {stats['repos']}，文件记录: {stats['records']}，"
+          f"新插入: {stats['inserted']}，已删除数组的仓库: {stats['arrays_removed']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
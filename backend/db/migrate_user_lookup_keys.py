@@ -0,0 +1,98 @@
+"""
+为已有用户补全小写的 username_lower / email_lower 字段（见 user_records.py），然后创建 users 集合的索引
+
+运行方式（在 backend 目录下）：
+    python -m db.migrate_user_lookup_keys --dry-run   # 只统计，不写入
+    python -m db.migrate_user_lookup_keys
+
+db_util / async_db_util 使用的数据库（db_config）和 auth_db 使用的数据库（MONGO_URI / DB_NAME）都会处理，
+两者相同时只处理一次。只有缺少字段的用户会被更新，重复运行是安全的。
+
+只有大小写不同的用户名或邮箱（例如 Alice 和 alice）在不区分大小写后是重复的，不能同时满足唯一索引：
+这些用户不会被更新，会逐一列出，处理（改名或合并账户）之后再重新运行；存在冲突时退出码为 1。
+"""
+import argparse
+import sys
+from collections import defaultdict
+
+from pymongo import MongoClient, UpdateOne
+
+from db import db_config
+from db.indexes import ensure_indexes
+from db.user_records import EMAIL_KEY, USERNAME_KEY, lookup_keys
+
+# 每批写入的用户数
+BATCH_SIZE = 1000
+
+
+def find_conflicts(users):
+    """
+    :param users: 所有用户文档（_id、username、email）
+    :return: {("username" 或 "email", 小写值): [_id, ...]}，只包含有多个用户的值
+    """
+    owners = defaultdict(list)
+    for user in users:
+        keys = lookup_keys(user.get("username"), user.get("email"))
+        owners[("username", keys[USERNAME_KEY])].append(user["_id"])
+        owners[("email", keys[EMAIL_KEY])].append(user["_id"])
+    return {key: ids for key, ids in owners.items() if key[1] is not None and len(ids) > 1}
+
+
+def backfill(db, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    :return: (统计信息 {users, missing, updated, conflicted}, 冲突 {(字段, 小写值): [_id, ...]})
+    """
+    users = list(db.users.find({}, {"username": 1, "email": 1, USERNAME_KEY: 1, EMAIL_KEY: 1}))
+    conflicts = find_conflicts(users)
+    conflicted_ids = {user_id for ids in conflicts.values() for user_id in ids}
+    stats = {"users": len(users), "missing": 0, "updated": 0, "conflicted": len(conflicted_ids)}
+
+    ops = []
+    for user in users:
+        keys = lookup_keys(user.get("username"), user.get("email"))
+        if all(user.get(key) == value for key, value in keys.items()):
+            continue
+        stats["missing"] += 1
+        if user["_id"] in conflicted_ids:
+            continue
+        ops.append(UpdateOne({"_id": user["_id"]}, {"$set": keys}))
+    if not dry_run:
+        for start in range(0, len(ops), batch_size):
+            result = db.users.bulk_write(ops[start:start + batch_size], ordered=False)
+            stats["updated"] += result.modified_count
+        ensure_indexes(db, collections=["users"])
+    return stats, conflicts
+
+
+def target_databases():
+    """需要处理的 (连接地址, 数据库名)，去掉重复"""
+    # auth_db 的连接参数在这里才导入；导入 auth_db 只创建 Motor 客户端对象，不会连接数据库
+    from db import auth_db
+    targets = [(db_config.DB_URL, db_config.DB_NAME), (auth_db.MONGO_URI, auth_db.DB_NAME)]
+    return list(dict.fromkeys(targets))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="为已有用户补全小写的用户名和邮箱字段")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要补全的用户和冲突，不写入")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每批写入的用户数")
+    args = parser.parse_args(argv)
+
+    has_conflicts = False
+    prefix = "[dry-run] " if args.dry_run else ""
+    for url, name in target_databases():
+        client = MongoClient(url, **db_config.client_options())
+        try:
+            stats, conflicts = backfill(client[name], dry_run=args.dry_run, batch_size=args.batch_size)
+        finally:
+            client.close()
+        print(f"{prefix}{name}: 用户 {stats['users']}，缺少小写字段 {stats['missing']}，"
+              f"已补全 {stats['updated']}，冲突 {stats['conflicted']}")
+        for (field, value), ids in conflicts.items():
+            print(f"  {field} '{value}' 不区分大小写后重复: {', '.join(str(user_id) for user_id in ids)}")
+        has_conflicts = has_conflicts or bool(conflicts)
+    return 1 if has_conflicts else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+"""
+用户名 / 邮箱不区分大小写的查找
+
+以前 auth_db 用 {"$regex": "^name$", "$options": "i"} 实现不区分大小写的查找：不区分大小写的正则无法利用普通索引，
+每次登录都要扫描整个 users 集合，输入中的正则特殊字符（. * + 等）也没有转义。
+现在用户文档额外保存小写的 username_lower / email_lower，并建有唯一索引（见 db/indexes.py），
+查找时先把输入转成小写再做等值查询，不再使用正则：
+
+    {
+        "username": "Alice", "username_lower": "alice",
+        "email": "Alice@Example.com", "email_lower": "alice@example.com",
+        ...
+    }
+
+db_util、async_db_util、auth_db 创建用户时都通过 lookup_keys 写入这两个字段；
+已有用户由 db/migrate_user_lookup_keys.py 补全。
+"""
+from pymongo import ASCENDING, IndexModel
+
+USERNAME_KEY = "username_lower"
+EMAIL_KEY = "email_lower"
+
+# 只对已经有小写字段的文档建唯一索引：补全之前的旧用户没有这两个字段，不会因为都缺少字段而违反唯一约束
+USER_INDEXES = [
+    IndexModel([(USERNAME_KEY, ASCENDING)], name="username_lower_unique", unique=True,
+               partialFilterExpression={USERNAME_KEY: {"$exists": True}}),
+    IndexModel([(EMAIL_KEY, ASCENDING)], name="email_lower_unique", unique=True,
+               partialFilterExpression={EMAIL_KEY: {"$exists": True}}),
+]
+
+
+def normalize(value):
+    """比较用的形式：去掉首尾空白并转成小写"""
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+def lookup_keys(username, email):
+    """创建用户时写入的小写字段"""
+    return {USERNAME_KEY: normalize(username), EMAIL_KEY: normalize(email)}
+
+
+def _field_query(field, key, value):
+    # 第二个条件按原字段精确匹配，补全之前创建的用户也能找到；两个条件各自使用索引
+    return [{key: normalize(value)}, {field: value}]
+
+
+def username_query(username):
+    return {"$or": _field_query("username", USERNAME_KEY, username)}
+
+
+def email_query(email):
+    return {"$or": _field_query("email", EMAIL_KEY, email)}
+
+
+def username_or_email_query(username_or_email):
+    return {"$or": _field_query("username", USERNAME_KEY, username_or_email)
+            + _field_query("email", EMAIL_KEY, username_or_email)}
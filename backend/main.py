@@ -23,6 +23,9 @@ from api.websocket import handle_websocket
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.websockets import WebSocketState
 from core.redis_manager import redis_manager  # 导入Redis管理器
+from db import async_db_util, auth_db  # 异步MongoDB客户端（Motor），应用关闭时释放连接池
+from db.indexes import ensure_indexes_async
+from core.password_hasher import PasswordHasherBusy, password_hasher
 from api.test_redis import router as test_redis_router  # 导入Redis测试路由
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
@@ -169,6 +172,18 @@ async def websocket_endpoint(websocket: WebSocket, repo_id: str):
             await websocket.close(code=1000)
 
 # 异常处理
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """
+    密码哈希线程池已满（登录 / 注册请求过多）时返回 503，客户端稍后重试
+    """
+    logger.warning(f"密码哈希线程池已满: {str(exc)}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "登录请求过多，请稍后重试"},
+        headers={"Retry-After": "1"}
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """
@@ -214,6 +229,11 @@ async def startup_event():
     """应用启动时的初始化操作"""
     # 初始化Redis连接池
     await redis_manager.init_redis_pool()
+    # 创建各集合缺少的索引（已存在时跳过，见 db/indexes.py）
+    await ensure_indexes_async(async_db_util.db)
+    # auth_db 使用单独配置的数据库（MONGO_URI / DB_NAME），其中的 users 集合同样需要索引
+    await ensure_indexes_async(auth_db.db, collections=["users"])
+    # 文件处理由独立的工作进程（worker.py）执行，API进程不再预热共享进程池
     logger.info("应用启动完成，Redis连接池已初始化")
 
 @app.on_event("shutdown")
@@ -221,7 +241,11 @@ async def shutdown_event():
     """应用关闭时的清理操作"""
     # 关闭Redis连接池
     await redis_manager.close()
-    logger.info("应用关闭，Redis连接池已关闭")
+    # 关闭MongoDB异步客户端的连接池
+    async_db_util.close()
+    auth_db.client.close()
+    password_hasher.shutdown()
+    logger.info("应用关闭，Redis连接池与MongoDB连接池已关闭")
 
 if __name__ == "__main__":
     # 当直接运行此文件时，启动开发服务器
@@ -11,7 +11,7 @@
 4. 关联处理结果与原始文件
 """
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 # 移除重复导入
@@ -33,6 +33,8 @@ class FileMetadata(BaseModel):
     size: int = Field(..., description="文件大小，单位为字节(bytes)")
     upload_date: datetime = Field(..., description="文件上传的日期和时间")
     status: str = Field(..., description="文件当前的处理状态，如'uploaded'、'processing'、'completed'等")
+    sha256: Optional[str] = Field(None, description="文件内容的SHA-256，上传时计算；较早上传的文件没有该字段")
+    source_file: Optional[str] = Field(None, description="结果文件对应的源文件ID；源文件为空")
     
     class Config:
         """
@@ -52,6 +54,17 @@ class FileMetadata(BaseModel):
         # 允许从字典创建模型实例时使用别名字段名
         allow_population_by_field_name = True
 
+class FileListResponse(BaseModel):
+    """
+    文件分页列表模型
+    
+    用于分页获取仓库中的源文件或结果文件。
+    文件按上传时间从新到旧排列，next_cursor 不为空时带上它请求下一页。
+    """
+    items: List[FileMetadata] = Field(..., description="本页的文件")
+    next_cursor: Optional[str] = Field(None, description="下一页的游标，为空表示没有更多文件")
+    total: int = Field(..., description="文件总数")
+
 class JsonRes(BaseModel):
     """
     JSON结果模型
@@ -47,6 +47,8 @@ class RepoResponse(BaseModel):
     
     用于返回仓库详细信息。
     包含仓库的基本信息、协作者列表、文件列表和处理结果列表。
+    files / results 按上传先后包含全部文件，与迁移到 files 集合之前的结构相同；
+    files_total / results_total 为总数，新代码应使用分页接口获取文件列表。
     
     这个模型用于:
     1. 获取单个仓库详情API
@@ -60,6 +62,8 @@ class RepoResponse(BaseModel):
     collaborators: List[str] = []
     files: List[Dict] = []
     results: List[Dict] = []
+    files_total: int = Field(0, description="仓库中源文件的总数")
+    results_total: int = Field(0, description="仓库中结果文件的总数")
 
     class Config:
         """
@@ -93,7 +97,9 @@ class RepoResponse(BaseModel):
                         "uploaded_at": "2023-06-01T12:05:00",
                         "status": "completed"
                     }
-                ]
+                ],
+                "files_total": 1,
+                "results_total": 1
             }
         }
 
@@ -1,11 +1,14 @@
 from .GeneralProcess import *
 from .MyFunctions import *
+from .ResultCache import CLASSIFICATION, get_result_cache, hash_text
+from .StructureDetector import STRUCTURE_CONFIDENCE_THRESHOLD, detect_structure
 import logging
 import threading
 import time
-import functools
 import os
+import json
 import concurrent.futures
+from collections import OrderedDict
 from pathlib import Path
 
 # 定义结构化级别常量
@@ -14,47 +17,168 @@ StructureLevels = ["结构化数据", "半结构化数据", "非结构化数据"
 # 线程本地存储
 thread_local = threading.local()
 
-# 为避免重复调用API，使用缓存装饰器
-def lru_cache_with_timeout(maxsize=128, timeout=3600):
+# 分类缓存的默认参数，可通过环境变量覆盖
+CLASSIFY_CACHE_SIZE = int(os.getenv("CLASSIFY_CACHE_SIZE", "1000"))
+CLASSIFY_CACHE_TTL = int(os.getenv("CLASSIFY_CACHE_TTL", "1800"))  # 30分钟
+# 开启后分类结果同时写入 Redis，供多个工作进程和多个服务实例共享
+CLASSIFY_CACHE_REDIS = os.getenv("CLASSIFY_CACHE_REDIS", "0").lower() in ("1", "true", "yes")
+
+# 表示缓存未命中的哨兵值（缓存值本身可能是任意对象）
+_MISSING = object()
+
+class TTLCache:
     """
-    带超时的LRU缓存装饰器
+    带逐条过期的线程安全LRU缓存
     
     功能：
-    - 缓存API调用结果，减少重复请求
-    - 设置超时时间，定期更新缓存
-    - 线程安全的缓存实现
+    - 每个条目单独记录过期时间，过期只影响该条目本身
+    - 超过容量时淘汰最久未访问的条目
+    - 读操作不加锁：依赖GIL保证单个OrderedDict操作的原子性，写入和淘汰才持有锁
+    - 单飞去重：多个线程同时未命中同一个键时，只有一个线程真正执行计算，其余线程等待其结果
+    - 可选的共享后端（如Redis），本地未命中时先查后端，计算结果同时写回后端
     
     参数：
         maxsize: 最大缓存项数
-        timeout: 缓存超时时间（秒）
+        ttl: 条目存活时间（秒）
+        backend: 可选的共享后端，需提供 get(key) 和 set(key, value, ttl)
     """
-    def wrapper_cache(func):
-        # 创建标准的LRU缓存
-        func = functools.lru_cache(maxsize=maxsize)(func)
-        # 保存最后访问时间
-        func.lifetime = {}
-        func.cache_lock = threading.RLock()
+    def __init__(self, maxsize=128, ttl=3600, backend=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.backend = backend
+        self._data = OrderedDict()  # key -> (过期时间, 值)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> 正在计算该键的 Future
+        self.stats = {"hits": 0, "misses": 0, "backend_hits": 0, "waits": 0}
+    
+    def get(self, key, default=None):
+        """读取本地缓存，未命中或已过期时返回default（不加锁）"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            with self._lock:
+                # 只删除读到的那个条目，避免误删其他线程刚写入的新值
+                if self._data.get(key) is entry:
+                    del self._data[key]
+            return default
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            # 条目刚好被其他线程淘汰，本次读取的值仍然有效
+            pass
+        return value
+    
+    def set(self, key, value, write_backend=True):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        if write_backend and self.backend is not None:
+            self.backend.set(key, value, self.ttl)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        读取缓存，未命中时调用compute计算并写入缓存
         
-        @functools.wraps(func)
-        def wrapped_func(*args, **kwargs):
-            # 检查缓存是否超时
-            now = time.time()
-            with func.cache_lock:
-                # 检查键是否在缓存中
-                key = functools._make_key(args, kwargs, typed=False)
-                if key in func.lifetime and now - func.lifetime[key] > timeout:
-                    # 超时，删除缓存项
-                    func.cache_info()  # 必须先调用，刷新内部状态
-                    func.cache_clear()
-                    func.lifetime.clear()
-                
-                # 调用函数并更新访问时间
-                result = func(*args, **kwargs)
-                func.lifetime[key] = now
-                return result
-                
-        return wrapped_func
-    return wrapper_cache
+        参数：
+            key: 缓存键
+            compute: 无参函数，返回要缓存的值；调用期间不持有任何锁
+            should_cache: 可选的判断函数，返回False的结果不写入缓存（例如接口出错时的默认值）
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats["hits"] += 1
+            return value
+        
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+        
+        if not leader:
+            # 已有线程在计算同一个键，等待它的结果而不是重复调用
+            self.stats["waits"] += 1
+            return future.result()
+        
+        try:
+            value = self._load_or_compute(key, compute, should_cache)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+    
+    def _load_or_compute(self, key, compute, should_cache):
+        # 等锁期间可能已有其他线程写入了结果
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.stats["hits"] += 1
+            return value
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self.stats["backend_hits"] += 1
+                self.set(key, value, write_backend=False)
+                return value
+        self.stats["misses"] += 1
+        value = compute()
+        if should_cache is None or should_cache(value):
+            self.set(key, value)
+        return value
+
+class RedisCacheBackend:
+    """
+    基于Redis的共享缓存后端
+    
+    使用 core.redis_manager 提供的同步客户端，值以JSON存储。
+    Redis不可用时只记录日志并视为未命中，不影响分类流程。
+    """
+    def __init__(self, prefix="classify:"):
+        self.prefix = prefix
+    
+    def _client(self):
+        from core.redis_manager import redis_manager
+        return redis_manager.sync_redis
+    
+    def get(self, key):
+        try:
+            data = self._client().get(self.prefix + key)
+            return json.loads(data) if data else None
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"读取Redis分类缓存失败: {str(e)}")
+            return None
+    
+    def set(self, key, value, ttl):
+        try:
+            self._client().set(self.prefix + key, json.dumps(value, ensure_ascii=False), ex=ttl)
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"写入Redis分类缓存失败: {str(e)}")
+
+# 全局分类缓存：键为文本内容的SHA-256，跨进程、跨重启保持稳定
+classification_cache = TTLCache(
+    maxsize=CLASSIFY_CACHE_SIZE,
+    ttl=CLASSIFY_CACHE_TTL,
+    backend=RedisCacheBackend() if CLASSIFY_CACHE_REDIS else None
+)
 
 # 获取线程安全的日志记录器
 def get_logger():
@@ -89,28 +213,52 @@ def get_logger():
     return thread_local.logger
 
 # 缓存的模型查询函数
-@lru_cache_with_timeout(maxsize=1000, timeout=1800)  # 缓存1000条记录，超时30分钟
 def cached_query_model(content_hash, content):
     """
     带缓存的模型查询函数
     
     功能：
-    - 使用哈希值作为键缓存查询结果
-    - 减少对大语言模型的重复调用
-    - 提高分类效率，降低API成本
+    - 使用内容的SHA-256作为键缓存查询结果，同一文本在任何进程中的键都相同
+    - 多个线程同时分类同一文本时只调用一次模型
+    - 接口出错时返回默认分类，但不写入缓存，下次会重新查询
     
     参数：
-        content_hash: 内容哈希值，用于缓存
+        content_hash: 内容的SHA-256（hash_text(content)）
         content: 待分类的文本内容
         
     返回：
         str: 分类结果
     """
+    level = classification_cache.get_or_compute(
+        content_hash,
+        lambda: query_structure_level(content_hash, content),
+        should_cache=lambda level: level is not None
+    )
+    return level or "非结构化数据"
+
+def query_structure_level(content_hash, content):
+    """
+    调用大语言模型判断文本的结构化程度
+    
+    功能：
+    - 先查持久化结果缓存，跨重启复用之前的分类结果
+    - 未命中时调用GLM模型，并将有效答案写入持久化缓存
+    
+    返回：
+        str: 分类结果；接口出错或答案无法识别时返回None
+    """
     logger = get_logger()
     
+    # 先查持久化缓存，跨进程、跨重启复用之前的分类结果
+    cache = get_result_cache()
+    level = cache.get(CLASSIFICATION, content_hash)
+    if level in StructureLevels:
+        logger.info(f"命中分类缓存 (hash: {content_hash[:12]}): {level}")
+        return level
+    
     try:
         # 调用大语言模型API接口
-        logger.info(f"调用模型API分类文本 (hash: {content_hash})")
+        logger.info(f"调用模型API分类文本 (hash: {content_hash[:12]})")
         
         # 使用GLM-4或其他模型进行分类
         response = client.chat.completions.create(
@@ -139,23 +287,25 @@ def cached_query_model(content_hash, content):
         for level in StructureLevels:
             if level in answer:
                 logger.info(f"模型分类结果: {level}")
+                # 只缓存模型给出的有效答案，接口出错时的默认分类不写入缓存
+                cache.set(CLASSIFICATION, content_hash, level)
                 return level
                 
-        # 如果结果不在预期范围内，返回默认值
+        # 如果结果不在预期范围内，由调用方使用默认分类
         logger.warning(f"模型返回了意外的答案: {answer}，使用默认分类")
-        return "非结构化数据"  # 默认为非结构化数据
+        return None
         
     except Exception as e:
         logger.error(f"调用模型API出错: {str(e)}")
-        # 出错时返回默认分类
-        return "非结构化数据"
+        # 出错时由调用方使用默认分类
+        return None
 
-def Classify(InputPath, OutputPath):
+def Classify(InputPath, OutputPath, progress_callback=None):
     """
     用于将不同的txt文件按照结构化程度进行分类
     
     优化点：
-    - 批量处理文件提高效率
+    - 有界的在途任务窗口持续向线程池供给任务，单个慢请求不会拖住其余文件
     - 使用线程池并行处理
     - 添加缓存减少API调用
     - 详细的日志和错误处理
@@ -163,6 +313,7 @@ def Classify(InputPath, OutputPath):
     参数：
         InputPath: 输入文本目录
         OutputPath: 输出分类目录
+        progress_callback: 可选的进度回调，每完成一个文件调用一次 progress_callback(已完成数, 总数)
     """
     # 获取线程安全的日志记录器
     logger = get_logger()
@@ -202,8 +353,8 @@ def Classify(InputPath, OutputPath):
         max_workers = min(max(2, multiprocessing.cpu_count()), 10)
         logger.info(f"使用 {max_workers} 个线程并行分类")
         
-        # 批量处理大小
-        batch_size = 5
+        # 在途任务上限：比线程数多一些，保证线程空出来时总有任务可取，同时避免一次性提交所有文件
+        max_in_flight = max_workers * 2
         
         # 记录处理统计
         processed = 0
@@ -212,24 +363,30 @@ def Classify(InputPath, OutputPath):
         unstructured_count = 0
         error_count = 0
         
-        # 使用线程池并行处理文件
+        # 使用线程池并行处理文件：任一任务完成就立即补充新任务，慢请求不会阻塞其他线程
+        pending_files = iter(files_to_process)
+        future_to_file = {}
         with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 分批处理文件
-            for i in range(0, total_files, batch_size):
-                batch_files = files_to_process[i:min(i+batch_size, total_files)]
-                
-                # 创建任务
-                future_to_file = {
-                    executor.submit(classify_single_file, filepath, SD, SSD, USD): filepath
-                    for filepath in batch_files
-                }
-                
-                # 处理批次结果
-                for future in concurrent.futures.as_completed(future_to_file):
-                    filepath = future_to_file[future]
+            
+            def submit_next():
+                filepath = next(pending_files, None)
+                if filepath is not None:
+                    future_to_file[executor.submit(classify_single_file, filepath, SD, SSD, USD)] = filepath
+                return filepath is not None
+            
+            # 先填满在途窗口
+            for _ in range(max_in_flight):
+                if not submit_next():
+                    break
+            
+            while future_to_file:
+                done, _ = concurrent.futures.wait(future_to_file, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    filepath = future_to_file.pop(future)
+                    # 有任务完成就补充一个，保持线程池满载
+                    submit_next()
                     try:
                         result = future.result()
-                        processed += 1
                         
                         # 更新统计信息
                         if result == "结构化数据":
@@ -238,15 +395,17 @@ def Classify(InputPath, OutputPath):
                             semi_structured_count += 1
                         elif result == "非结构化数据":
                             unstructured_count += 1
-                            
-                        # 每处理5个文件或达到总数时打印进度
-                        if processed % 5 == 0 or processed == total_files:
-                            progress = processed * 100 / total_files
-                            logger.info(f"已分类 {processed}/{total_files} 文件 ({progress:.1f}%)")
-                            
                     except Exception as e:
                         logger.error(f"分类文件 {filepath} 时出错: {str(e)}")
                         error_count += 1
+                    
+                    processed += 1
+                    if progress_callback is not None:
+                        progress_callback(processed, total_files)
+                    # 每处理5个文件或达到总数时打印进度
+                    if processed % 5 == 0 or processed == total_files:
+                        progress = processed * 100 / total_files
+                        logger.info(f"已分类 {processed}/{total_files} 文件 ({progress:.1f}%)，在途 {len(future_to_file)} 个")
         
         # 计算处理时间
         end_time = time.time()
@@ -259,6 +418,28 @@ def Classify(InputPath, OutputPath):
     except Exception as e:
         logger.error(f"分类处理过程中出现未捕获的异常: {str(e)}")
 
+def classify_content(content):
+    """
+    判断文本的结构化程度
+    
+    功能：
+    - 先用本地规则预判（表格、JSON/XML、键值对、自然语言句子）
+    - 本地置信度达到 STRUCTURE_CONFIDENCE_THRESHOLD 时直接采用，不调用远程模型
+    - 否则交给带缓存的模型查询
+    
+    参数：
+        content: 待分类的文本内容
+        
+    返回：
+        str: 分类结果
+    """
+    level, confidence = detect_structure(content)
+    if confidence >= STRUCTURE_CONFIDENCE_THRESHOLD:
+        get_logger().info(f"本地预判分类结果: {level} (置信度: {confidence})")
+        return level
+    # 计算内容的SHA-256，用作缓存键
+    return cached_query_model(hash_text(content), content)
+
 def classify_single_file(filepath, sd_dir, ssd_dir, usd_dir):
     """
     分类单个文本文件
@@ -286,11 +467,9 @@ def classify_single_file(filepath, sd_dir, ssd_dir, usd_dir):
         # 读取文件内容
         try:
             content = filepath.read_text(encoding='utf-8')
-            # 计算内容哈希值，用于缓存
-            content_hash = hash(content)
             
-            # 调用缓存的查询函数
-            classification = cached_query_model(content_hash, content)
+            # 先本地预判，特征不明显时才调用缓存的模型查询
+            classification = classify_content(content)
         except Exception as e:
             logger.error(f"读取文件 {filepath} 时出错: {str(e)}")
             
@@ -319,10 +498,7 @@ def QuiryModel(content):
         str: 分类结果
     """
     try:
-        # 计算内容哈希值
-        content_hash = hash(content)
-        # 调用缓存的查询函数
-        return cached_query_model(content_hash, content)
+        return classify_content(content)
     except Exception as e:
         logger = get_logger()
         logger.error(f"查询模型时出错: {str(e)}")
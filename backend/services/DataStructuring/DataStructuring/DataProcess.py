@@ -2,6 +2,7 @@
 from .GeneralProcess import *
 from .ParticularProcess import *
 from .MyFunctions import *
+from .ResultCache import SOURCE_TEXT, get_result_cache, hash_file
 import filetype
 import os
 import re
@@ -172,6 +173,16 @@ def process_single_file(filepath, TextPath, result_queue):
     """
     logger = get_thread_logger()
     try:
+        # 相同内容的文件已经抽取过文本时直接复用，不再调用外部接口
+        cache = get_result_cache()
+        source_hash = hash_file(filepath)
+        content = cache.get(SOURCE_TEXT, source_hash)
+        if content:
+            logger.info(f"命中文本缓存: {filepath}")
+            text_file_path = write_source_text(filepath, TextPath, content)
+            result_queue.put({"success": True, "cached": True, "path": filepath, "output": text_file_path})
+            return True
+
         # 识别文件类型
         file_type = FileTypeRecognize(filepath)
         
@@ -201,12 +212,8 @@ def process_single_file(filepath, TextPath, result_queue):
             return False
             
         # 创建文本文件名并写入内容
-        file_name = os.path.basename(filepath)
-        text_file_name = pattern_substitute(file_name, ".txt")
-        text_file_path = os.path.join(TextPath, text_file_name)
-        
-        # 写入文本内容
-        write_to_txt_os(text_file_path, content)
+        text_file_path = write_source_text(filepath, TextPath, content)
+        cache.set(SOURCE_TEXT, source_hash, content)
         
         # 记录成功结果
         result_queue.put({"success": True, "path": filepath, "output": text_file_path})
@@ -216,4 +223,17 @@ def process_single_file(filepath, TextPath, result_queue):
         # 记录错误
         logger.error(f"处理文件异常: {filepath}: {str(e)}")
         result_queue.put({"success": False, "reason": "exception", "error": str(e), "path": filepath})
-        return False
\ No newline at end of file
+        return False
+
+def write_source_text(filepath, TextPath, content):
+    """
+    将源文件抽取出的文本写入文本目录，文件名与源文件相同、后缀改为 .txt
+    
+    返回：
+        str: 文本文件路径
+    """
+    file_name = os.path.basename(filepath)
+    text_file_name = pattern_substitute(file_name, ".txt")
+    text_file_path = os.path.join(TextPath, text_file_name)
+    write_to_txt_os(text_file_path, content)
+    return text_file_path
\ No newline at end of file
@@ -0,0 +1,235 @@
+# ===== DataStructuring/FieldExtractor.py =====
+# 批量字段抽取引擎：一次（或按分类分组的少数几次）结构化输出调用抽取一个文档的全部表头字段
+#
+# 原先 txt_to_excel 对每个文本文件的 30 个字段逐个请求 Ollama，单个文档需要 30 次往返。
+# 这里改为：
+# 1. 按表头大分类把字段分成少数几组，每组一次请求，要求模型以 JSON 形式返回该组所有字段
+# 2. 解析 JSON 并逐字段校验、归一化（交易类型映射、金额取数字等，规则与原逐字段逻辑一致）
+# 3. 只有校验失败的字段才退回到原来的逐字段提示词单独请求
+from .MyFunctions import FIELD_DEFINITIONS, get_prompt
+import json
+import logging
+import re
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 定义 Ollama API 地址与模型
+OLLAMA_API_URL = "http://localhost:11434/api/generate"
+OLLAMA_MODEL = "wangshenzhi/llama3-8b-chinese-chat-ollama-q4:v1"
+
+# 需要抽取的全部字段（顺序即输出顺序）
+FIELD_NAMES = ['交易ID', '交易类型', '交易金额', '交易币种', '交易频率', '小额交易', '设备信息',
+    '交易时间', '操作时长', '初始账户旧余额', '初始账户新余额', '初始账户开户信息',
+    '初始账户信用等级', '初始账户地址', '初始账户年龄', '初始账户职业', '初始账户教育水平',
+    '初始账户联系方式', '目标账户名', '目标账户旧余额', '目标账户新余额', '目标账户开户信息',
+    '目标账户信用等级', '目标账户地址', '目标账户年龄',
+    '目标账户职业', '目标账户教育水平', '目标账户联系方式', '是否欺诈', '是否标记为欺诈']
+
+# 按表头大分类分组，每组一次请求；组数越少往返越少，但单次输出越长、越容易出错
+FIELD_GROUPS = [
+    FIELD_NAMES[0:9],    # 本次交易 / 相关交易 / 操作信息
+    FIELD_NAMES[9:18],   # 初始账户
+    FIELD_NAMES[18:30],  # 目标账户 / 欺诈检测
+]
+
+# 数值型字段：只保留第一个数字，缺失时记为 0
+NUMERIC_FIELDS = {'交易金额', '初始账户旧余额', '初始账户新余额', '目标账户旧余额', '目标账户新余额'}
+
+# 交易类型的候选项（与逐字段提示词中的 A-E 选项一一对应）
+TRANSACTION_TYPES = {'A': '存款', 'B': '取款', 'C': '转账', 'D': '支付', 'E': '借记'}
+
+MISSING_VALUE = '无'
+
+_NUMBER_PATTERN = re.compile(r'(\d+\.\d+|\d+)')
+
+# 复用 TCP 连接，避免每次请求重新握手
+_session = requests.Session()
+
+
+def build_request_payload(prompt, json_format=False):
+    """
+    构造 Ollama /api/generate 的请求体，同步与异步客户端共用
+
+    参数：
+        prompt: 完整提示词
+        json_format: 是否要求模型输出 JSON（Ollama 的结构化输出模式）
+    """
+    data = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": False,
+        "temperature": 0,
+        "num_predict": 1,
+        "top_k": 1,
+        "top_p": 1.0
+    }
+    if json_format:
+        # 批量抽取需要完整输出所有字段，因此不能沿用单字段请求的参数
+        data["format"] = "json"
+        data.pop("num_predict")
+        data["options"] = {"temperature": 0, "top_k": 1, "top_p": 1.0}
+    return data
+
+
+def get_ollama_response(prompt, json_format=False, timeout=None):
+    """
+    向 Ollama API 发送请求并获取响应
+
+    参数：
+        prompt: 完整提示词
+        json_format: 是否要求模型输出 JSON
+        timeout: 请求超时时间（秒），None 表示不限制
+
+    返回：
+        str: 模型回答，请求失败时返回 None
+    """
+    try:
+        response = _session.post(OLLAMA_API_URL, json=build_request_payload(prompt, json_format), timeout=timeout)
+        response.raise_for_status()
+        result = response.json()
+        return result.get("response", "")
+    except requests.RequestException as e:
+        logger.warning(f"请求 Ollama API 时出错: {e}")
+        return None
+
+
+def build_group_prompt(fields, content):
+    """构造一次抽取多个字段的提示词，要求模型返回以字段名为键的 JSON 对象"""
+    lines = []
+    for field in fields:
+        definition = FIELD_DEFINITIONS.get(field, {})
+        if field == '交易类型':
+            options = '、'.join(TRANSACTION_TYPES.values())
+            lines.append(f'- "{field}": {definition.get("解释", "")} 只能从 {options} 中选择一个')
+        else:
+            examples = '，'.join(definition.get("示例", []))
+            lines.append(f'- "{field}": {definition.get("解释", "")} 示例：{examples}')
+    keys = '\n'.join(lines)
+    return (
+        "请从目标文本中提取以下指标，并严格以 JSON 对象输出，键为指标名称，值为字符串。\n"
+        f"不要输出任何多余信息和提示，若文本中没有相关信息，对应的值输出“{MISSING_VALUE}”。\n"
+        f"指标列表：\n{keys}\n"
+        f"目标文本内容为：{content}"
+    )
+
+
+def parse_json_response(response):
+    """
+    解析模型返回的 JSON，兼容 ```json 代码块和前后多余文字
+
+    返回：
+        dict: 解析结果，无法解析时返回空字典
+    """
+    if not response:
+        return {}
+    text = response.strip()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find('{'), text.rfind('}')
+        if start == -1 or end <= start:
+            return {}
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return {}
+    return data if isinstance(data, dict) else {}
+
+
+def normalize_field(field, response):
+    """
+    将模型对某个字段的回答归一化为写入表格的内容（与原逐字段逻辑保持一致）
+
+    返回：
+        str: 归一化后的内容；response 为 None 时返回 '无'
+    """
+    if response is None:
+        return MISSING_VALUE
+    response = str(response).strip()
+    if field == '交易类型':
+        if response in TRANSACTION_TYPES.values():
+            return response
+        if 'A' in response or 'a' in response or '存款' in response:
+            response = '存款'
+        elif 'B' in response or 'b' in response or '取款' in response:
+            response = '取款'
+        elif 'C' in response or 'c' in response or '转账' in response:
+            response = '转账'
+        elif 'D' in response or 'd' in response or '支付' in response:
+            response = '支付'
+        elif 'E' in response or 'e' in response or '借记' in response:
+            response = '借记'
+        else:
+            response = MISSING_VALUE
+    if field in NUMERIC_FIELDS:
+        # 保证不出现空行，只提供第一个数字就好
+        matches = _NUMBER_PATTERN.findall(response)
+        response = matches[0] if matches else '0'
+    # 空行全部替换为空格
+    return response.replace('\n', ' ')
+
+
+def validate_field(field, value):
+    """
+    校验批量结果中某个字段的原始值是否可用
+
+    不可用的情况：缺失、不是标量、数值字段既不是数字也不是“无”、交易类型无法识别。
+    不可用的字段会退回逐字段请求。
+    """
+    if value is None or isinstance(value, (dict, list)):
+        return False
+    text = str(value).strip()
+    if not text:
+        return False
+    if field in NUMERIC_FIELDS:
+        return text == MISSING_VALUE or bool(_NUMBER_PATTERN.search(text))
+    if field == '交易类型':
+        return text == MISSING_VALUE or text in TRANSACTION_TYPES.values() or text.upper() in TRANSACTION_TYPES
+    return True
+
+
+def collect_group_results(fields, response, results, failed):
+    """解析一组字段的批量回答：通过校验的写入 results，其余字段名追加到 failed"""
+    data = parse_json_response(response)
+    for field in fields:
+        value = data.get(field)
+        if validate_field(field, value):
+            results[field] = normalize_field(field, value)
+        else:
+            failed.append(field)
+
+
+def extract_fields(content, groups=None, fallback=True):
+    """
+    抽取一个文档的全部表头字段
+
+    参数：
+        content: 文档文本
+        groups: 字段分组，默认 FIELD_GROUPS；传入 [FIELD_NAMES] 即单次请求抽取全部字段
+        fallback: 是否对校验失败的字段退回逐字段请求
+
+    返回：
+        dict: {字段名: 归一化后的内容}，包含 groups 中的所有字段
+    """
+    groups = groups if groups is not None else FIELD_GROUPS
+    results = {}
+    failed = []
+
+    for fields in groups:
+        response = get_ollama_response(build_group_prompt(fields, content), json_format=True)
+        collect_group_results(fields, response, results, failed)
+
+    if failed:
+        logger.info(f"批量抽取有 {len(failed)} 个字段未通过校验，逐字段重试: {failed}")
+    for field in failed:
+        if not fallback:
+            results[field] = MISSING_VALUE
+            continue
+        try:
+            results[field] = normalize_field(field, get_ollama_response(get_prompt(field) + content))
+        except Exception as e:
+            logger.warning(f"逐字段抽取 {field} 失败: {e}")
+            results[field] = MISSING_VALUE
+
+    return results
@@ -19,9 +19,23 @@ def GeneralFile(filepath):
     .PDF .DOCX .DOC .XLS .XLSX .PPT .PPTX .PNG .JPG .JPEG .CSV .PY .TXT .MD .BMP .GIF
     返回值为文件内容的字符串
     """
-    delete_uploaded_files()
     # filepath=f"./pictures/pic1.png"
-    file_object = client.files.create(file=Path(filepath), purpose="file-extract")
+    return extract_file_content(Path(filepath))
+
+
+def GeneralBytes(filename, data):
+    """
+    GeneralBytes函数与GeneralFile相同，但直接接收内存中的文件内容，不需要先把文件写到磁盘
+    filename 用于让接口识别文件格式，data 为文件的二进制内容
+    返回值为文件内容的字符串
+    """
+    return extract_file_content((filename, data))
+
+
+def extract_file_content(file):
+    """上传文件（路径或 (文件名, 二进制内容) 元组）到智谱接口并抽取文本内容"""
+    delete_uploaded_files()
+    file_object = client.files.create(file=file, purpose="file-extract")
     # 文件内容抽取
     file_content = client.files.content(file_id=file_object.id).content.decode()
     # #print(file_content)
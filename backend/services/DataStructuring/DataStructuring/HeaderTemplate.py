@@ -0,0 +1,70 @@
+# ===== DataStructuring/HeaderTemplate.py =====
+# 表头模板：每个进程只解析一次 表头初版汇总.xlsx
+#
+# 原先每写一个结果文件都要重新 pd.read_excel 模板，再做 30 次布尔掩码赋值，
+# 批量处理几百个文件时 openpyxl 的重复解析开销很明显。
+# 这里把模板编译成一个只读对象（大分类、字段顺序、字段到行号的映射），
+# 每个文件只需按行号把结果填进预分配的列表，再一次性构造 DataFrame 写出。
+from functools import lru_cache
+import os
+import pandas as pd
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '表头初版汇总.xlsx')
+
+CATEGORY_COLUMN = '大分类'
+FIELD_COLUMN = '表头中具体条目'
+CONTENT_COLUMN = '内容'
+
+
+class HeaderTemplate:
+    """
+    编译后的表头模板
+
+    属性：
+        categories: 每一行的大分类（合并单元格只有首行有值，其余为 None）
+        fields: 每一行的具体条目，顺序与模板一致
+        row_index: {具体条目: 行号}
+    """
+
+    def __init__(self, categories, fields):
+        self.categories = tuple(categories)
+        self.fields = tuple(fields)
+        self.row_index = {field: i for i, field in enumerate(self.fields)}
+
+    @classmethod
+    def from_excel(cls, path=TEMPLATE_FILE):
+        target = pd.read_excel(path)
+        categories = [None if pd.isna(value) else value for value in target[CATEGORY_COLUMN]]
+        return cls(categories, target[FIELD_COLUMN].tolist())
+
+    def build_contents(self, values, default=None):
+        """
+        按模板行顺序排列一个文档的抽取结果
+
+        参数：
+            values: {具体条目: 内容}，模板中没有的键会被忽略
+            default: 模板中有、但 values 中没有的条目的取值
+        """
+        contents = [default] * len(self.fields)
+        for field, value in values.items():
+            row = self.row_index.get(field)
+            if row is not None:
+                contents[row] = value
+        return contents
+
+    def to_frame(self, values, default=None):
+        """构造与模板结构一致、已填好内容列的 DataFrame"""
+        return pd.DataFrame({
+            CATEGORY_COLUMN: pd.Series(self.categories, dtype=object),
+            FIELD_COLUMN: pd.Series(self.fields, dtype=object),
+            CONTENT_COLUMN: pd.Series(self.build_contents(values, default), dtype=object),
+        })
+
+    def write_excel(self, values, target_file, default=None):
+        self.to_frame(values, default).to_excel(target_file, index=False)
+
+
+@lru_cache(maxsize=None)
+def get_header_template(path=TEMPLATE_FILE):
+    """获取编译后的表头模板，同一进程内只读取一次"""
+    return HeaderTemplate.from_excel(path)
@@ -175,8 +175,8 @@ def copy_file(source_file, destination_folder):
     except Exception as e:
         print(f"复制文件时出现错误: {e}")
 
-def get_prompt(context):
-    context_all={
+# 各个表头指标的解释与示例，供逐字段提示词与批量抽取提示词共用
+FIELD_DEFINITIONS={
     "交易ID": {
         "解释": "每笔交易的唯一标识符。",
         "示例": ["TX202405100001", "TX202406150002", "TX202407200003"]
@@ -300,7 +300,9 @@ def get_prompt(context):
         "示例": ["0", "1"]
     }
 }
-    content=context_all[context]
+
+def get_prompt(context):
+    content=FIELD_DEFINITIONS[context]
     if context=="交易类型":
         return f"请提取并只输出给定文本中的{context}指标，其中{context}指标含义为{content['解释']}，\n严格从我给的五个选项中进行选择，不要输出任何多余信息，输出为一个大写字母，选项包括 A.存款，B.取款，C.转账，D.支付，E.借记;\n目标文本内容为："
     
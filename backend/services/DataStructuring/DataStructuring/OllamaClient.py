@@ -0,0 +1,222 @@
+# ===== DataStructuring/OllamaClient.py =====
+# 基于 asyncio + httpx 的 Ollama 并发客户端
+#
+# 同步的 get_ollama_response 一次只能发出一个请求，30 个字段（以及多个文件）只能排队执行。
+# 这里提供：
+# - 共享的 keep-alive 连接池（同一个 httpx.AsyncClient）
+# - 可配置的在途请求上限（asyncio.Semaphore），避免压垮 Ollama
+# - 单次请求超时与带指数退避的重试
+# - 字段抽取的异步版本：同一文件的各组字段、以及多个文件的字段同时派发
+# - 可选的取消令牌：抽取期间在后台线程中轮询，任务被取消后立即取消所有在途和排队的请求
+from .FieldExtractor import (
+    FIELD_GROUPS, MISSING_VALUE, OLLAMA_API_URL,
+    build_group_prompt, build_request_payload, collect_group_results, normalize_field,
+)
+from .MyFunctions import get_prompt
+import asyncio
+import concurrent.futures
+import logging
+import os
+import random
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 默认参数，可通过环境变量覆盖
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+DEFAULT_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+DEFAULT_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+DEFAULT_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+
+# 这些状态码说明服务端暂时不可用，值得重试；其余 4xx 重试也不会成功
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class AsyncOllamaClient:
+    """
+    Ollama 异步客户端
+
+    用法：
+        async with AsyncOllamaClient(max_concurrency=8) as client:
+            text = await client.generate(prompt)
+
+    属性 stats 记录请求数、重试数、失败数和观察到的最大在途请求数，便于压测时核对并发上限。
+
+    cancel_token 是任意提供 is_cancelled() 和 raise_if_cancelled() 方法的对象（例如 core.task_queue.CancellationToken）。
+    run() 执行期间每隔 cancel_check_interval 秒在线程中调用一次 is_cancelled()（检查可能访问 Redis 等外部服务，
+    不能阻塞事件循环）；返回 True 时取消 run() 中所有未完成的请求（httpx 会关闭对应的连接），
+    再由 raise_if_cancelled() 抛出异常中止当前的抽取。直接调用 generate() 不检查取消令牌。
+    """
+
+    def __init__(self, url=OLLAMA_API_URL, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF, cancel_token=None,
+                 cancel_check_interval=None):
+        self.url = url
+        self.cancel_token = cancel_token
+        self.cancel_check_interval = cancel_check_interval or getattr(cancel_token, "check_interval", 0.5)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._client = None
+        self._semaphore = None
+        self._in_flight = 0
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "cancelled": 0, "max_in_flight": 0}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        """创建共享连接池；连接数与并发上限一致，保证每个在途请求都能复用一条长连接"""
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_concurrency,
+                                  max_keepalive_connections=self.max_concurrency)
+            self._client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _wait_cancelled(self):
+        """在线程中轮询取消令牌，直到任务被取消"""
+        while not await asyncio.to_thread(self.cancel_token.is_cancelled):
+            await asyncio.sleep(self.cancel_check_interval)
+
+    async def run(self, coro):
+        """
+        执行 coro（通常是若干 generate 的 gather），任务被取消时取消其中所有未完成的请求
+
+        返回：
+            coro 的结果；任务被取消时抛出 cancel_token.raise_if_cancelled() 的异常
+        """
+        if self.cancel_token is None:
+            return await coro
+        work = asyncio.ensure_future(coro)
+        watcher = asyncio.create_task(self._wait_cancelled())
+        try:
+            await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+        if not work.done():
+            # 取消令牌先触发：取消在途的 HTTP 请求和还在等待信号量的请求
+            self.stats["cancelled"] += self._in_flight
+            work.cancel()
+            await asyncio.gather(work, return_exceptions=True)
+            await asyncio.to_thread(self.cancel_token.raise_if_cancelled)
+        return work.result()
+
+    async def generate(self, prompt, json_format=False):
+        """
+        发送一次生成请求
+
+        返回：
+            str: 模型回答；超过重试次数仍失败时返回 None（与同步版本一致）
+        """
+        await self.open()
+        payload = build_request_payload(prompt, json_format)
+        async with self._semaphore:
+            self._in_flight += 1
+            self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self._in_flight)
+            try:
+                return await self._post_with_retry(payload)
+            finally:
+                self._in_flight -= 1
+
+    async def _post_with_retry(self, payload):
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.stats["retries"] += 1
+                # 指数退避 + 随机抖动，避免所有请求同时重试
+                await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * (1 + random.random()))
+            self.stats["requests"] += 1
+            try:
+                response = await self._client.post(self.url, json=payload)
+                if response.status_code not in RETRYABLE_STATUS:
+                    response.raise_for_status()
+                    return response.json().get("response", "")
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                # 连接失败、超时等网络错误，可以重试
+                error = str(e) or type(e).__name__
+            except (httpx.HTTPStatusError, ValueError) as e:
+                # 其余 4xx 或响应无法解析，重试也不会成功
+                self.stats["failures"] += 1
+                logger.warning(f"请求 Ollama API 失败: {e}")
+                return None
+        self.stats["failures"] += 1
+        logger.warning(f"请求 Ollama API 失败，已重试 {self.max_retries} 次: {error}")
+        return None
+
+
+async def extract_fields_async(client, content, groups=None, fallback=True):
+    """
+    extract_fields 的异步版本：所有分组请求同时派发，校验失败的字段再同时逐字段重试
+
+    返回：
+        dict: {字段名: 归一化后的内容}
+    """
+    groups = groups if groups is not None else FIELD_GROUPS
+    results = {}
+    failed = []
+
+    responses = await asyncio.gather(*[
+        client.generate(build_group_prompt(fields, content), json_format=True) for fields in groups
+    ])
+    for fields, response in zip(groups, responses):
+        collect_group_results(fields, response, results, failed)
+
+    if failed and fallback:
+        logger.info(f"批量抽取有 {len(failed)} 个字段未通过校验，并发逐字段重试: {failed}")
+        responses = await asyncio.gather(*[client.generate(get_prompt(field) + content) for field in failed])
+        for field, response in zip(failed, responses):
+            results[field] = normalize_field(field, response)
+    else:
+        for field in failed:
+            results[field] = MISSING_VALUE
+
+    return results
+
+
+async def extract_documents_async(contents, client=None, groups=None, fallback=True, cancel_token=None):
+    """
+    并发抽取多个文档：所有文档的所有请求共享同一个连接池和并发上限
+
+    参数：
+        contents: 文档文本列表
+        client: 可选的 AsyncOllamaClient，None 时按默认配置创建并在结束后关闭
+        cancel_token: 可选的取消令牌，见 AsyncOllamaClient；传入 client 时使用 client 自己的取消令牌
+
+    返回：
+        list[dict]: 与 contents 顺序一致的字段字典
+    """
+    owns_client = client is None
+    client = client or AsyncOllamaClient(cancel_token=cancel_token)
+    start = time.time()
+    try:
+        results = await client.run(asyncio.gather(*[
+            extract_fields_async(client, content, groups=groups, fallback=fallback) for content in contents
+        ]))
+    finally:
+        if owns_client:
+            await client.close()
+    logger.info(f"并发抽取 {len(contents)} 个文档完成，耗时 {time.time() - start:.2f} 秒，统计: {client.stats}")
+    return list(results)
+
+
+def extract_documents(contents, **kwargs):
+    """在同步代码（线程或子进程）中调用 extract_documents_async 的便捷入口"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(extract_documents_async(contents, **kwargs))
+    # 当前线程已有事件循环（例如在 async 路由中被同步调用），改在独立线程中运行，避免嵌套事件循环
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, extract_documents_async(contents, **kwargs)).result()
@@ -0,0 +1,276 @@
+# ===== DataStructuring/ResultCache.py =====
+# 基于内容哈希的持久化结果缓存
+#
+# 同一个文件被重复上传时，原先会从头走一遍 GeneralFile → Classify → txt_to_excel → predict_all，
+# 每一步都要调用外部模型接口。这里用 SQLite 按内容的 SHA-256 缓存各阶段的结果：
+# - source_text:    源文件字节的哈希 → 抽取出的文本
+# - classification: 文本的哈希 → 结构化程度分类
+# - fields:         文本的哈希 → 表头字段抽取结果
+# - document:       源文件字节的哈希 → 整个文档的最终结果（文本哈希、目标文件名、分类、字段、欺诈概率）
+#
+# 缓存条目带 TTL，总大小超过上限时按最近访问时间淘汰。
+# SQLite 开启 WAL 模式，每个线程使用独立连接，可被多个线程和子进程同时使用。
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 默认参数，可通过环境变量覆盖
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", os.path.join(CURRENT_DIR, "CacheData", "result_cache.sqlite3"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(7 * 24 * 3600)))  # 默认保留 7 天
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 默认 512MB
+
+# 缓存命名空间
+SOURCE_TEXT = "source_text"
+CLASSIFICATION = "classification"
+FIELDS = "fields"
+DOCUMENT = "document"
+
+# 每写入这么多次做一次过期清理与容量检查，避免每次写入都扫描全表
+_EVICT_INTERVAL = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace   TEXT NOT NULL,
+    digest      TEXT NOT NULL,
+    value       TEXT NOT NULL,
+    size        INTEGER NOT NULL,
+    created_at  REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (namespace, digest)
+);
+CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries (accessed_at);
+CREATE INDEX IF NOT EXISTS idx_entries_created_at ON entries (created_at);
+"""
+
+
+def hash_bytes(data):
+    """计算字节串的 SHA-256"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    """计算文本（UTF-8 编码）的 SHA-256"""
+    return hash_bytes(text.encode("utf-8"))
+
+
+def hash_file(filepath, chunk_size=1024 * 1024):
+    """分块计算文件内容的 SHA-256，避免大文件一次性读入内存"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    SQLite 持久化缓存
+
+    值以 JSON 形式存储，get 未命中或条目已过期时返回 None。
+    缓存只是加速手段，任何数据库错误都只记录日志，不会向调用方抛出。
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._write_count = 0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace, digest):
+        try:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, created_at FROM entries WHERE namespace = ? AND digest = ?",
+                (namespace, digest),
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            now = time.time()
+            if self.ttl and now - created_at > self.ttl:
+                with conn:
+                    conn.execute("DELETE FROM entries WHERE namespace = ? AND digest = ?", (namespace, digest))
+                return None
+            with conn:
+                conn.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND digest = ?",
+                    (now, namespace, digest),
+                )
+            return json.loads(value)
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(f"读取结果缓存失败 ({namespace}/{digest}): {e}")
+            return None
+
+    def set(self, namespace, digest, value):
+        try:
+            data = json.dumps(value, ensure_ascii=False)
+            now = time.time()
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, digest, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, digest, data, len(data.encode("utf-8")), now, now),
+                )
+            with self._lock:
+                self._write_count += 1
+                should_evict = self._write_count % _EVICT_INTERVAL == 1
+            if should_evict:
+                self.evict()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logger.warning(f"写入结果缓存失败 ({namespace}/{digest}): {e}")
+
+    def delete(self, namespace, digest):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM entries WHERE namespace = ? AND digest = ?", (namespace, digest))
+        except sqlite3.Error as e:
+            logger.warning(f"删除结果缓存失败 ({namespace}/{digest}): {e}")
+
+    def evict(self):
+        """
+        清理过期条目，并在总大小超过上限时按最近访问时间淘汰最旧的条目
+
+        返回：
+            int: 删除的条目数
+        """
+        removed = 0
+        try:
+            conn = self._connection()
+            with conn:
+                if self.ttl:
+                    removed += conn.execute(
+                        "DELETE FROM entries WHERE created_at < ?", (time.time() - self.ttl,)
+                    ).rowcount
+                total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if self.max_bytes and total > self.max_bytes:
+                    # 淘汰到上限的 90%，避免每次写入都触发淘汰
+                    excess = total - int(self.max_bytes * 0.9)
+                    freed = 0
+                    victims = []
+                    for namespace, digest, size in conn.execute(
+                        "SELECT namespace, digest, size FROM entries ORDER BY accessed_at"
+                    ):
+                        victims.append((namespace, digest))
+                        freed += size
+                        if freed >= excess:
+                            break
+                    conn.executemany("DELETE FROM entries WHERE namespace = ? AND digest = ?", victims)
+                    removed += len(victims)
+            if removed:
+                logger.info(f"结果缓存淘汰了 {removed} 个条目")
+        except sqlite3.Error as e:
+            logger.warning(f"清理结果缓存失败: {e}")
+        return removed
+
+    def stats(self):
+        """返回各命名空间的条目数与总大小"""
+        try:
+            rows = self._connection().execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"读取结果缓存统计失败: {e}")
+            return {}
+        return {namespace: {"entries": count, "bytes": size} for namespace, count, size in rows}
+
+
+class _DisabledCache:
+    """RESULT_CACHE_ENABLED=0 时使用的空实现"""
+
+    def get(self, namespace, digest):
+        return None
+
+    def set(self, namespace, digest, value):
+        pass
+
+    def delete(self, namespace, digest):
+        pass
+
+    def evict(self):
+        return 0
+
+    def stats(self):
+        return {}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """获取进程内共享的结果缓存实例（子进程会各自创建自己的连接）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache() if RESULT_CACHE_ENABLED else _DisabledCache()
+    return _cache
+
+
+def lookup_document(source_hash):
+    """
+    查找已处理过的源文件的完整结果
+
+    返回：
+        dict: 包含 text_hash、target_name、classification、fields、probability；未命中时返回 None
+    """
+    cache = get_result_cache()
+    document = cache.get(DOCUMENT, source_hash)
+    if document is None:
+        return None
+    # 字段结果可能已被单独淘汰，此时视为未命中
+    fields = cache.get(FIELDS, document["text_hash"])
+    if fields is None:
+        return None
+    document["fields"] = fields
+    return document
+
+
+def remember_document(source_hash, target_name, probability):
+    """
+    在整条流水线跑完后记录源文件的完整结果，供下次直接复用
+
+    文本、分类和字段在各阶段已经分别写入缓存，这里只需把它们按源文件哈希串起来。
+    任何一环缺失（例如该阶段失败未写缓存）时不记录。
+
+    返回：
+        bool: 是否记录成功
+    """
+    cache = get_result_cache()
+    text = cache.get(SOURCE_TEXT, source_hash)
+    if text is None:
+        return False
+    text_hash = hash_text(text)
+    if cache.get(FIELDS, text_hash) is None:
+        return False
+    cache.set(DOCUMENT, source_hash, {
+        "text_hash": text_hash,
+        "target_name": target_name,
+        "classification": cache.get(CLASSIFICATION, text_hash),
+        "probability": probability,
+    })
+    return True
@@ -0,0 +1,178 @@
+# ===== DataStructuring/StructureDetector.py =====
+# 本地结构化程度预判
+#
+# Classify 原先对每个文本都调用一次 glm-4-flash。上传的文件大多是导出的表格、JSON 等，
+# 结构是否规整用简单的本地规则就能判断。这里根据以下特征给出分类和置信度：
+# - JSON 能否被完整解析；XML 还要有重复的记录元素（例如多个 <row>），只是合法的标记（HTML 信件等）不算
+# - 分隔符（制表符、逗号、竖线、分号）在各行出现次数是否一致，即表格行的密度；
+#   单元格还要像表格单元格（较短），避免把逗号较多的折行文字当成表格
+# - “键: 值” 形式的行占比：每行只有一个分隔符，且键很短（时间 10:31 中的冒号不算分隔符）
+# - 以句末标点结尾的长句占比
+# 只有置信度不足的文本才交给远程模型判断。
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from collections import Counter
+
+STRUCTURED = "结构化数据"
+SEMI_STRUCTURED = "半结构化数据"
+UNSTRUCTURED = "非结构化数据"
+
+# 置信度达到该阈值时直接采用本地结果，否则交给远程模型
+STRUCTURE_CONFIDENCE_THRESHOLD = float(os.getenv("STRUCTURE_CONFIDENCE_THRESHOLD", "0.8"))
+
+# 只分析开头的部分内容，避免超大文本拖慢预判
+_MAX_ANALYZE_CHARS = 20000
+_MIN_TABLE_LINES = 3
+
+# 不包含全角逗号“，”：中文正文里几乎每行都有，不能说明是表格
+_DELIMITERS = ["\t", ",", "|", ";"]
+# 单元格长度的中位数上限：每行至少 2 个分隔符（3 列以上）时放宽，只有 1 个分隔符时从严
+_MAX_CELL_LENGTH = 40
+_MAX_CELL_LENGTH_TWO_COLUMNS = 20
+# 键值对：键的最大长度、键中不能出现的字符（表格分隔符、句内标点和标记的尖括号）
+_MAX_KEY_LENGTH = 20
+_KEY_VALUE_SEPARATOR = re.compile(r"[:：=]")
+_KEY_FORBIDDEN_PATTERN = re.compile(r"[|,，。！？!?；;<>\t]")
+# XML 中重复元素的叶子文本超过该长度时更像正文段落（例如 HTML 的 <p>），不算记录
+_MAX_LEAF_LENGTH = 100
+_SENTENCE_END_PATTERN = re.compile(r"[。！？!?.；]\s*$")
+# markdown 表格的分隔行，例如 |---|:---:|
+_MARKDOWN_RULE_PATTERN = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+
+
+def _try_json(text):
+    if not text or text[0] not in "{[":
+        return False
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return False
+    return isinstance(data, (dict, list))
+
+
+def _is_leaf(element):
+    return len(element) == 0 and len((element.text or "").strip()) <= _MAX_LEAF_LENGTH
+
+
+def _is_record(element):
+    """叶子元素，或者子元素全部是叶子元素（例如 <row><name>..</name><amount>..</amount></row>）"""
+    return _is_leaf(element) or all(_is_leaf(child) for child in element)
+
+
+def _try_xml(text):
+    """能被完整解析，并且有同名的重复子元素，这些子元素都是记录；HTML 文档不算"""
+    if not text.startswith("<"):
+        return False
+    try:
+        root = ET.fromstring(text)
+    except ET.ParseError:
+        return False
+    if root.tag.lower() == "html":
+        return False
+    for element in root.iter():
+        repeated = [tag for tag, count in Counter(child.tag for child in element).items() if count >= 2]
+        for tag in repeated:
+            if all(_is_record(child) for child in element.findall(tag)):
+                return True
+    return False
+
+
+def _median_cell_length(lines, delimiter):
+    lengths = sorted(len(cell.strip()) for line in lines for cell in line.split(delimiter))
+    return lengths[len(lengths) // 2]
+
+
+def table_line_density(lines):
+    """
+    计算表格行的密度
+
+    对每种分隔符，统计各行出现次数的众数；出现次数恰好等于众数的行视为同一张表的行，
+    只有表头（第一行）和末行可以不同（例如末行少一列），但也必须含有该分隔符。
+    单元格长度的中位数超过上限时不算表格（折行的正文虽然每行逗号数相同，但“单元格”很长）。
+    返回所有分隔符中最高的占比。
+    """
+    best = 0.0
+    last = len(lines) - 1
+    for delimiter in _DELIMITERS:
+        counts = [line.count(delimiter) for line in lines]
+        present = Counter(count for count in counts if count > 0)
+        if not present:
+            continue
+        mode = present.most_common(1)[0][0]
+        rows = [line for i, (line, count) in enumerate(zip(lines, counts))
+                if count == mode or (count > 0 and i in (0, last))]
+        max_cell_length = _MAX_CELL_LENGTH if mode >= 2 else _MAX_CELL_LENGTH_TWO_COLUMNS
+        if _median_cell_length(rows, delimiter) > max_cell_length:
+            continue
+        best = max(best, len(rows) / len(lines))
+    return best
+
+
+def _is_key_value_line(line):
+    """
+    是否为 “键: 值” 形式的行
+
+    两侧都是数字的冒号（10:31）和 URL 中的 :// 不算分隔符；剩下的分隔符必须恰好一个，
+    键不超过 _MAX_KEY_LENGTH 个字符且不含表格分隔符和句内标点，值不能为空。
+    """
+    separators = [
+        match.start() for match in _KEY_VALUE_SEPARATOR.finditer(line)
+        if not (0 < match.start() < len(line) - 1
+                and line[match.start() - 1].isdigit() and line[match.start() + 1].isdigit())
+        and not line.startswith("//", match.start() + 1)
+    ]
+    if len(separators) != 1:
+        return False
+    key, value = line[:separators[0]].strip(), line[separators[0] + 1:].strip()
+    return 0 < len(key) <= _MAX_KEY_LENGTH and bool(value) and not _KEY_FORBIDDEN_PATTERN.search(key)
+
+
+def key_value_ratio(lines):
+    """“键: 值” 形式的行占比"""
+    return sum(1 for line in lines if _is_key_value_line(line)) / len(lines)
+
+
+def sentence_ratio(lines):
+    """以句末标点结尾、且长度像自然语言句子的行占比"""
+    return sum(1 for line in lines if len(line) >= 20 and _SENTENCE_END_PATTERN.search(line)) / len(lines)
+
+
+def detect_structure(content):
+    """
+    用本地规则判断文本的结构化程度
+
+    参数：
+        content: 文本内容
+
+    返回：
+        tuple: (分类, 置信度)，置信度在 0 到 1 之间；
+               置信度低于 STRUCTURE_CONFIDENCE_THRESHOLD 时应交给远程模型判断
+    """
+    text = (content or "").strip()
+    if not text:
+        return UNSTRUCTURED, 0.0
+
+    # 完整的 JSON 文档、由重复记录组成的 XML 文档可以直接判定
+    if len(text) <= _MAX_ANALYZE_CHARS * 5 and (_try_json(text) or _try_xml(text)):
+        return SEMI_STRUCTURED, 0.95
+
+    lines = [line for line in text[:_MAX_ANALYZE_CHARS].splitlines() if line.strip()]
+    lines = [line for line in lines if not _MARKDOWN_RULE_PATTERN.match(line)] or lines
+
+    table = table_line_density(lines) if len(lines) >= _MIN_TABLE_LINES else 0.0
+    key_value = key_value_ratio(lines)
+    sentences = sentence_ratio(lines)
+
+    if table >= 0.8 and sentences < 0.2:
+        return STRUCTURED, round(min(0.99, table), 2)
+    if key_value >= 0.6 and table < 0.5 and sentences < 0.3:
+        return SEMI_STRUCTURED, round(min(0.95, key_value), 2)
+    if sentences >= 0.5 and table < 0.3 and key_value < 0.2:
+        return UNSTRUCTURED, round(min(0.95, 0.5 + sentences / 2), 2)
+
+    # 特征不明显：返回最接近的分类和较低的置信度，交给远程模型决定
+    scores = {STRUCTURED: table, SEMI_STRUCTURED: key_value, UNSTRUCTURED: sentences}
+    level = max(scores, key=scores.get)
+    return level, round(min(0.5, scores[level]), 2)
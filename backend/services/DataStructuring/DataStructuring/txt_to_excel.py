@@ -1,21 +1,41 @@
 # coding= gbk
 from .MyFunctions import *
-import pandas as pd
+from .FieldExtractor import FIELD_NAMES, MISSING_VALUE
+from .OllamaClient import extract_documents
+from .HeaderTemplate import get_header_template
+from .ResultCache import FIELDS, get_result_cache, hash_text
 
 # ޸ĺĴ
 import os
-import requests
 
-#  Ollama API ַ
-OLLAMA_API_URL = "http://localhost:11434/api/generate"
+def extract_fields_cached(contents, cancel_token=None):
+    """
+    ȡııͷֶΣıݹϣ֮ǰĳȡֻδеı Ollama
+    
+    
+        cancel_token: ѡȡƣȡڼں̨ѯȡֹ; Ollama 
+    
+    أ
+        list[dict]:  contents ˳һµֵֶ
+    """
+    cache = get_result_cache()
+    hashes = [hash_text(content) for content in contents]
+    all_fields = [cache.get(FIELDS, text_hash) for text_hash in hashes]
+    missing = [i for i, fields in enumerate(all_fields) if fields is None]
+    if not missing:
+        return all_fields
+    # ļֶһӳزɷУʧֶܵλԶֶ
+    extracted = extract_documents([contents[i] for i in missing], cancel_token=cancel_token)
+    for i, fields in zip(missing, extracted):
+        all_fields[i] = fields
+        # ֶζΪʱ Ollama ãд뻺棬´³ȡ
+        if any(value not in (MISSING_VALUE, '0') for value in fields.values()):
+            cache.set(FIELDS, hashes[i], fields)
+    return all_fields
+
 def txt_to_excel(folder_path,output_path):
     # ʹԭʼַҪļ·
-    all=['ID', '', '׽', 'ױ', 'Ƶ', 'С', '豸Ϣ', 
-        'ʱ', 'ʱ', 'ʼ˻', 'ʼ˻', 'ʼ˻Ϣ', 
-        'ʼ˻õȼ', 'ʼ˻ַ', 'ʼ˻', 'ʼ˻ְҵ', 'ʼ˻ˮƽ', 
-        'ʼ˻ϵʽ', 'Ŀ˻', 'Ŀ˻', 'Ŀ˻', 'Ŀ˻Ϣ',
-        'Ŀ˻õȼ', 'Ŀ˻ַ', 'Ŀ˻', 
-        'Ŀ˻ְҵ', 'Ŀ˻ˮƽ', 'Ŀ˻ϵʽ', 'Ƿթ', 'ǷΪթ']
+    all=FIELD_NAMES
     # ָ prompt
     # prompt_template = "ıݣ{}"
 
@@ -23,161 +43,36 @@ def txt_to_excel(folder_path,output_path):
         """
         ݹָļе txt ļȡ
         """
-        txt_contents = []
+        documents = []
         for root, dirs, files in os.walk(folder):
             for file in files:
                 if file.endswith(".txt"):
                     file_path = os.path.join(root, file)
                     try:
                         with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            # #print(content)
-                            #print('',file)
-                            #print('----------------------------------------------')
-                            # ȡͷ  ·
-                            current_dir = os.path.dirname(os.path.abspath(__file__))
-                            target_file=os.path.join(current_dir,'./ͷ.xlsx')
-                            target=pd.read_excel(target_file)
-                            #print(target)
-                            for context in all:
-                                #print('',context,'ָ')
-                                #print('----------------------------------------------')
-                                prompt=get_prompt(context)
-                                response=''
-                                try:
-                                    response = get_ollama_response(prompt+content)
-                                    ###
-                                    #  #print("\n\n\ncontent is :"+content)
-                                    ### 
-                                    #print('response',response)
-                                    if(context==''):
-                                        if 'A' in response or 'a' in response or '' in response:
-                                            response = ''
-                                        elif 'B' in response or 'b' in response or 'ȡ' in response:
-                                            response = 'ȡ'
-                                        elif 'C' in response or 'c' in response or 'ת' in response:
-                                            response = 'ת'
-                                        elif 'D' in response or 'd' in response or '֧' in response:
-                                            response = '֧'
-                                        elif 'E' in response or 'e' in response or '' in response:
-                                            response = ''
-                                        else:
-                                            response = ''
-                                    if context=='׽' or context=='ʼ˻' or context=='ʼ˻' or context=='Ŀ˻' or context=='Ŀ˻':
-                                        # ֿ֤Уֻṩһоͺ
-                                        pattern = r'(\d+\.\d+|\d+)'
-                                        matches = re.findall(pattern, response)
-                                        results = [match.strip() for match in matches if match.strip()]
-                                        if results:
-                                            response=results[0]
-                                        else:
-                                            response=''
-                                        if response == '':
-                                            response = '0'
-                                    # ȫ滻Ϊո
-                                    response = response.replace('\n', ' ')
-                                    # else:
-                                    #     if context=='豸Ϣ' or context=='ʼ˻Ϣ' or context=='Ŀ˻Ϣ':
-                                    #         pass
-                                    #     elif context=='Ƿթ'or context=='ǷΪթ':
-                                    #         if 'թ' in response and 'թ' not in response:
-                                    #             response=''
-                                    #         elif '' in response or 'թ' in response:
-                                    #             response=''
-                                    #         else:
-                                    #             response=''
-                                    #     else:
-                                    #         response=extract(context,response)
-                                    #         pattern = r'[:](.*?)(?:\n|$|)'
-                                    #         matches = re.findall(pattern, response, re.DOTALL)
-                                    #         results = [match.strip() for match in matches if match.strip()]
-                                    #         pattern_dash = r'-(.*?)(?:\n|$|)'
-                                    #         matches_dash = re.findall(pattern_dash, response, re.DOTALL)
-                                    #         results_dash = [match.strip() for match in matches_dash if match.strip()]
-                                    #         pattern_quote = r'(.*?)'
-                                    #         matches_quote = re.findall(pattern_quote, response)
-                                    #         results_quote =[match.strip() for match in matches_quote if match.strip()]
-                                    #         pattern_s = r'```(.*?)```'
-                                    #         matches_s = re.findall(pattern_s, response, re.DOTALL)
-                                    #         results_s=[match.strip() for match in matches_s if match.strip()]
-                                    #         # ȡ | ֮
-                                    #         pattern_pipe = r'\|(.*?)(?:\n|$|)'
-                                    #         matches_pipe = re.findall(pattern_pipe, response, re.DOTALL)
-                                    #         results_pipe = [match.strip() for match in matches_pipe if match.strip()]
-                                    #         lines = response.splitlines()
-                                    #         r = []
-                                    #         i = 0
-                                    #         while i < len(lines):
-                                    #             if lines[i].strip() == '':  # ҵһ
-                                    #                 start_index = i + 1
-                                    #                 # ҵһ
-                                    #                 j = start_index
-                                    #                 while j < len(lines) and lines[j].strip() != '':
-                                    #                     j += 1
-                                    #                 end_index = j
-                                    #                 # ֻ֮һ
-                                    #                 if end_index - start_index == 1 and start_index!=len(lines)-1 and start_index!=0 and len(lines[start_index])<30:
-                                    #                     r.append(lines[start_index].strip())
-                                    #                 i = end_index
-                                    #             else:
-                                    #                 i += 1
-                                    #         if results_s:
-                                    #             response=results_s[0]
-                                    #         elif results_dash:
-                                    #             response=results_dash[0]
-                                    #         elif r:
-                                    #             response=r[-1]
-                                    #         elif results:
-                                    #             response=results[0]
-                                    #         elif results_quote:
-                                    #             response=results_quote[-1]
-                                    #         elif results_pipe:
-                                    #             response=results_pipe[0]
-                                    #         else:
-                                    #             response=''
-                                    #print('response',response)
-                                except:
-                                    response=''
-                                    #print('ȡϢʧ')
-                                condition=target['ͷоĿ']==context
-                                target.loc[condition,'']=response
-                                #print('----------------------------------------------')
-                            #     #print("ɹд")
-                            # response=get_ollama_response(f"{content}شбÿһϢ{all}")
-                            # #print(response)
-
-                            target_file=output_path+'\\'+file[:-3]+'xlsx'
-                            #print("----------------------------------------------\n")
-                            #print(f"\n*** for debug: target_file: {target_file}")
-                            target.to_excel(target_file,index=False)
-                            #print("----------------------------------------------\n")
-                            txt_contents.append(content)
+                            documents.append((file, f.read()))
                     except Exception as e:
                         print(f"ȡļ {file_path} ʱ: {e}")
-        #print(txt_contents)                
-        return txt_contents
+        return documents
 
-    def get_ollama_response(prompt):
+    def write_excel_files(documents, all_fields):
         """
-         Ollama API 󲢻ȡӦ
+        ȡͷģд excel
         """
-        data = {
-            "model": "wangshenzhi/llama3-8b-chinese-chat-ollama-q4:v1",
-            "prompt": prompt,
-            "stream": False,
-            "temperature":0,
-            "num_predict": 1,
-            "top_k": 1,
-            "top_p": 1.0
-        }
-        try:
-            response = requests.post(OLLAMA_API_URL, json=data)
-            response.raise_for_status()
-            result = response.json()
-            return result.get("response", "")
-        except requests.RequestException as e:
-            #print(f" Ollama API ʱ: {e}")
-            return None
+        # ģڽֻһΣÿļֻ谴кݺһд
+        template = get_header_template()
+        txt_contents = []
+        for (file, content), fields in zip(documents, all_fields):
+            try:
+                target_file=os.path.join(output_path,file[:-3]+'xlsx')
+                #print(f"\n*** for debug: target_file: {target_file}")
+                template.write_excel(fields,target_file,default='')
+                txt_contents.append(content)
+            except Exception as e:
+                print(f"дļ {file} Ľʱ: {e}")
+        return txt_contents
 
-    txt_contents = read_txt_files(folder_path)
-    #print("ɹļ",txt_contents)
\ No newline at end of file
+    documents = read_txt_files(folder_path)
+    all_fields = extract_fields_cached([content for _, content in documents])
+    txt_contents = write_excel_files(documents, all_fields)
+    #print("ɹļ",txt_contents)
\ No newline at end of file
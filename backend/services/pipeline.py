@@ -0,0 +1,306 @@
+# 内存中的文档处理流水线
+#
+# 原先一个文件要依次经过：写入 SourceData → 复制到 sub_i → 转换为 TextData → Classify_in_Dir 复制到
+# InputData_for_ShenZijun → 写 xlsx 到 TargetData → 复制到预测目录 → predict_all 重新读取 xlsx
+# → process_target_to_json 再读取一次并写 JSON。小文件的耗时大部分花在这些复制和重复解析上。
+#
+# 这里让 Document 对象在内存中依次经过 extract → classify → structure → predict → serialize 五个阶段，
+# 各阶段直接读写 Document 的属性；只有传入 stage_dir 时才把中间结果落盘，便于排查问题。
+# 传入 cancel_token 时，在阶段之间、每个文档开始处理之前检查任务是否已被取消；
+# 字段抽取期间由 AsyncOllamaClient 在后台轮询，任务被取消时立即中止在途的 Ollama 请求。
+
+import concurrent.futures
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import filetype
+
+from core.task_queue import TaskCancelled
+from services.DataStructuring.DataStructuring.Clssifier import classify_content
+from services.DataStructuring.DataStructuring.DataProcess import AllowTypeSet, AudioTypeSet
+from services.DataStructuring.DataStructuring.FieldExtractor import MISSING_VALUE
+from services.DataStructuring.DataStructuring.GeneralProcess import GeneralBytes
+from services.DataStructuring.DataStructuring.HeaderTemplate import get_header_template
+from services.DataStructuring.DataStructuring.ParticularProcess import AudioFile
+from services.DataStructuring.DataStructuring.ResultCache import (
+    SOURCE_TEXT, get_result_cache, hash_bytes, lookup_document, remember_document,
+)
+from services.DataStructuring.DataStructuring.txt_to_excel import extract_fields_cached
+from services.risk_prediction.prediction import get_model, predict_batch
+from services.target_to_json import dataframe_to_json
+
+logger = logging.getLogger(__name__)
+
+# 文本抽取与分类阶段都是等待外部接口的 I/O 操作，用线程并发
+MAX_IO_WORKERS = int(os.getenv("PIPELINE_MAX_IO_WORKERS", "8"))
+
+
+@dataclass
+class Document:
+    """
+    流水线中的一个文档
+
+    各阶段依次填充 text、classification、fields、probability、json_data；
+    任一阶段失败时记录 error，后续阶段跳过该文档。
+    """
+    filename: str
+    data: bytes
+    source_hash: str = ""
+    text: Optional[str] = None
+    classification: Optional[str] = None
+    fields: Optional[Dict[str, str]] = None
+    probability: Optional[float] = None
+    prediction_error: Optional[str] = None
+    model_version: Optional[str] = None
+    json_data: Optional[dict] = None
+    error: Optional[str] = None
+    cached: bool = False
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, "rb") as f:
+            return cls(filename=os.path.basename(path), data=f.read())
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def stem(self):
+        return os.path.splitext(self.filename)[0]
+
+    @property
+    def target_name(self):
+        """结果表格的文件名，与原流程中 TargetData 下的文件名一致"""
+        return self.stem + ".xlsx"
+
+    def to_frame(self):
+        """按表头模板构造结果表格"""
+        return get_header_template().to_frame(self.fields or {}, default=MISSING_VALUE)
+
+    def to_excel_bytes(self):
+        """将结果表格渲染为 xlsx 的二进制内容，可直接上传"""
+        buffer = io.BytesIO()
+        self.to_frame().to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+
+def _check_cancelled(cancel_token):
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+
+def _run_threaded(func, documents, max_workers=None, cancel_token=None):
+    """
+    用线程池对每个文档执行 func，单个文档的异常记录到 document.error
+
+    任务被取消时不再开始处理剩余文档，等待已开始的文档结束后抛出 TaskCancelled。
+    """
+    if not documents:
+        return
+
+    def run(document):
+        _check_cancelled(cancel_token)
+        func(document)
+
+    max_workers = min(max_workers or MAX_IO_WORKERS, len(documents))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_document = {executor.submit(run, document): document for document in documents}
+        for future in concurrent.futures.as_completed(future_to_document):
+            document = future_to_document[future]
+            try:
+                future.result()
+            except TaskCancelled:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            except Exception as e:
+                logger.error(f"处理文档 {document.filename} 时出错: {str(e)}")
+                document.error = str(e)
+
+
+# ===== 阶段1：文本抽取 =====
+def _extract_one(document):
+    cache = get_result_cache()
+    text = cache.get(SOURCE_TEXT, document.source_hash)
+    if text:
+        document.text = text
+        return
+
+    kind = filetype.guess(document.data)
+    file_type = kind.extension if kind else None
+    if file_type in AllowTypeSet:
+        text = GeneralBytes(document.filename, document.data)
+    elif file_type in AudioTypeSet:
+        # 语音转写接口只接受文件路径，只有这一种情况需要临时文件
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, document.filename)
+            with open(path, "wb") as f:
+                f.write(document.data)
+            text = AudioFile(filepath=path, type=file_type)
+    else:
+        document.error = f"不支持处理的文件类型: {file_type}"
+        return
+
+    if not text:
+        document.error = "无法提取内容"
+        return
+    document.text = text
+    cache.set(SOURCE_TEXT, document.source_hash, text)
+
+
+def extract_stage(documents, cancel_token=None):
+    """将源文件内容转换为文本（对应原 ProcessData）"""
+    _run_threaded(_extract_one, documents, cancel_token=cancel_token)
+
+
+# ===== 阶段2：结构化程度分类 =====
+def _classify_one(document):
+    document.classification = classify_content(document.text)
+
+
+def classify_stage(documents, cancel_token=None):
+    """判断文本的结构化程度（对应原 Classify，但不再复制文件到分类目录）"""
+    _run_threaded(_classify_one, documents, cancel_token=cancel_token)
+
+
+# ===== 阶段3：表头字段抽取 =====
+def structure_stage(documents, cancel_token=None):
+    """抽取表头字段（对应原 txt_to_excel），所有文档的请求共享连接池并发派发"""
+    if not documents:
+        return
+    all_fields = extract_fields_cached([document.text for document in documents], cancel_token=cancel_token)
+    for document, fields in zip(documents, all_fields):
+        document.fields = fields
+
+
+# ===== 阶段4：风险预测 =====
+def predict_stage(documents):
+    """直接用内存中的表头字段批量预测欺诈概率（对应原 predict_all），所有文档只调用一次模型"""
+    if not documents:
+        return
+    try:
+        # 先取出模型，整批文档使用同一个版本，期间发生热切换也不会混用
+        model = get_model()
+        probabilities, errors = predict_batch([document.fields or {} for document in documents], model=model)
+        version = model.version
+    except Exception as e:
+        # 预测失败不影响结构化结果的输出
+        logger.error(f"批量预测 {len(documents)} 个文档时出错: {str(e)}")
+        probabilities, errors, version = [None] * len(documents), [None] * len(documents), None
+    for document, probability, error in zip(documents, probabilities, errors):
+        if error:
+            logger.info(f"文档 {document.filename} 无法预测: {error}")
+        document.probability = probability
+        document.prediction_error = error
+        document.model_version = version
+
+
+# ===== 阶段5：序列化 =====
+def serialize_stage(documents):
+    """生成按大分类分组的 JSON 结果（对应原 process_target_to_json）"""
+    for document in documents:
+        document.json_data = dataframe_to_json(document.to_frame())
+
+
+def write_stage_files(documents, stage_dir):
+    """把各文档的文本、结果表格和 JSON 写入 stage_dir，仅用于排查问题"""
+    os.makedirs(stage_dir, exist_ok=True)
+    for document in documents:
+        if document.text is not None:
+            with open(os.path.join(stage_dir, document.stem + ".txt"), "w", encoding="utf-8") as f:
+                f.write(document.text)
+        if document.fields is not None:
+            with open(os.path.join(stage_dir, document.target_name), "wb") as f:
+                f.write(document.to_excel_bytes())
+        if document.json_data is not None:
+            with open(os.path.join(stage_dir, document.stem + ".json"), "w", encoding="utf-8") as f:
+                json.dump(document.json_data, f, ensure_ascii=False, indent=4)
+
+
+def run_pipeline(documents: List[Document], stage_dir=None, cancel_token=None):
+    """
+    在内存中处理一批文档
+
+    参数：
+        documents: Document 列表，至少需要 filename 和 data
+        stage_dir: 可选的目录，提供时把每个文档的中间结果写入该目录
+        cancel_token: 可选的取消令牌（core.task_queue.CancellationToken），任务取消时抛出 TaskCancelled
+
+    返回：
+        list[Document]: 传入的文档列表（已就地填充各阶段结果）
+    """
+    start_time = time.time()
+
+    # 已完整处理过的文件直接从结果缓存恢复
+    pending = []
+    for document in documents:
+        document.source_hash = document.source_hash or hash_bytes(document.data)
+        cached = lookup_document(document.source_hash)
+        if cached:
+            document.classification = cached["classification"]
+            document.fields = cached["fields"]
+            document.probability = cached["probability"]
+            document.cached = True
+        else:
+            pending.append(document)
+    if len(pending) < len(documents):
+        logger.info(f"{len(documents) - len(pending)} 个文档命中结果缓存")
+
+    _check_cancelled(cancel_token)
+    extract_stage(pending, cancel_token=cancel_token)
+    pending = [document for document in pending if document.ok]
+    _check_cancelled(cancel_token)
+    classify_stage(pending, cancel_token=cancel_token)
+    _check_cancelled(cancel_token)
+    structure_stage([document for document in pending if document.ok], cancel_token=cancel_token)
+    pending = [document for document in pending if document.ok]
+
+    # 预测只需要内存中的字段且耗时可以忽略，命中缓存的文档也重新预测，以便得到校验错误并使用当前的模型
+    _check_cancelled(cancel_token)
+    predict_stage([document for document in documents if document.ok])
+    for document in pending:
+        remember_document(document.source_hash, document.target_name, document.probability)
+
+    serialize_stage([document for document in documents if document.ok])
+    if stage_dir:
+        write_stage_files(documents, stage_dir)
+
+    failed = [document.filename for document in documents if not document.ok]
+    logger.info(f"流水线处理 {len(documents)} 个文档完成，失败 {len(failed)} 个，"
+                f"总耗时: {time.time() - start_time:.2f} 秒")
+    if failed:
+        logger.warning(f"处理失败的文档: {failed}")
+    return documents
+
+
+def process_subtask(documents, subtask_id, stage_dir=None, cancel_token=None):
+    """
+    在进程池的工作进程中处理一组文档
+
+    除 TaskCancelled 外，任何异常都记录到文档的 error 中而不是抛出，这样一个子任务失败不会影响其他子任务。
+    返回前清空源文件内容，减少结果传回主进程时的序列化开销。
+
+    返回：
+        list[Document]: 填充了处理结果的文档
+    """
+    try:
+        logger.info(f"子任务 {subtask_id} 开始处理 {len(documents)} 个文档")
+        run_pipeline(documents, stage_dir=stage_dir, cancel_token=cancel_token)
+        logger.info(f"子任务 {subtask_id} 完成处理：成功 {sum(document.ok for document in documents)} 个文档")
+    except TaskCancelled:
+        logger.info(f"子任务 {subtask_id} 已取消")
+        raise
+    except Exception as e:
+        logger.error(f"子任务 {subtask_id} 处理失败: {str(e)}")
+        for document in documents:
+            document.error = document.error or str(e)
+
+    for document in documents:
+        document.data = b""
+    return documents
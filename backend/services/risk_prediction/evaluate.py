@@ -0,0 +1,286 @@
+# 模型选择与评估
+#
+# model.py 只训练一个固定参数的 AdaBoost。这里对 AdaBoost 和 HistGradientBoosting 做参数网格的分层交叉验证，
+# 所有 (参数组合, 折) 用 joblib 分发到多个 CPU 核心并行训练；每个模型族选出交叉验证最好的参数，
+# 在与 model.py 相同的训练集上重新训练并在测试集上评估，同时测量推理延迟：
+# - 每 1000 行一批的 predict_proba 耗时（对应 rescore.py / predict_batch 的批量评分）
+# - 单行 predict_proba 耗时（对应 process_data 中每个文件一次的预测）
+# - AdaBoost 额外测量线上实际使用的纯 NumPy 推理（fast_model.py）
+# 结果以 JSON 输出，并可写出 Markdown 报告，用于在质量和线上推理成本之间做选择。
+#
+# 命令行：
+#   cd backend
+#   python -m services.risk_prediction.evaluate PS_20174392719_1491204439457_log.csv --report evaluation_report.md
+#   python -m services.risk_prediction.evaluate data.csv --sample 200000 --folds 3 --jobs 8 --grid grid.json
+# --grid 为 JSON 文件，格式同 DEFAULT_GRIDS，例如 {"hist_gradient_boosting": {"max_iter": [100, 300]}}；
+# 未给出的模型族使用默认网格，给出空对象 {} 的模型族只评估默认参数。
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+from .fast_model import FastAdaBoostModel, flatten_adaboost
+from .model import DEFAULT_CHUNK_SIZE, DEFAULT_DATA_PATH, LABEL_COLUMN, feature_matrix, load_dataset, peak_rss_mb
+
+logger = logging.getLogger(__name__)
+
+RANDOM_STATE = 42
+DEFAULT_GRIDS = {
+    'adaboost': {
+        'n_estimators': [50, 100, 200],
+        'learning_rate': [0.5, 1.0],
+    },
+    'hist_gradient_boosting': {
+        'max_iter': [100, 200],
+        'learning_rate': [0.05, 0.1],
+        'max_leaf_nodes': [15, 31],
+    },
+}
+LATENCY_ROWS = 1000
+
+
+def make_model(family, params):
+    if family == 'adaboost':
+        from sklearn.ensemble import AdaBoostClassifier
+        return AdaBoostClassifier(algorithm='SAMME', random_state=RANDOM_STATE, **params)
+    if family == 'hist_gradient_boosting':
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        return HistGradientBoostingClassifier(random_state=RANDOM_STATE, **params)
+    raise ValueError(f"未知的模型族: {family}")
+
+
+def expand_grid(grid):
+    """{参数名: [取值]} → [{参数名: 取值}]"""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def score(y, proba):
+    from sklearn.metrics import average_precision_score, f1_score, log_loss, roc_auc_score
+
+    return {
+        'roc_auc': roc_auc_score(y, proba),
+        'average_precision': average_precision_score(y, proba),
+        'f1': f1_score(y, proba >= 0.5, zero_division=0),
+        'log_loss': log_loss(y, proba, labels=[0, 1]),
+    }
+
+
+def _fit_and_score(family, params, X, y, train_index, test_index):
+    """在一折上训练并评估，运行在 joblib 的工作进程中（X、y 较大时由 joblib 以 mmap 方式共享）"""
+    started = time.time()
+    model = make_model(family, params)
+    model.fit(X[train_index], y[train_index])
+    fit_seconds = time.time() - started
+    metrics = score(y[test_index], model.predict_proba(X[test_index])[:, 1])
+    return dict(metrics, fit_seconds=fit_seconds)
+
+
+def _median_seconds(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def measure_latency(model, X, repeats=20):
+    """
+    在当前进程中串行测量推理延迟（不与训练任务争抢 CPU）
+
+    返回：
+        dict: 每 1000 行一批的耗时（毫秒）、单行耗时（毫秒）；AdaBoost 另有 NumPy 推理的对应耗时
+    """
+    batch = X[:LATENCY_ROWS]
+    row = X[:1]
+    per_1k = 1000.0 / len(batch)
+    latency = {
+        'sklearn_ms_per_1k': _median_seconds(lambda: model.predict_proba(batch), repeats) * 1000 * per_1k,
+        'sklearn_ms_per_row': _median_seconds(lambda: model.predict_proba(row), repeats) * 1000,
+    }
+    if type(model).__name__ == 'AdaBoostClassifier':
+        fast = FastAdaBoostModel(*flatten_adaboost(model))
+        batch64, row64 = batch.astype(np.float64), row.astype(np.float64)
+        latency['numpy_ms_per_1k'] = _median_seconds(lambda: fast.predict_proba(batch64), repeats) * 1000 * per_1k
+        latency['numpy_ms_per_row'] = _median_seconds(lambda: fast.predict_proba(row64), repeats) * 1000
+    return latency
+
+
+def serving_ms_per_1k(latency):
+    """线上实际使用的推理方式的每 1000 行耗时：AdaBoost 为 NumPy 推理，其他为 sklearn"""
+    return latency.get('numpy_ms_per_1k', latency['sklearn_ms_per_1k'])
+
+
+def run_evaluation(data_path=DEFAULT_DATA_PATH, grids=None, folds=3, jobs=-1, sample=None, scoring='roc_auc',
+                   cache_dir=None, chunk_size=DEFAULT_CHUNK_SIZE, latency_repeats=20):
+    """
+    交叉验证参数网格，选出每个模型族的最佳参数并在测试集上评估
+
+    参数：
+        grids: {模型族: {参数名: [取值]}}，默认为 DEFAULT_GRIDS
+        folds: 交叉验证折数
+        jobs: 并行的进程数，-1 表示使用全部 CPU 核心
+        sample: 只使用训练集中的这么多行做交叉验证（分层抽样），None 表示全部
+        scoring: 选择参数所依据的指标，越大越好（roc_auc / average_precision / f1）
+
+    返回：
+        dict: 数据规模、每个参数组合的交叉验证结果、每个模型族的测试集指标和推理延迟
+    """
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import StratifiedKFold, train_test_split
+
+    started = time.time()
+    grids = grids or DEFAULT_GRIDS
+    meta, columns, _ = load_dataset(data_path, cache_dir, chunk_size)
+    # 与 model.py 相同的训练 / 测试划分
+    train_index, test_index = train_test_split(np.arange(meta['rows_kept']), test_size=0.2, random_state=RANDOM_STATE)
+    y = np.asarray(columns[LABEL_COLUMN])
+
+    cv_index = train_index
+    if sample and sample < len(train_index):
+        cv_index, _ = train_test_split(train_index, train_size=sample, stratify=y[train_index],
+                                       random_state=RANDOM_STATE)
+    X_cv = feature_matrix(columns, cv_index).to_numpy()
+    y_cv = y[cv_index]
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=RANDOM_STATE).split(X_cv, y_cv))
+
+    candidates = [(family, params) for family, grid in grids.items() for params in expand_grid(grid)]
+    logger.info(f"交叉验证 {len(candidates)} 组参数 × {folds} 折，共 {len(candidates) * folds} 次训练，"
+                f"样本 {len(cv_index)} 行")
+    cv_started = time.time()
+    fold_results = Parallel(n_jobs=jobs, verbose=5)(
+        delayed(_fit_and_score)(family, params, X_cv, y_cv, fold_train, fold_test)
+        for family, params in candidates
+        for fold_train, fold_test in splits
+    )
+    cv_seconds = time.time() - cv_started
+    del X_cv
+
+    cv_results = []
+    for i, (family, params) in enumerate(candidates):
+        results = fold_results[i * folds:(i + 1) * folds]
+        summary = {'family': family, 'params': params}
+        for metric in ('roc_auc', 'average_precision', 'f1', 'log_loss', 'fit_seconds'):
+            values = [result[metric] for result in results]
+            summary[metric] = float(np.mean(values))
+            summary[metric + '_std'] = float(np.std(values))
+        cv_results.append(summary)
+
+    best = {}
+    for summary in cv_results:
+        if summary['family'] not in best or summary[scoring] > best[summary['family']][scoring]:
+            best[summary['family']] = summary
+
+    # 每个模型族的最佳参数在完整训练集上重新训练，并行进行；延迟在之后串行测量
+    X_train, X_test = feature_matrix(columns, train_index).to_numpy(), feature_matrix(columns, test_index).to_numpy()
+    families = list(best)
+    fitted = Parallel(n_jobs=min(len(families), jobs if jobs > 0 else len(families)))(
+        delayed(make_model(family, best[family]['params']).fit)(X_train, y[train_index]) for family in families
+    )
+    del X_train
+
+    finalists = {}
+    for family, model in zip(families, fitted):
+        latency = measure_latency(model, X_test, repeats=latency_repeats)
+        finalists[family] = {
+            'params': best[family]['params'],
+            'cv': {key: value for key, value in best[family].items() if key not in ('family', 'params')},
+            'test': score(y[test_index], model.predict_proba(X_test)[:, 1]),
+            'latency': latency,
+            'serving_ms_per_1k': serving_ms_per_1k(latency),
+        }
+
+    return {
+        'data_path': os.path.abspath(data_path),
+        'rows_kept': meta['rows_kept'],
+        'cv_rows': int(len(cv_index)),
+        'test_rows': int(len(test_index)),
+        'folds': folds,
+        'scoring': scoring,
+        'cv_seconds': round(cv_seconds, 3),
+        'wall_seconds': round(time.time() - started, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'cv_results': sorted(cv_results, key=lambda summary: -summary[scoring]),
+        'finalists': finalists,
+    }
+
+
+def format_report(result):
+    """把 run_evaluation 的结果整理为 Markdown"""
+    scoring = result['scoring']
+    lines = [
+        '# 欺诈检测模型评估报告',
+        '',
+        f"- 数据：`{result['data_path']}`，筛选后 {result['rows_kept']} 行；交叉验证 {result['cv_rows']} 行 × "
+        f"{result['folds']} 折，测试集 {result['test_rows']} 行",
+        f"- 选择依据：交叉验证 `{scoring}`；交叉验证耗时 {result['cv_seconds']:.1f} 秒，总耗时 {result['wall_seconds']:.1f} 秒",
+        '',
+        '## 各模型族的最佳参数（测试集）',
+        '',
+        '| 模型 | 参数 | ROC AUC | AP | F1 | Log Loss | 线上推理 ms/1k 行 | sklearn ms/1k 行 | 单行 ms |',
+        '| --- | --- | --- | --- | --- | --- | --- | --- | --- |',
+    ]
+    for family, finalist in result['finalists'].items():
+        test, latency = finalist['test'], finalist['latency']
+        row_ms = latency.get('numpy_ms_per_row', latency['sklearn_ms_per_row'])
+        lines.append(
+            f"| {family} | `{json.dumps(finalist['params'], sort_keys=True)}` | {test['roc_auc']:.4f} | "
+            f"{test['average_precision']:.4f} | {test['f1']:.4f} | {test['log_loss']:.4f} | "
+            f"{finalist['serving_ms_per_1k']:.3f} | {latency['sklearn_ms_per_1k']:.3f} | {row_ms:.3f} |"
+        )
+    lines += [
+        '',
+        'AdaBoost 的线上推理为 fast_model.py 的纯 NumPy 实现，其他模型为 sklearn 的 predict_proba。',
+        '',
+        '## 交叉验证结果',
+        '',
+        f'| 模型 | 参数 | {scoring} | AP | F1 | Log Loss | 每折训练秒数 |',
+        '| --- | --- | --- | --- | --- | --- | --- |',
+    ]
+    for summary in result['cv_results']:
+        lines.append(
+            f"| {summary['family']} | `{json.dumps(summary['params'], sort_keys=True)}` | "
+            f"{summary[scoring]:.4f} ± {summary[scoring + '_std']:.4f} | {summary['average_precision']:.4f} | "
+            f"{summary['f1']:.4f} | {summary['log_loss']:.4f} | {summary['fit_seconds']:.2f} |"
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="交叉验证比较 AdaBoost 与 HistGradientBoosting 的质量和推理延迟")
+    parser.add_argument('data', nargs='?', default=DEFAULT_DATA_PATH, help="PaySim CSV 文件")
+    parser.add_argument('--grid', default=None, help="参数网格 JSON 文件，格式同 DEFAULT_GRIDS")
+    parser.add_argument('--folds', type=int, default=3, help="交叉验证折数")
+    parser.add_argument('--jobs', type=int, default=-1, help="并行进程数，-1 表示全部 CPU 核心")
+    parser.add_argument('--sample', type=int, default=None, help="交叉验证只使用训练集中的这么多行")
+    parser.add_argument('--scoring', default='roc_auc', choices=['roc_auc', 'average_precision', 'f1'],
+                        help="选择参数所依据的指标")
+    parser.add_argument('--cache-dir', default=None, help="筛选结果缓存目录（同 model.py）")
+    parser.add_argument('--latency-repeats', type=int, default=20, help="测量推理延迟的重复次数")
+    parser.add_argument('--report', default=None, help="写出 Markdown 报告的路径")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    grids = None
+    if args.grid:
+        with open(args.grid, 'r', encoding='utf-8') as f:
+            grids = dict(DEFAULT_GRIDS, **json.load(f))
+    result = run_evaluation(args.data, grids, folds=args.folds, jobs=args.jobs, sample=args.sample,
+                            scoring=args.scoring, cache_dir=args.cache_dir, latency_repeats=args.latency_repeats)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            f.write(format_report(result))
+        logger.info(f"评估报告已写入 {args.report}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,289 @@
+# 纯 NumPy 的 AdaBoost 推理
+#
+# prediction.py 原先在导入时就 import sklearn 并用 joblib 反序列化模型，进程池中每个新启动的工作进程都要为此
+# 付出数百毫秒和几十 MB 内存，而推理本身只是 100 个决策树桩的加权投票。
+# 这里把训练好的 SAMME AdaBoost 导出为几个 .npy 数组（节点的特征下标、阈值、左右子节点、叶子类别、
+# 每棵树的根节点位置和权重）加一个 meta.json，推理时只需要 NumPy，结果与 sklearn 逐位一致。
+#
+# 命令行：
+#   python -m services.risk_prediction.fast_model export   # 从 adaboost_model.joblib 导出
+#   python -m services.risk_prediction.fast_model verify   # 与 joblib 模型逐一比对预测概率
+# 重新训练模型后需要重新导出；meta.json 中记录了源模型文件的 sha256，不一致时 prediction.py 会回退到 joblib 模型。
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+JOBLIB_MODEL_PATH = os.path.join(CURRENT_DIR, 'adaboost_model.joblib')
+EXPORT_DIR = os.path.join(CURRENT_DIR, 'adaboost_model_npy')
+META_FILE = 'meta.json'
+
+# 导出的数组，每个保存为 <名称>.npy
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'leaf_class', 'roots', 'weights')
+LEAF = -1
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def flatten_adaboost(model):
+    """
+    把拟合好的 AdaBoostClassifier（algorithm='SAMME'）展平为 NumPy 数组
+
+    所有树的节点依次拼接在一起，left / right 存放拼接后的全局下标，叶子节点的 feature 为 -1。
+    leaf_class 是叶子预测的类别在 model.classes_ 中的位置，与 DecisionTreeClassifier.predict 一致（取 value 的 argmax）。
+
+    返回：
+        tuple: (arrays, meta)
+    """
+    if getattr(model, 'algorithm', 'SAMME') != 'SAMME':
+        raise ValueError(f"只支持 SAMME 算法，当前为 {model.algorithm}")
+
+    classes = list(model.classes_)
+    features, thresholds, lefts, rights, leaf_classes, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == LEAF
+        # 估计器自己的类别顺序映射到集成模型的类别顺序
+        class_position = np.array([classes.index(c) for c in estimator.classes_], dtype=np.int32)
+        leaf_class = class_position[np.argmax(tree.value[:, 0, :], axis=1)]
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, LEAF, tree.feature).astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(np.where(is_leaf, LEAF, tree.children_left + offset).astype(np.int32))
+        rights.append(np.where(is_leaf, LEAF, tree.children_right + offset).astype(np.int32))
+        leaf_classes.append(np.where(is_leaf, leaf_class, LEAF).astype(np.int32))
+        offset += tree.node_count
+
+    arrays = {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'left': np.concatenate(lefts),
+        'right': np.concatenate(rights),
+        'leaf_class': np.concatenate(leaf_classes),
+        'roots': np.array(roots, dtype=np.int32),
+        'weights': np.asarray(model.estimator_weights_, dtype=np.float64),
+    }
+    meta = {
+        'algorithm': 'SAMME',
+        'classes': [c.item() if hasattr(c, 'item') else c for c in classes],
+        'feature_names': [str(name) for name in getattr(model, 'feature_names_in_', [])],
+        'n_features': int(model.n_features_in_),
+        'n_estimators': len(model.estimators_),
+        'max_depth': int(max(estimator.tree_.max_depth for estimator in model.estimators_)),
+    }
+    return arrays, meta
+
+
+class FastAdaBoostModel:
+    """
+    只依赖 NumPy 的 SAMME AdaBoost 推理
+
+    用法：
+        model = FastAdaBoostModel.load()
+        proba = model.predict_proba(X)   # 形状 (N, 类别数)，与 sklearn 的 predict_proba 一致
+    """
+
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        self.classes = np.array(meta['classes'])
+        self.n_classes = len(self.classes)
+        self.max_depth = meta['max_depth']
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self._weight_sum = self.weights.sum()
+
+    @classmethod
+    def load(cls, path=EXPORT_DIR, mmap_mode=None):
+        with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(arrays, meta)
+
+    def apply(self, X):
+        """
+        返回每个样本在每棵树中落到的叶子的类别下标，形状 (树的数量, N)
+
+        与 sklearn 的决策树一样先把特征转换为 float32 再与阈值比较，保证落到同一个叶子。
+        """
+        X = np.asarray(X, dtype=np.float32).T
+        columns = np.arange(X.shape[1])
+        # 第一层所有样本都在根节点，按树取整行特征即可，不需要逐元素的花式索引（决策树桩只有这一层）
+        roots = self.roots
+        root_internal = (self.feature[roots] != LEAF)[:, None]
+        go_left = X[np.maximum(self.feature[roots], 0)] <= self.threshold[roots][:, None]
+        node = np.where(root_internal, np.where(go_left, self.left[roots][:, None], self.right[roots][:, None]),
+                        roots[:, None])
+        for _ in range(self.max_depth - 1):
+            feature = self.feature[node]
+            internal = feature != LEAF
+            if not internal.any():
+                break
+            go_left = X[np.where(internal, feature, 0), columns] <= self.threshold[node]
+            node = np.where(internal, np.where(go_left, self.left[node], self.right[node]), node)
+        return self.leaf_class[node]
+
+    def decision_function(self, X):
+        """与 AdaBoostClassifier.decision_function（SAMME）相同的计算，按树的顺序累加以保证结果逐位一致"""
+        n_classes = self.n_classes
+        leaf_class = self.apply(X)
+        weights = self.weights[:, None]
+        if n_classes == 2:
+            # 二分类时类别0的票数恰好是类别1的相反数，sklearn 的结果化简为 2 * (类别1票数之和 / 权重和)，
+            # 这里只累加类别1，每一步的舍入与 sklearn 完全相同
+            votes = np.where(leaf_class == 1, weights, -weights)
+            return 2 * (votes.sum(axis=0) / self._weight_sum)
+        # votes 形状为 (树的数量, N, 类别数)；沿第 0 轴求和时 NumPy 按树的顺序逐个累加，与 sklearn 的 sum() 相同
+        votes = np.where(leaf_class[:, :, None] == np.arange(n_classes), weights[:, :, None],
+                         -1 / (n_classes - 1) * weights[:, :, None])
+        return votes.sum(axis=0) / self._weight_sum
+
+    def predict_proba(self, X):
+        """
+        返回形状为 (N, 类别数) 的概率矩阵，列顺序同 meta.json 中的 classes
+        """
+        X = np.asarray(X)
+        if self.n_classes == 1:
+            return np.ones((X.shape[0], 1))
+        decision = self.decision_function(X)
+        if self.n_classes == 2:
+            decision = np.vstack([-decision, decision]).T / 2
+        else:
+            decision /= self.n_classes - 1
+        # 与 sklearn.utils.extmath.softmax 的计算步骤一致
+        decision -= np.max(decision, axis=1).reshape((-1, 1))
+        np.exp(decision, decision)
+        decision /= np.sum(decision, axis=1).reshape((-1, 1))
+        return decision
+
+
+def export_model(model_path=JOBLIB_MODEL_PATH, out_dir=EXPORT_DIR):
+    """从 joblib 模型导出 NumPy 数组和 meta.json（需要 sklearn）"""
+    import joblib
+
+    model = joblib.load(model_path)
+    arrays, meta = flatten_adaboost(model)
+    meta['source_sha256'] = file_sha256(model_path)
+    meta['exported_at'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    os.makedirs(out_dir, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + '.npy'), array)
+    with open(os.path.join(out_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    logger.info(f"已导出 {meta['n_estimators']} 棵树、{arrays['feature'].shape[0]} 个节点到 {out_dir}")
+    return meta
+
+
+def is_export_current(model_path=JOBLIB_MODEL_PATH, export_dir=EXPORT_DIR):
+    """导出结果是否存在且与当前的 joblib 模型文件一致"""
+    try:
+        with open(os.path.join(export_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if not os.path.exists(model_path):
+        # 只部署了导出结果，没有源模型可比对
+        return True
+    return meta.get('source_sha256') == file_sha256(model_path)
+
+
+def verification_samples(n_features, n_random=20000, seed=0):
+    """构造用于比对的样本：随机金额/余额（跨多个数量级）+ 各交易类型的独热编码 + 边界值"""
+    rng = np.random.default_rng(seed)
+    n_numeric = n_features - 5 if n_features > 5 else n_features
+    numeric = np.power(10.0, rng.uniform(-2, 8, size=(n_random, n_numeric))).round(2)
+    numeric[rng.random(numeric.shape) < 0.05] = 0.0
+    parts = [numeric]
+    if n_features > n_numeric:
+        parts.append(np.eye(n_features - n_numeric)[rng.integers(0, n_features - n_numeric, n_random)])
+    X = np.hstack(parts)
+    return np.vstack([X, np.zeros((1, n_features))])
+
+
+def verify(model_path=JOBLIB_MODEL_PATH, export_dir=EXPORT_DIR, n_random=20000, tolerance=0.0):
+    """
+    用 joblib 模型和导出的 NumPy 模型分别预测同一批样本并比较
+
+    除随机样本外，还会在每个阈值本身以及它在 float32 下前后相邻的值上取样，覆盖比较边界。
+
+    返回：
+        dict: 样本数、最大绝对误差、是否通过
+    """
+    import joblib
+    import pandas as pd
+
+    reference = joblib.load(model_path)
+    fast = FastAdaBoostModel.load(export_dir)
+    X = verification_samples(reference.n_features_in_, n_random=n_random)
+
+    # 阈值边界样本：对每个内部节点，把对应特征设置为阈值及其上下相邻的 float32 值
+    internal = np.flatnonzero(fast.feature != LEAF)
+    edges = []
+    for node in internal:
+        threshold = np.float32(fast.threshold[node])
+        for value in (np.nextafter(threshold, np.float32(-np.inf)), threshold, np.nextafter(threshold, np.float32(np.inf))):
+            row = X[len(edges) % len(X)].copy()
+            row[fast.feature[node]] = value
+            edges.append(row)
+    if edges:
+        X = np.vstack([X, np.array(edges)])
+
+    columns = fast.meta['feature_names'] or None
+    start = time.time()
+    expected = reference.predict_proba(pd.DataFrame(X, columns=columns) if columns else X)
+    sklearn_seconds = time.time() - start
+    start = time.time()
+    actual = fast.predict_proba(X)
+    numpy_seconds = time.time() - start
+
+    max_error = float(np.max(np.abs(expected - actual)))
+    return {
+        'samples': int(X.shape[0]),
+        'max_abs_error': max_error,
+        'passed': max_error <= tolerance,
+        'sklearn_seconds': round(sklearn_seconds, 4),
+        'numpy_seconds': round(numpy_seconds, 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出 AdaBoost 模型为 NumPy 数组，或校验导出结果")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help="从 joblib 模型导出")
+    verify_parser = subparsers.add_parser('verify', help="与 joblib 模型比对预测概率")
+    for sub in (export_parser, verify_parser):
+        sub.add_argument('--model', default=JOBLIB_MODEL_PATH, help="joblib 模型文件")
+        sub.add_argument('--out', default=EXPORT_DIR, help="导出目录")
+    verify_parser.add_argument('--samples', type=int, default=20000, help="随机样本数")
+    verify_parser.add_argument('--tolerance', type=float, default=0.0, help="允许的最大绝对误差")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'export':
+        meta = export_model(args.model, args.out)
+        print(json.dumps(meta, ensure_ascii=False, indent=2))
+        return 0
+
+    result = verify(args.model, args.out, n_random=args.samples, tolerance=args.tolerance)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0 if result['passed'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,65 +1,250 @@
-import pandas as pd
+# 训练 AdaBoost 欺诈检测模型
+#
+# 原先用 pd.read_csv 一次读入整个 PaySim 数据集（数 GB），筛选后写出 updatedData1.csv 再读回来训练，
+# 内存中同时存在好几份完整数据。现在改为：
+# - 分块读取 CSV，只读需要的 5 列并指定紧凑的类型（type 为 category，isFraud 为 int8）
+# - 每块单独应用余额一致性筛选（amount ≈ |oldbalanceOrg - newbalanceOrig|），筛选后金额转为 float32 保存
+# - 筛选结果按列缓存为 .npy（与 CSV 的路径、大小、修改时间绑定），再次训练时以 mmap 方式直接读取
+# - 输出各阶段耗时、峰值内存和模型在测试集 / 训练集上的指标
+#
+# 筛选仍按 float64 计算，保证保留的行与原来完全一致；决策树训练时本来就会把特征转换为 float32，
+# 所以得到的模型与原流程相同。
+#
+# 命令行：
+#   cd backend
+#   python -m services.risk_prediction.model PS_20174392719_1491204439457_log.csv
+#   python -m services.risk_prediction.model data.csv --out /tmp/adaboost_model.joblib --rebuild-cache
+# 训练完成后按 README 第 4、6 节导出并注册为新的模型版本。
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
 import numpy as np
-import joblib
+import pandas as pd
+
+from .fast_model import JOBLIB_MODEL_PATH
+from .prediction import FEATURE_COLUMNS, TYPE_COLUMNS
+
 pd.options.display.max_columns = None
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, confusion_matrix, log_loss
-from sklearn.ensemble import AdaBoostClassifier
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import roc_auc_score
-
-path = r'PS_20174392719_1491204439457_log.csv'
-
-df = pd.read_csv(path,encoding='utf-8')
-df=df[['type','amount','oldbalanceOrg','newbalanceOrig','isFraud']]
-df = df[np.isclose(df['amount'], abs(df['oldbalanceOrg'] - df['newbalanceOrig']), atol=1)]
-df.to_csv("updatedData1.csv", index=False,encoding='utf-8')  # 保存为 CSV 文件
-df = pd.read_csv('updatedData1.csv',encoding='utf-8')
-encoded_df = pd.get_dummies(df,columns=['type'])
-##print(encoded_df)
-X = encoded_df.drop(columns=['isFraud'])  # 替换为目标变量的实际列名
-y = encoded_df['isFraud']
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-ada_model = AdaBoostClassifier(n_estimators=100,learning_rate=1.0,random_state=42,algorithm='SAMME')
-ada_model.fit(X_train, y_train)
-joblib.dump(ada_model,'adaboost_model.joblib')
-
-#print("Test:")
-y_pred = ada_model.predict(X_test)
-y_pred_proba = ada_model.predict_proba(X_test)[:, 1]
-#print(y_pred_proba)
-roc_auc = roc_auc_score(y_test, y_pred_proba)
-accuracy = accuracy_score(y_test, y_pred)
-precision = precision_score(y_test, y_pred)
-recall = recall_score(y_test, y_pred)
-f1 = f1_score(y_test, y_pred)
-roc_auc = roc_auc_score(y_test, y_pred_proba)
-logloss = log_loss(y_test, y_pred_proba)
-conf_matrix = confusion_matrix(y_test, y_pred)
-#print(f"Accuracy: {accuracy:.10f}")
-#print(f"Precision: {precision:.10f}")
-#print(f"Recall: {recall:.10f}")
-#print(f"F1 Score: {f1:.10f}")
-#print(f"ROC AUC: {roc_auc:.10f}")
-#print(f"Log Loss: {logloss:.10f}")
-#print("Confusion Matrix:")
-#print(conf_matrix)
-#print("Train:")
-y_pred = ada_model.predict(X_train)
-y_pred_proba = ada_model.predict_proba(X_train)[:, 1]
-#print(y_pred_proba)
-roc_auc = roc_auc_score(y_train, y_pred_proba)
-accuracy = accuracy_score(y_train, y_pred)
-precision = precision_score(y_train, y_pred)
-recall = recall_score(y_train, y_pred)
-f1 = f1_score(y_train, y_pred)
-roc_auc = roc_auc_score(y_train, y_pred_proba)
-logloss = log_loss(y_train, y_pred_proba)
-conf_matrix = confusion_matrix(y_train, y_pred)
-#print(f"Accuracy: {accuracy:.10f}")
-#print(f"Precision: {precision:.10f}")
-#print(f"Recall: {recall:.10f}")
-#print(f"F1 Score: {f1:.10f}")
-#print(f"ROC AUC: {roc_auc:.10f}")
-#print(f"Log Loss: {logloss:.10f}")
-#print("Confusion Matrix:")
-#print(conf_matrix)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_PATH = r'PS_20174392719_1491204439457_log.csv'
+DEFAULT_CHUNK_SIZE = 500_000
+# 余额一致性筛选的容差
+BALANCE_ATOL = 1
+
+AMOUNT_COLUMNS = ['amount', 'oldbalanceOrg', 'newbalanceOrig']
+LABEL_COLUMN = 'isFraud'
+# 分块读取时的列类型：金额先按 float64 读入用于筛选，筛选后再转为 float32
+CSV_DTYPES = {
+    'type': pd.CategoricalDtype(TYPE_COLUMNS),
+    'amount': np.float64,
+    'oldbalanceOrg': np.float64,
+    'newbalanceOrig': np.float64,
+    LABEL_COLUMN: np.int8,
+}
+# 缓存中每列的存储类型；type 保存为 TYPE_COLUMNS 中的下标
+CACHE_COLUMNS = {'type': np.int8, 'amount': np.float32, 'oldbalanceOrg': np.float32,
+                 'newbalanceOrig': np.float32, LABEL_COLUMN: np.int8}
+CACHE_META = 'meta.json'
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）；Windows 上没有 resource 模块，返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def default_cache_dir(data_path):
+    return os.path.splitext(os.path.abspath(data_path))[0] + '_filtered_npy'
+
+
+def _source_signature(data_path):
+    stat = os.stat(data_path)
+    return {'source': os.path.abspath(data_path), 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'atol': BALANCE_ATOL}
+
+
+def iter_filtered_chunks(data_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    分块读取 CSV 并筛选
+
+    返回：
+        generator: 每块产出 (读取的行数, {列名: 紧凑类型的 numpy 数组})
+    """
+    reader = pd.read_csv(data_path, encoding='utf-8', usecols=list(CSV_DTYPES), dtype=CSV_DTYPES,
+                         chunksize=chunk_size)
+    for chunk in reader:
+        keep = np.isclose(chunk['amount'], abs(chunk['oldbalanceOrg'] - chunk['newbalanceOrig']), atol=BALANCE_ATOL)
+        # 不在 TYPE_COLUMNS 中的交易类型读入后为 NaN，无法编码为训练特征，丢弃
+        keep &= chunk['type'].notna().to_numpy()
+        chunk = chunk[keep]
+        columns = {'type': chunk['type'].cat.codes.to_numpy(dtype=np.int8)}
+        for column in AMOUNT_COLUMNS:
+            columns[column] = chunk[column].to_numpy(dtype=np.float32)
+        columns[LABEL_COLUMN] = chunk[LABEL_COLUMN].to_numpy(dtype=np.int8)
+        yield len(keep), columns
+
+
+def build_cache(data_path, cache_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+    """分块筛选 CSV，把结果按列写入 cache_dir，返回 meta"""
+    parts = {column: [] for column in CACHE_COLUMNS}
+    rows_read = 0
+    for n, columns in iter_filtered_chunks(data_path, chunk_size):
+        rows_read += n
+        for column, values in columns.items():
+            parts[column].append(values)
+        logger.info(f"已读取 {rows_read} 行，保留 {sum(len(part) for part in parts['type'])} 行")
+
+    os.makedirs(cache_dir, exist_ok=True)
+    rows_kept = 0
+    for column, dtype in CACHE_COLUMNS.items():
+        values = np.concatenate(parts.pop(column)) if parts[column] else np.empty(0, dtype=dtype)
+        rows_kept = len(values)
+        np.save(os.path.join(cache_dir, column + '.npy'), values.astype(dtype, copy=False))
+        del values
+
+    # meta.json 最后写入，中途失败时不会留下被当作有效的缓存
+    meta = dict(_source_signature(data_path), rows_read=rows_read, rows_kept=rows_kept,
+                columns={column: np.dtype(dtype).name for column, dtype in CACHE_COLUMNS.items()})
+    with open(os.path.join(cache_dir, CACHE_META), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def load_cache(data_path, cache_dir):
+    """缓存与 CSV 一致时以 mmap 方式返回 (meta, {列名: 数组})，否则返回 None"""
+    try:
+        with open(os.path.join(cache_dir, CACHE_META), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    signature = _source_signature(data_path)
+    if any(meta.get(key) != value for key, value in signature.items()):
+        return None
+    columns = {column: np.load(os.path.join(cache_dir, column + '.npy'), mmap_mode='r') for column in CACHE_COLUMNS}
+    return meta, columns
+
+
+def feature_matrix(columns, index):
+    """按行下标构造 float32 特征矩阵（列顺序同 FEATURE_COLUMNS），类型列展开为独热编码"""
+    n_numeric = len(AMOUNT_COLUMNS)
+    X = np.zeros((len(index), len(FEATURE_COLUMNS)), dtype=np.float32)
+    for i, column in enumerate(AMOUNT_COLUMNS):
+        X[:, i] = columns[column][index]
+    X[np.arange(len(index)), n_numeric + columns['type'][index]] = 1.0
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
+
+
+def evaluate(model, X, y):
+    from sklearn.metrics import (accuracy_score, confusion_matrix, f1_score, log_loss, precision_score,
+                                 recall_score, roc_auc_score)
+
+    y_pred = model.predict(X)
+    y_pred_proba = model.predict_proba(X)[:, 1]
+    return {
+        'accuracy': accuracy_score(y, y_pred),
+        'precision': precision_score(y, y_pred, zero_division=0),
+        'recall': recall_score(y, y_pred, zero_division=0),
+        'f1': f1_score(y, y_pred, zero_division=0),
+        'roc_auc': roc_auc_score(y, y_pred_proba),
+        'log_loss': log_loss(y, y_pred_proba, labels=[0, 1]),
+        'confusion_matrix': confusion_matrix(y, y_pred, labels=[0, 1]).tolist(),
+    }
+
+
+def load_dataset(data_path=DEFAULT_DATA_PATH, cache_dir=None, chunk_size=DEFAULT_CHUNK_SIZE, rebuild_cache=False):
+    """
+    读取筛选后的数据集，缓存不存在或已过期时先分块构建
+
+    返回：
+        tuple: (meta, {列名: 数组}, 'hit' 或 'built')
+    """
+    cache_dir = cache_dir or default_cache_dir(data_path)
+    cached = None if rebuild_cache else load_cache(data_path, cache_dir)
+    if cached is not None:
+        logger.info(f"使用缓存的筛选结果 {cache_dir}")
+        return cached + ('hit',)
+    logger.info(f"分块读取 {data_path}，每块 {chunk_size} 行，筛选结果缓存到 {cache_dir}")
+    build_cache(data_path, cache_dir, chunk_size)
+    return load_cache(data_path, cache_dir) + ('built',)
+
+
+def train(data_path=DEFAULT_DATA_PATH, out_path=JOBLIB_MODEL_PATH, cache_dir=None, chunk_size=DEFAULT_CHUNK_SIZE,
+          rebuild_cache=False, evaluate_train=True):
+    """
+    训练并保存模型
+
+    返回：
+        dict: 数据规模、各阶段耗时、峰值内存和评估指标
+    """
+    import joblib
+    from sklearn.ensemble import AdaBoostClassifier
+    from sklearn.model_selection import train_test_split
+
+    started = time.time()
+    meta, columns, cache_status = load_dataset(data_path, cache_dir, chunk_size, rebuild_cache)
+    load_seconds = time.time() - started
+
+    # 与原来对整个 DataFrame 调用 train_test_split 的划分相同（划分只取决于行数和 random_state），
+    # 但只切分行下标，训练集和测试集的特征矩阵按需构造，不保留完整数据的副本
+    train_index, test_index = train_test_split(np.arange(meta['rows_kept']), test_size=0.2, random_state=42)
+    y = np.asarray(columns[LABEL_COLUMN])
+
+    fit_started = time.time()
+    X_train = feature_matrix(columns, train_index)
+    ada_model = AdaBoostClassifier(n_estimators=100, learning_rate=1.0, random_state=42, algorithm='SAMME')
+    ada_model.fit(X_train, y[train_index])
+    fit_seconds = time.time() - fit_started
+    joblib.dump(ada_model, out_path)
+    logger.info(f"模型已保存到 {out_path}")
+
+    metrics = {}
+    if evaluate_train:
+        metrics['train'] = evaluate(ada_model, X_train, y[train_index])
+    del X_train
+    metrics['test'] = evaluate(ada_model, feature_matrix(columns, test_index), y[test_index])
+
+    return {
+        'data_path': os.path.abspath(data_path),
+        'model_path': os.path.abspath(out_path),
+        'cache': cache_status,
+        'rows_read': meta['rows_read'],
+        'rows_kept': meta['rows_kept'],
+        'load_seconds': round(load_seconds, 3),
+        'fit_seconds': round(fit_seconds, 3),
+        'wall_seconds': round(time.time() - started, 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'metrics': metrics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分块读取 PaySim 数据并训练 AdaBoost 欺诈检测模型")
+    parser.add_argument('data', nargs='?', default=DEFAULT_DATA_PATH, help="PaySim CSV 文件")
+    parser.add_argument('--out', default=JOBLIB_MODEL_PATH, help="模型输出路径")
+    parser.add_argument('--cache-dir', default=None, help="筛选结果缓存目录，默认为 CSV 同目录下的 <文件名>_filtered_npy")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="每块读取的行数")
+    parser.add_argument('--rebuild-cache', action='store_true', help="忽略已有缓存，重新读取 CSV")
+    parser.add_argument('--skip-train-metrics', action='store_true', help="不计算训练集上的指标")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = train(args.data, args.out, args.cache_dir, args.chunk_size, args.rebuild_cache,
+                   evaluate_train=not args.skip_train_metrics)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
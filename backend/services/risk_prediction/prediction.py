@@ -1,132 +1,256 @@
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import AdaBoostClassifier
-from sklearn.model_selection import train_test_split
-import joblib
+import logging
 import os
+import threading
+import time
+
+from .fast_model import FastAdaBoostModel, JOBLIB_MODEL_PATH, EXPORT_DIR, is_export_current, file_sha256
+from .registry import active_version, load_version
+
+logger = logging.getLogger(__name__)
+
+# 推理后端：auto 在导出的 NumPy 模型与 joblib 模型一致时使用前者，否则回退到 sklearn；
+# numpy / sklearn 强制使用对应后端。sklearn 和 joblib 只在使用 sklearn 后端时才导入
+PREDICTION_BACKEND = os.getenv("PREDICTION_BACKEND", "auto")
+# 固定使用模型仓库（registry.py）中的某个版本；为空时跟随仓库的 ACTIVE 版本
+PREDICTION_MODEL_VERSION = os.getenv("PREDICTION_MODEL_VERSION", "")
+# 每隔多少秒检查一次 ACTIVE 版本是否变化，变化时在当前进程内热切换模型
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", "5"))
+
+# 模型训练时 pd.get_dummies 生成的特征列，顺序必须与训练时一致
+FEATURE_COLUMNS = ['amount', 'oldbalanceOrg', 'newbalanceOrig', 'type_CASH_IN', 'type_CASH_OUT', 'type_DEBIT',
+                   'type_PAYMENT', 'type_TRANSFER']
+TYPE_COLUMNS = ['CASH_IN', 'CASH_OUT', 'DEBIT', 'PAYMENT', 'TRANSFER']
+# 交易类型 → 独热编码的列号；存款、取款是表头字段抽取输出的叫法，与入账、提现等价
+TRANSACTION_TYPE_INDEX = {
+    '入账': 0, '存款': 0,
+    '提现': 1, '取款': 1,
+    '借记': 2,
+    '支付': 3,
+    '转账': 4,
+}
+TYPE_FIELD = '交易类型'
+# 表头字段 → 数值特征列
+NUMERIC_FIELDS = {'交易金额': 'amount', '初始账户旧余额': 'oldbalanceOrg', '初始账户新余额': 'newbalanceOrig'}
+
+MISSING_VALUE = '无'
+INSUFFICIENT_DATA = '交易数据不足'
+INVALID_TYPE = '交易类型错误'
 
 train_columns = {}
 class AdaBoostPredicModel:
-    def __init__(self):
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        # #print(current_dir)
-        self.model = joblib.load(os.path.join(current_dir, 'adaboost_model.joblib'))
+    def __init__(self, backend=PREDICTION_BACKEND, version=None):
+        if version and backend != 'sklearn':
+            # 模型仓库中的版本：校验和通过后以只读 mmap 方式打开，多个工作进程共享同一份页缓存
+            self.model = load_version(version)
+            self.backend = 'numpy'
+            self.version = version
+        elif backend == 'numpy' or (backend == 'auto' and is_export_current()):
+            # 纯 NumPy 推理，不需要导入 sklearn，见 fast_model.py
+            self.model = FastAdaBoostModel.load(EXPORT_DIR, mmap_mode='r')
+            self.backend = 'numpy'
+            self.version = self.model.meta.get('version') or self.model.meta['source_sha256'][:12]
+        else:
+            if backend == 'auto':
+                logger.warning("导出的 NumPy 模型不存在或已过期，使用 sklearn 模型；"
+                               "可运行 python -m services.risk_prediction.fast_model export 重新导出")
+            import joblib
+            self.model = joblib.load(JOBLIB_MODEL_PATH)
+            self.backend = 'sklearn'
+            self.version = file_sha256(JOBLIB_MODEL_PATH)[:12]
 
     def TrainandPred(self,X0):
-        y_pred = self.model.predict(X0)
-        y_pred_proba0 = self.model.predict_proba(X0)[:, 0]
-        y_pred_proba = self.model.predict_proba(X0)[:, 1]
-        # result =  {
-        #     "predict": y_pred.tolist(),
-        #     "probability of predict as 0": y_pred_proba0.tolist(),
-        #     "probability of predict as 1": y_pred_proba.tolist(),
-        # }
-        result = y_pred_proba[0]
-        #print("probability of predict as 1:", result)
-        return result
+        # 只调用一次 predict_proba，返回第一行预测为欺诈（类别1）的概率
+        return self.predict_proba(X0)[0]
 
+    def predict_proba(self, X):
+        """
+        批量预测
 
-from flask import request, jsonify
-import openpyxl
+        参数：
+            X: 特征矩阵（列顺序同 FEATURE_COLUMNS），numpy 数组或 DataFrame
 
-model = AdaBoostPredicModel()
+        返回：
+            np.ndarray: 每一行预测为欺诈（类别1）的概率
+        """
+        if self.backend == 'numpy':
+            return self.model.predict_proba(np.asarray(X, dtype=np.float64))[:, 1]
+        if isinstance(X, np.ndarray):
+            # 模型是用带列名的 DataFrame 训练的，传入同名列避免 sklearn 的特征名警告
+            X = pd.DataFrame(X, columns=FEATURE_COLUMNS)
+        return self.model.predict_proba(X)[:, 1]
 
-def predict_once(file_path):
-    # 获取上传的文件
-    # 将文件内容读取为字符串
-    df = pd.read_excel(file_path, engine='openpyxl', nrows=11)
-    for i in range(0, 11):
-        if i != 1 and i != 2 and i != 9 and i != 10:
-            df = df.drop(index=i)
-    columns = ['交易类型', '交易金额', '初始账户旧余额', '初始账户新余额']
-    data = pd.DataFrame(
-        columns=['amount', 'oldbalanceOrg', 'newbalanceOrig', 'type_CASH_IN', 'type_CASH_OUT', 'type_DEBIT',
-                 'type_PAYMENT', 'type_TRANSFER'])
-    for key in columns:
-        # 找到包含特定条目的行
-        mask = df['表头中具体条目'] == key
-        if mask.any():
-            content = df.loc[mask, '内容'].iloc[0]
-            if key == '交易类型':
-                if content == '入账':
-                    data.loc[0, 'type_CASH_IN'] = True
-                    data.loc[0, 'type_CASH_OUT'] = False
-                    data.loc[0, 'type_DEBIT'] = False
-                    data.loc[0, 'type_PAYMENT'] = False
-                    data.loc[0, 'type_TRANSFER'] = False
-                elif content == '提现':
-                    data.loc[0, 'type_CASH_IN'] = False
-                    data.loc[0, 'type_CASH_OUT'] = True
-                    data.loc[0, 'type_DEBIT'] = False
-                    data.loc[0, 'type_PAYMENT'] = False
-                    data.loc[0, 'type_TRANSFER'] = False
-                elif content == '借记':
-                    data.loc[0, 'type_CASH_IN'] = False
-                    data.loc[0, 'type_CASH_OUT'] = False
-                    data.loc[0, 'type_DEBIT'] = True
-                    data.loc[0, 'type_PAYMENT'] = False
-                    data.loc[0, 'type_TRANSFER'] = False
-                elif content == '支付':
-                    data.loc[0, 'type_CASH_IN'] = False
-                    data.loc[0, 'type_CASH_OUT'] = False
-                    data.loc[0, 'type_DEBIT'] = False
-                    data.loc[0, 'type_PAYMENT'] = True
-                    data.loc[0, 'type_TRANSFER'] = False
-                elif content == '转账':
-                    data.loc[0, 'type_CASH_IN'] = False
-                    data.loc[0, 'type_CASH_OUT'] = False
-                    data.loc[0, 'type_DEBIT'] = False
-                    data.loc[0, 'type_PAYMENT'] = False
-                    data.loc[0, 'type_TRANSFER'] = True
-                elif content == '无':
-                    #print("error:交易数据不足")
-                    return
-                else:
-                    #print("error:交易类型错误")
-                    return
-            elif key == '交易金额':
-                if content == '无':
-                    #print("error:交易数据不足")
-                    return
-                else:
-                    data.loc[0, 'amount'] = content
-            elif key == '初始账户旧余额':
-                if content == '无':
-                    #print("error:交易数据不足")
-                    return
-                else:
-                    data.loc[0, 'oldbalanceOrg'] = content
-            elif key == '初始账户新余额':
-                if content == '无':
-                    #print("error:交易数据不足")
-                    return
+
+_model_lock = threading.Lock()
+_current_model = None
+_next_check = 0.0
+# 加载失败的版本（版本内容不可修改，不必每次检查都重试），ACTIVE 切换到其他版本后清除
+_failed_version = None
+
+
+def _wanted_version():
+    """应该使用的模型仓库版本；None 表示不使用仓库（仓库为空或强制 sklearn 后端）"""
+    if PREDICTION_BACKEND == 'sklearn':
+        return None
+    return PREDICTION_MODEL_VERSION or active_version()
+
+
+def get_model():
+    """
+    返回当前进程使用的模型：第一次调用时加载，之后每隔 MODEL_RELOAD_INTERVAL 秒检查一次仓库的 ACTIVE 版本，
+    版本变化时加载新版本并替换引用（正在使用旧模型的调用不受影响），新版本加载失败时继续使用旧模型
+    """
+    global _current_model, _next_check, _failed_version
+    model = _current_model
+    if model is not None and time.monotonic() < _next_check:
+        return model
+    with _model_lock:
+        if _current_model is None or time.monotonic() >= _next_check:
+            _next_check = time.monotonic() + MODEL_RELOAD_INTERVAL
+            version = _wanted_version()
+            changed = version is not None and version != _current_model.version if _current_model else True
+            if changed and (_current_model is None or version != _failed_version):
+                try:
+                    model = AdaBoostPredicModel(version=version)
+                except Exception as e:
+                    if _current_model is None:
+                        raise
+                    _failed_version = version
+                    logger.error(f"加载风险预测模型版本 {version} 失败，继续使用 {_current_model.version}: {str(e)}")
                 else:
-                    data.loc[0, 'newbalanceOrig'] = content
-        else:
-            # 如果没有找到特定条目，添加空值
-            data[key] = [None]
+                    _failed_version = None
+                    previous = _current_model
+                    _current_model = model
+                    if previous is None:
+                        logger.info(f"风险预测模型已加载，版本 {model.version}，推理后端: {model.backend}")
+                    else:
+                        logger.info(f"风险预测模型已从 {previous.version} 切换到 {model.version}")
+        return _current_model
+
+
+def reload_model():
+    """立即检查并加载 ACTIVE 版本，不等待 MODEL_RELOAD_INTERVAL"""
+    global _next_check
+    _next_check = 0.0
+    return get_model()
+
+
+def frame_to_fields(df):
+    """把表头模板格式的表格（含 表头中具体条目、内容 两列）转换为 {字段名: 内容}"""
+    return dict(zip(df['表头中具体条目'], df['内容']))
 
-    # 训练模型并预测
 
-    results = model.TrainandPred(data)
-    return results
+def build_feature_matrix(records):
+    """
+    把多个文档的表头字段一次性转换为特征矩阵
+
+    参数：
+        records: list[dict]，每个元素为一个文档的 {字段名: 内容}
+
+    返回：
+        tuple: (X, errors)
+            X: 形状为 (N, 8) 的 float64 矩阵，列顺序同 FEATURE_COLUMNS；校验失败的行全为 0
+            errors: 长度为 N 的列表，校验通过为 None，否则为错误说明
+    """
+    n = len(records)
+    X = np.zeros((n, len(FEATURE_COLUMNS)), dtype=np.float64)
+    errors = np.full(n, None, dtype=object)
+    if not n:
+        return X, []
+
+    # 交易类型：映射为列号，缺失为 -2，无法识别为 -1
+    types = pd.Series([record.get(TYPE_FIELD) for record in records], dtype=object)
+    types = types.where(types.isna(), types.astype(str).str.strip())
+    missing_type = types.isna() | (types == MISSING_VALUE)
+    type_index = types.map(TRANSACTION_TYPE_INDEX).fillna(-1).astype(np.int64).to_numpy()
+    type_index[missing_type.to_numpy()] = -2
+
+    # 金额与余额：去掉千分位逗号和首尾空白后统一转为数值，无法转换的记为 NaN
+    missing_numeric = np.zeros(n, dtype=bool)
+    invalid_numeric = np.zeros(n, dtype=bool)
+    for field, feature in NUMERIC_FIELDS.items():
+        column = FEATURE_COLUMNS.index(feature)
+        raw = pd.Series([record.get(field) for record in records], dtype=object)
+        text = raw.astype(str).str.replace(',', '', regex=False).str.strip()
+        missing = raw.isna() | (text == MISSING_VALUE) | (text == '')
+        values = pd.to_numeric(text.where(~missing), errors='coerce').to_numpy(dtype=np.float64)
+        missing_numeric |= missing.to_numpy()
+        invalid_numeric |= np.isnan(values) & ~missing.to_numpy()
+        X[:, column] = np.nan_to_num(values)
+
+    valid_type = type_index >= 0
+    X[np.flatnonzero(valid_type), len(NUMERIC_FIELDS) + type_index[valid_type]] = 1.0
+
+    # 与原逐条校验的优先级一致：先检查交易类型，再检查数值字段
+    errors[invalid_numeric] = INSUFFICIENT_DATA
+    errors[missing_numeric] = INSUFFICIENT_DATA
+    errors[type_index == -1] = INVALID_TYPE
+    errors[type_index == -2] = INSUFFICIENT_DATA
+    X[errors != None] = 0.0  # noqa: E711
+    return X, errors.tolist()
+
+
+def predict_batch(records, model=None):
+    """
+    批量预测多个文档的欺诈概率：构造一个特征矩阵，只调用一次 predict_proba
+
+    参数：
+        records: list[dict]，每个元素为一个文档的 {字段名: 内容}
+        model: 使用的 AdaBoostPredicModel，默认为 get_model()；需要记录模型版本时由调用方先取出模型再传入
+
+    返回：
+        tuple: (probabilities, errors)，两个与 records 等长的列表
+            probabilities: 预测为欺诈的概率，校验失败的文档为 None
+            errors: 校验通过为 None，否则为错误说明（交易数据不足 / 交易类型错误）
+    """
+    X, errors = build_feature_matrix(records)
+    probabilities = [None] * len(records)
+    valid = [i for i, error in enumerate(errors) if error is None]
+    if valid:
+        model = model or get_model()
+        for i, probability in zip(valid, model.predict_proba(X[valid])):
+            probabilities[i] = float(probability)
+    return probabilities, errors
+
+
+def predict_fields(fields):
+    """
+    直接根据字段抽取阶段得到的 {字段名: 内容} 预测欺诈概率，不需要先写出再读回结果表格
+
+    返回：
+        tuple: (probability, error)，校验失败时 probability 为 None、error 为错误说明
+    """
+    probabilities, errors = predict_batch([fields or {}])
+    return probabilities[0], errors[0]
+
+
+def predict_once(file_path):
+    # 读取表头模板格式的结果表格并预测
+    df = pd.read_excel(file_path, engine='openpyxl', nrows=11)
+    return predict_frame(df)
+
+def predict_frame(df):
+    # 根据表头模板格式的表格（含 表头中具体条目、内容 两列）预测欺诈概率，可直接使用内存中的结果
+    probabilities, _ = predict_batch([frame_to_fields(df)])
+    return probabilities[0]
 
 #示例操作调用函数
 
 def predict_all(source_dir=None):
     current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), './SourceData')
+
     dir_path = source_dir if source_dir else os.path.join(current_dir, "SourceData")
-    #
-    
-    file_list = os.listdir(dir_path)
-    results = {}
-    for file in file_list:
-        file_path = os.path.join(dir_path, file)
+
+    # 先读取所有 excel 文件，再一次性批量预测
+    names, records = [], []
+    for file in os.listdir(dir_path):
         # 如果是excel文件，则预测
         if file.endswith('.xlsx'):
-            results[file] = predict_once(file_path)
-    return results
+            df = pd.read_excel(os.path.join(dir_path, file), engine='openpyxl', nrows=11)
+            names.append(file)
+            records.append(frame_to_fields(df))
+    probabilities, _ = predict_batch(records)
+    return dict(zip(names, probabilities))
 
-# #print(predict_all(dir_path))
\ No newline at end of file
+# #print(predict_all(dir_path))
@@ -0,0 +1,195 @@
+# 风险预测模型仓库
+#
+# 每个模型版本是仓库目录下的一个子目录，内容与 fast_model.py 的导出结果相同（若干 .npy 数组 + meta.json），
+# meta.json 另外记录版本号、注册时间、说明和每个数组文件的 sha256：
+#
+#   model_registry/
+#     ACTIVE              当前生效的版本号（一行文本）
+#     v1/meta.json
+#     v1/feature.npy ...
+#
+# - 注册：先写入临时目录并计算校验和，全部完成后 os.rename 为版本目录，读到的版本目录总是完整的
+# - 切换：写临时文件后 os.replace 替换 ACTIVE，正在运行的进程在下一次检查时（MODEL_RELOAD_INTERVAL）加载新版本，无需重启
+# - 加载：先校验每个数组的 sha256，再以 mmap 方式打开，同一台机器上的多个工作进程共享同一份页缓存
+#
+# 命令行：
+#   python -m services.risk_prediction.registry register v2 --from services/risk_prediction/adaboost_model_npy --activate
+#   python -m services.risk_prediction.registry list
+#   python -m services.risk_prediction.registry activate v1      # 回滚
+#   python -m services.risk_prediction.registry verify v2
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+
+from .fast_model import ARRAY_NAMES, EXPORT_DIR, META_FILE, FastAdaBoostModel, file_sha256
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join(CURRENT_DIR, 'model_registry'))
+ACTIVE_FILE = 'ACTIVE'
+
+VERSION_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+class ModelRegistryError(Exception):
+    """版本不存在、版本号非法或校验和不一致"""
+
+
+def _version_dir(version, registry_dir=REGISTRY_DIR):
+    if not VERSION_PATTERN.match(version or ''):
+        raise ModelRegistryError(f"非法的模型版本号: {version!r}")
+    return os.path.join(registry_dir, version)
+
+
+def read_meta(version, registry_dir=REGISTRY_DIR):
+    path = os.path.join(_version_dir(version, registry_dir), META_FILE)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ModelRegistryError(f"模型版本 {version} 不存在")
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    """返回所有已注册版本的 meta，按注册时间排序"""
+    if not os.path.isdir(registry_dir):
+        return []
+    metas = []
+    for name in os.listdir(registry_dir):
+        if VERSION_PATTERN.match(name) and os.path.exists(os.path.join(registry_dir, name, META_FILE)):
+            metas.append(read_meta(name, registry_dir))
+    return sorted(metas, key=lambda meta: meta.get('registered_at', ''))
+
+
+def active_version(registry_dir=REGISTRY_DIR):
+    """当前生效的版本号；仓库为空或未设置时返回 None"""
+    try:
+        with open(os.path.join(registry_dir, ACTIVE_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def activate(version, registry_dir=REGISTRY_DIR):
+    """原子地切换当前版本；切换前校验目标版本完整"""
+    verify_version(version, registry_dir)
+    tmp_path = os.path.join(registry_dir, f".{ACTIVE_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(registry_dir, ACTIVE_FILE))
+    logger.info(f"风险预测模型已切换到版本 {version}")
+
+
+def register(version, source_dir=EXPORT_DIR, description='', registry_dir=REGISTRY_DIR, activate_now=False):
+    """
+    把 fast_model.py 导出的模型目录注册为一个新版本
+
+    参数：
+        version: 版本号，只能包含字母、数字、点、下划线和连字符；已存在时报错，版本内容不可修改
+        source_dir: 导出目录（python -m services.risk_prediction.fast_model export 的输出）
+        description: 说明，例如训练数据、评估结果
+        activate_now: 注册后立即切换为当前版本
+
+    返回：
+        dict: 新版本的 meta
+    """
+    target = _version_dir(version, registry_dir)
+    if os.path.exists(target):
+        raise ModelRegistryError(f"模型版本 {version} 已存在")
+    with open(os.path.join(source_dir, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+
+    os.makedirs(registry_dir, exist_ok=True)
+    staging = os.path.join(registry_dir, f".{version}.{os.getpid()}.tmp")
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    try:
+        checksums = {}
+        for name in ARRAY_NAMES:
+            filename = name + '.npy'
+            shutil.copyfile(os.path.join(source_dir, filename), os.path.join(staging, filename))
+            checksums[filename] = file_sha256(os.path.join(staging, filename))
+        meta.update({
+            'version': version,
+            'description': description,
+            'registered_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'checksums': checksums,
+        })
+        with open(os.path.join(staging, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.rename(staging, target)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    logger.info(f"已注册风险预测模型版本 {version}")
+
+    if activate_now:
+        activate(version, registry_dir)
+    return meta
+
+
+def verify_version(version, registry_dir=REGISTRY_DIR):
+    """校验版本目录中每个数组文件的 sha256 与注册时记录的一致"""
+    meta = read_meta(version, registry_dir)
+    directory = _version_dir(version, registry_dir)
+    for filename, expected in meta.get('checksums', {}).items():
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path) or file_sha256(path) != expected:
+            raise ModelRegistryError(f"模型版本 {version} 的文件 {filename} 缺失或校验和不一致")
+    return meta
+
+
+def load_version(version, registry_dir=REGISTRY_DIR, mmap_mode='r'):
+    """校验后以只读 mmap 方式加载指定版本"""
+    verify_version(version, registry_dir)
+    return FastAdaBoostModel.load(_version_dir(version, registry_dir), mmap_mode=mmap_mode)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="管理风险预测模型的版本")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    register_parser = subparsers.add_parser('register', help="注册导出的模型为新版本")
+    register_parser.add_argument('version')
+    register_parser.add_argument('--from', dest='source_dir', default=EXPORT_DIR, help="fast_model.py 的导出目录")
+    register_parser.add_argument('--description', default='', help="版本说明")
+    register_parser.add_argument('--activate', action='store_true', help="注册后立即切换为当前版本")
+    activate_parser = subparsers.add_parser('activate', help="切换当前版本")
+    activate_parser.add_argument('version')
+    verify_parser = subparsers.add_parser('verify', help="校验版本的文件完整性")
+    verify_parser.add_argument('version')
+    subparsers.add_parser('list', help="列出所有版本")
+    parser.add_argument('--registry', default=REGISTRY_DIR, help="模型仓库目录")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        if args.command == 'register':
+            meta = register(args.version, args.source_dir, args.description, args.registry, args.activate)
+            print(json.dumps(meta, ensure_ascii=False, indent=2))
+        elif args.command == 'activate':
+            activate(args.version, args.registry)
+        elif args.command == 'verify':
+            verify_version(args.version, args.registry)
+            print(f"{args.version} 校验通过")
+        else:
+            current = active_version(args.registry)
+            for meta in list_versions(args.registry):
+                marker = '*' if meta['version'] == current else ' '
+                print(f"{marker} {meta['version']}\t{meta.get('registered_at', '')}\t{meta.get('description', '')}")
+    except ModelRegistryError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,291 @@
+# 批量重新评分
+#
+# 重新训练模型后，已经处理过的文件的欺诈概率仍是旧模型算出来的（process_data 把概率写在源文件的 status 字段里），
+# 以前只能重新上传文件。这个命令按 _id 顺序分块读取 json_res 集合中的所有结果，从结果 JSON 中还原表头字段，
+# 每块构造一个特征矩阵、只调用一次模型，再用 bulk_write 批量写回：
+#   - json_res.prediction: {probability, error, model_version, scored_at}
+#   - files 集合中源文件记录的 status: 与 process_data 相同，概率或无法预测的原因（正在处理中的文件不覆盖）
+#
+# 命令行：
+#   cd backend
+#   python -m services.risk_prediction.rescore --version v2         # 模型仓库（registry.py）中的版本，默认为 ACTIVE 版本
+#   python -m services.risk_prediction.rescore --model-dir services/risk_prediction/adaboost_model_npy
+#   python -m services.risk_prediction.rescore --dry-run            # 只评分统计，不写回
+# 每处理完一块就把最后一个 _id 写入检查点文件，中断后用同样的参数再次运行会从检查点继续；
+# 已经用同一模型版本评过分的结果会被跳过，所以即使检查点丢失，重新运行也只会处理剩下的文档。
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, UTC
+from itertools import islice
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from db.file_records import FILES_COLLECTION, KIND_RESULT, KIND_SOURCE
+
+from .fast_model import EXPORT_DIR, FastAdaBoostModel
+from .prediction import build_feature_matrix
+from .registry import ModelRegistryError, active_version, load_version
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CHECKPOINT = os.path.join(CURRENT_DIR, 'rescore_checkpoint.json')
+DEFAULT_CHUNK_SIZE = 1000
+
+# 正在处理的文件稍后会由 process_data 写入新的状态，重新评分时不覆盖
+SKIP_STATUSES = ('processing',)
+
+
+def content_to_fields(content):
+    """
+    把 json_res 中按大分类分组的结果（services/target_to_json.py 的 dataframe_to_json）还原为 {字段名: 内容}
+    """
+    fields = {}
+    for entries in (content or {}).values():
+        if not isinstance(entries, list):
+            # task_id、status 等附加信息
+            continue
+        for entry in entries:
+            if isinstance(entry, dict) and 'key' in entry:
+                fields[entry['key']] = entry.get('value')
+    return fields
+
+
+def model_version(model):
+    """模型版本：模型仓库写入 meta.json 的 version，直接使用导出目录时为源模型 sha256 的前 12 位（与 prediction.py 一致）"""
+    meta = model.meta
+    return meta.get('version') or (meta.get('source_sha256') or 'unknown')[:12]
+
+
+def score_chunk(model, documents):
+    """
+    对一块 json_res 文档批量评分
+
+    返回：
+        tuple: (probabilities, errors)，与 documents 等长；校验失败的文档概率为 None
+    """
+    X, errors = build_feature_matrix([content_to_fields(document.get('content')) for document in documents])
+    probabilities = [None] * len(documents)
+    valid = [i for i, error in enumerate(errors) if error is None]
+    if valid:
+        for i, probability in zip(valid, model.predict_proba(X[valid])[:, 1]):
+            probabilities[i] = float(probability)
+    return probabilities, errors
+
+
+def source_files(db, result_ids):
+    """
+    查出结果文件对应的 (仓库 id, 源文件 id)
+
+    upload_res_file 在结果文件的记录中保存了 source_file，这里按 file_id 索引一次查询一整块结果
+    """
+    mapping = {}
+    cursor = db[FILES_COLLECTION].find(
+        {"file_id": {"$in": result_ids}, "kind": KIND_RESULT},
+        {"_id": 0, "file_id": 1, "repo_id": 1, "source_file": 1},
+    )
+    for result in cursor:
+        if result.get('source_file'):
+            mapping[result['file_id']] = (result['repo_id'], result['source_file'])
+    return mapping
+
+
+def build_writes(documents, probabilities, errors, version, locations, scored_at):
+    """生成 json_res 和 files 两个集合的批量更新操作"""
+    json_res_ops, file_ops = [], []
+    for document, probability, error in zip(documents, probabilities, errors):
+        json_res_ops.append(UpdateOne(
+            {"_id": document['_id']},
+            {"$set": {"prediction": {
+                "probability": probability,
+                "error": error,
+                "model_version": version,
+                "scored_at": scored_at,
+            }}},
+        ))
+        location = locations.get(document.get('file_id'))
+        if location is None:
+            continue
+        repo_id, source_file_id = location
+        status = f"{probability}" if probability is not None else error
+        file_ops.append(UpdateOne(
+            {"file_id": source_file_id, "repo_id": repo_id, "kind": KIND_SOURCE,
+             "status": {"$nin": list(SKIP_STATUSES)}},
+            {"$set": {"status": status}},
+        ))
+    return json_res_ops, file_ops
+
+
+def load_checkpoint(path, version):
+    """读取检查点；模型版本不同的检查点不能用于继续"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get('model_version') != version:
+        raise ValueError(f"检查点 {path} 属于模型版本 {checkpoint.get('model_version')}，"
+                         f"与当前版本 {version} 不一致；确认后使用 --restart 重新开始")
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """先写临时文件再替换，中途被杀死也不会留下损坏的检查点"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def iter_chunks(cursor, size):
+    while True:
+        chunk = list(islice(cursor, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def rescore(db, model, chunk_size=DEFAULT_CHUNK_SIZE, checkpoint_path=DEFAULT_CHECKPOINT,
+            restart=False, force=False, dry_run=False, limit=None):
+    """
+    用 model 重新评分 json_res 中的所有结果
+
+    参数：
+        db: pymongo 数据库对象
+        model: FastAdaBoostModel
+        chunk_size: 每块读取、评分、写回的文档数
+        checkpoint_path: 检查点文件，None 表示不记录也不继续
+        restart: 忽略已有的检查点，从头开始
+        force: 也重新评分已经用同一模型版本评过分的结果
+        dry_run: 只评分统计，不写回数据库，也不记录检查点
+        limit: 最多处理的文档数，用于试运行
+
+    返回：
+        dict: 各项计数与耗时
+    """
+    version = model_version(model)
+    checkpoint = None
+    if checkpoint_path and not restart and not dry_run:
+        checkpoint = load_checkpoint(checkpoint_path, version)
+
+    stats = {
+        'model_version': version,
+        'last_id': None,
+        'processed': 0,
+        'scored': 0,
+        'unscorable': 0,
+        'json_res_updated': 0,
+        'status_updated': 0,
+        'read_seconds': 0.0,
+        'score_seconds': 0.0,
+        'write_seconds': 0.0,
+    }
+    query = {}
+    if checkpoint:
+        stats.update({key: checkpoint[key] for key in stats if key in checkpoint})
+        query['_id'] = {"$gt": ObjectId(checkpoint['last_id'])}
+        logger.info(f"从检查点继续：已处理 {stats['processed']} 个，上次的最后一个 _id 为 {checkpoint['last_id']}")
+    if not force:
+        query['prediction.model_version'] = {"$ne": version}
+
+    total = db.json_res.count_documents(query)
+    if limit is not None:
+        total = min(total, limit)
+    logger.info(f"模型版本 {version}，待评分 {total} 个结果，每块 {chunk_size} 个")
+
+    cursor = db.json_res.find(query, {"file_id": 1, "content": 1}).sort("_id", 1).batch_size(chunk_size)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    started = time.time()
+    done = 0
+    read_started = time.time()
+    for documents in iter_chunks(cursor, chunk_size):
+        stats['read_seconds'] += time.time() - read_started
+
+        score_started = time.time()
+        probabilities, errors = score_chunk(model, documents)
+        stats['score_seconds'] += time.time() - score_started
+
+        scored = sum(probability is not None for probability in probabilities)
+        stats['scored'] += scored
+        stats['unscorable'] += len(documents) - scored
+
+        if not dry_run:
+            write_started = time.time()
+            locations = source_files(db, [document['file_id'] for document in documents if 'file_id' in document])
+            json_res_ops, file_ops = build_writes(documents, probabilities, errors, version, locations,
+                                                  datetime.now(UTC))
+            result = db.json_res.bulk_write(json_res_ops, ordered=False)
+            stats['json_res_updated'] += result.modified_count
+            if file_ops:
+                result = db[FILES_COLLECTION].bulk_write(file_ops, ordered=False)
+                stats['status_updated'] += result.modified_count
+            stats['write_seconds'] += time.time() - write_started
+
+        done += len(documents)
+        stats['processed'] += len(documents)
+        stats['last_id'] = str(documents[-1]['_id'])
+        if checkpoint_path and not dry_run:
+            save_checkpoint(checkpoint_path, stats)
+
+        elapsed = time.time() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        remaining = (total - done) / rate if rate > 0 and total > done else 0.0
+        logger.info(f"进度 {done}/{total}，{rate:.0f} 个/秒，预计剩余 {remaining:.0f} 秒"
+                    f"（读取 {stats['read_seconds']:.1f}s，评分 {stats['score_seconds']:.1f}s，写回 {stats['write_seconds']:.1f}s）")
+        read_started = time.time()
+
+    elapsed = time.time() - started
+    stats['elapsed_seconds'] = round(elapsed, 3)
+    stats['docs_per_second'] = round(done / elapsed, 1) if elapsed > 0 else 0.0
+    for key in ('read_seconds', 'score_seconds', 'write_seconds'):
+        stats[key] = round(stats[key], 3)
+
+    finished = limit is None or done < limit
+    if finished and checkpoint_path and not dry_run and os.path.exists(checkpoint_path):
+        # 全部完成后删除检查点，下一次运行重新扫描（已评分的结果会被模型版本过滤掉）；
+        # 被 limit 截断时保留，下一次从这里继续
+        os.remove(checkpoint_path)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用指定版本的模型重新评分所有已保存的结果")
+    parser.add_argument('--version', default=None, help="模型仓库中的版本，默认为 ACTIVE 版本")
+    parser.add_argument('--model-dir', default=None, help="直接使用导出的 NumPy 模型目录（见 fast_model.py），不经过模型仓库")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="每块处理的文档数")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="检查点文件")
+    parser.add_argument('--restart', action='store_true', help="忽略已有检查点，从头开始")
+    parser.add_argument('--force', action='store_true', help="同一模型版本评过分的结果也重新评分")
+    parser.add_argument('--dry-run', action='store_true', help="只评分统计，不写回数据库")
+    parser.add_argument('--limit', type=int, default=None, help="最多处理的文档数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # 数据库连接在这里才导入，导入本模块（例如只用 content_to_fields）时不需要连接 MongoDB
+    from db.db_util import db
+
+    if args.model_dir:
+        model = FastAdaBoostModel.load(args.model_dir, mmap_mode='r')
+    else:
+        version = args.version or active_version()
+        try:
+            model = load_version(version) if version else FastAdaBoostModel.load(EXPORT_DIR, mmap_mode='r')
+        except ModelRegistryError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+    stats = rescore(db, model, chunk_size=args.chunk_size, checkpoint_path=args.checkpoint,
+                    restart=args.restart, force=args.force, dry_run=args.dry_run, limit=args.limit)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
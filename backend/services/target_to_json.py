@@ -18,6 +18,39 @@ def translate(value):
 
 
 
+def dataframe_to_json(df):
+    """将表头模板格式的表格（大分类、具体条目、内容三列）转换为按大分类分组的字典"""
+    # 初始化结果字典
+    result = {}
+    current_category = None
+    
+    # 遍历每一行数据
+    for _, row in df.iterrows():
+
+        #time.sleep(2)#用来理解一下处理逻辑
+        #print("\n\n\n")
+        #print(_)
+        #print(row)
+        #print("\n\n\n")
+        category = row.iloc[0]
+        category=translate(category)
+        key = row.iloc[1]
+        value = row.iloc[2]
+        
+        # 如果category不为空，更新当前category
+        if pd.notna(category):
+            current_category = category
+            result[current_category] = []
+        
+        # 如果有当前category，添加key-value对
+        if current_category is not None:
+            result[current_category].append({
+                "key": str(key),
+                "value": str(value)
+            })
+    return result
+
+
 def process_target_to_json(target_dir=None,json_dir=None):
     # 首先，获取本文件的路径
     current_path = os.path.abspath(__file__)
@@ -34,35 +67,7 @@ def process_target_to_json(target_dir=None,json_dir=None):
         if file.endswith(".xlsx"):
             # 读取xlsx文件
             df = pd.read_excel(os.path.join(target_path, file))
-            
-            # 初始化结果字典
-            result = {}
-            current_category = None
-            
-            # 遍历每一行数据
-            for _, row in df.iterrows():
-
-                #time.sleep(2)#用来理解一下处理逻辑
-                #print("\n\n\n")
-                #print(_)
-                #print(row)
-                #print("\n\n\n")
-                category = row.iloc[0]
-                category=translate(category)
-                key = row.iloc[1]
-                value = row.iloc[2]
-                
-                # 如果category不为空，更新当前category
-                if pd.notna(category):
-                    current_category = category
-                    result[current_category] = []
-                
-                # 如果有当前category，添加key-value对
-                if current_category is not None:
-                    result[current_category].append({
-                        "key": str(key),
-                        "value": str(value)
-                    })
+            result = dataframe_to_json(df)
             
             # 保存为JSON文件
             output_filename = os.path.splitext(file)[0] + '.json'
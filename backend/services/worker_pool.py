@@ -0,0 +1,283 @@
+# 共享的长驻进程池
+#
+# process_data 原先每个任务都新建一个 ProcessPoolExecutor，每次都要付出启动解释器、
+# 导入 pandas / sklearn / zhipuai、加载 joblib 模型的开销，任务结束后这些又全部丢弃。
+# 这里提供一个进程级单例的进程池，供所有处理请求共享：
+# - 工作进程启动时通过 initializer 预先导入流水线模块并加载模型和表头模板
+# - 池大小、每个工作进程最多处理的任务数（到达后自动替换新进程，防止内存泄漏累积）可通过环境变量配置
+# - 提供健康检查；工作进程异常退出导致进程池损坏时自动重建，只是忙碌（探测任务排队超时）时不重建
+# - 可以终止正在执行指定任务的工作进程（用于取消任务）：每个任务开始执行时，工作进程通过队列报告自己的 PID，
+#   terminate 直接杀死对应的进程。进程池因此损坏并自动重建，同一时刻在其他工作进程中执行的任务
+#   会以 BrokenProcessPool 失败，由调用方决定是否重新提交
+
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# 默认使用(CPU核心数-1)个工作进程，保留一个核心给Web服务，最多8个
+DEFAULT_POOL_SIZE = min(max(1, (os.cpu_count() or 2) - 1), 8)
+WORKER_POOL_SIZE = int(os.getenv("WORKER_POOL_SIZE", str(DEFAULT_POOL_SIZE)))
+# 每个工作进程处理这么多个任务后被替换，0 表示不替换
+WORKER_MAX_TASKS_PER_CHILD = int(os.getenv("WORKER_MAX_TASKS_PER_CHILD", "50"))
+# max_tasks_per_child 不支持 fork 启动方式，默认使用 spawn
+WORKER_START_METHOD = os.getenv("WORKER_START_METHOD", "spawn")
+WORKER_HEALTH_TIMEOUT = float(os.getenv("WORKER_HEALTH_TIMEOUT", "10"))
+
+
+# 工作进程中用于报告 (任务编号, PID) 的队列，由 _warm_worker 设置
+_started_queue = None
+
+# 终止工作进程使用的信号；Windows 没有 SIGKILL，os.kill 使用 SIGTERM 时直接结束进程
+_KILL_SIGNAL = getattr(signal, "SIGKILL", signal.SIGTERM)
+
+
+def _warm_worker(started_queue=None):
+    """工作进程初始化：预先导入流水线并加载模型、表头模板，让第一个任务不再承担冷启动开销"""
+    global _started_queue
+    _started_queue = started_queue
+    # 导入 pipeline 会连带导入 pandas、zhipuai；风险预测模型默认是导出的 NumPy 数组，不需要导入 sklearn
+    from services.pipeline import run_pipeline  # noqa: F401
+    from services.DataStructuring.DataStructuring.HeaderTemplate import get_header_template
+    from services.risk_prediction.prediction import get_model
+    get_header_template()
+    get_model()
+
+
+def _ping():
+    """健康检查任务：返回工作进程的 PID"""
+    return os.getpid()
+
+
+def _run_tracked(job_id, fn, args, kwargs):
+    """在工作进程中执行任务，开始前报告当前进程的 PID，供 WorkerPool.terminate 使用"""
+    if _started_queue is not None:
+        _started_queue.put((job_id, os.getpid()))
+    return fn(*args, **kwargs)
+
+
+class WorkerPool:
+    """
+    可自动重建的共享进程池
+
+    用法：
+        pool = get_worker_pool()
+        future = pool.submit(func, *args)
+
+    submit 在进程池已损坏时会重建后重试一次；health_check 会实际派发一个任务检查工作进程是否可用；
+    terminate(futures) 杀死正在执行这些任务的工作进程。
+    """
+
+    def __init__(self, size=WORKER_POOL_SIZE, max_tasks_per_child=WORKER_MAX_TASKS_PER_CHILD,
+                 start_method=WORKER_START_METHOD):
+        self.size = max(1, size)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.start_method = start_method
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._job_ids = itertools.count(1)
+        self._jobs = {}  # future -> 任务编号
+        self._job_pids = {}  # 任务编号 -> 正在执行它的工作进程 PID
+        self._killed_pids = set()  # 当前执行器中已经终止的进程，进程池重建前不再重复终止
+        self._started_queue = None
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "rebuilds": 0, "terminated": 0,
+                      "started_at": None}
+
+    def _create_executor(self):
+        context = multiprocessing.get_context(self.start_method)
+        # 每个执行器使用新的队列：被杀死的工作进程可能正持有旧队列的写锁
+        self._started_queue = context.Queue()
+        self._job_pids.clear()
+        self._killed_pids.clear()
+        kwargs = {}
+        if self.max_tasks_per_child and self.start_method != "fork":
+            kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+        executor = ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=context,
+            initializer=_warm_worker,
+            initargs=(self._started_queue,),
+            **kwargs
+        )
+        self.stats["started_at"] = time.time()
+        logger.info(f"共享进程池已创建：{self.size} 个工作进程，启动方式 {self.start_method}，"
+                    f"每个进程最多处理 {self.max_tasks_per_child or '不限'} 个任务")
+        return executor
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._create_executor()
+        return self._executor
+
+    def start(self):
+        """预热：让所有工作进程立即启动并完成初始化，不等待结果"""
+        for _ in range(self.size):
+            self.submit(_ping)
+
+    def rebuild(self, broken=None):
+        """
+        重建进程池
+
+        参数：
+            broken: 检测到损坏的执行器；如果它已经被其他线程替换，则不再重复重建
+        """
+        with self._lock:
+            old = self._executor
+            if broken is not None and old is not broken:
+                return
+            self._executor = self._create_executor()
+            self.stats["rebuilds"] += 1
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+        logger.warning("共享进程池已重建")
+
+    def submit(self, fn, *args, **kwargs):
+        job_id = next(self._job_ids)
+        executor = self.executor
+        try:
+            future = executor.submit(_run_tracked, job_id, fn, args, kwargs)
+        except BrokenProcessPool:
+            # 某个工作进程异常退出（例如被 OOM 杀死）会导致整个进程池不可用，重建后重试一次
+            logger.error("共享进程池已损坏，正在重建")
+            self.rebuild(broken=executor)
+            executor = self.executor
+            future = executor.submit(_run_tracked, job_id, fn, args, kwargs)
+
+        with self._lock:
+            self.stats["submitted"] += 1
+            self._in_flight += 1
+            self._jobs[future] = job_id
+        future.add_done_callback(lambda f: self._on_done(f, executor))
+        return future
+
+    def _collect_started(self):
+        """读取工作进程报告的 (任务编号, PID)，只保留还没有结束的任务；调用方需持有 self._lock"""
+        started_queue = self._started_queue
+        active = set(self._jobs.values())
+        while started_queue is not None:
+            try:
+                job_id, pid = started_queue.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                break
+            if job_id in active:
+                self._job_pids[job_id] = pid
+
+    def terminate(self, futures):
+        """
+        杀死正在执行这些任务的工作进程，用于取消任务
+
+        还在排队的任务请直接 future.cancel()。被杀死的进程会使整个进程池损坏并自动重建，
+        此时在其他工作进程中执行的任务会以 BrokenProcessPool 失败，调用方可以重新提交。
+
+        返回：
+            list[int]: 被终止的工作进程 PID
+        """
+        killed = []
+        with self._lock:
+            self._collect_started()
+            pids = {self._job_pids.get(self._jobs.get(future)) for future in futures if not future.done()}
+            pids -= self._killed_pids | {None}
+            self._killed_pids |= pids
+        for pid in pids:
+            try:
+                os.kill(pid, _KILL_SIGNAL)
+            except (ProcessLookupError, PermissionError, OSError) as e:
+                logger.warning(f"终止工作进程 {pid} 失败: {e}")
+                continue
+            killed.append(pid)
+        if killed:
+            with self._lock:
+                self.stats["terminated"] += len(killed)
+            logger.warning(f"已终止共享进程池中的工作进程 {killed}，进程池将自动重建")
+        return killed
+
+    def _on_done(self, future, executor):
+        with self._lock:
+            self._in_flight -= 1
+            self._job_pids.pop(self._jobs.pop(future, None), None)
+            # 顺便读取队列，避免没有调用 terminate 时报告在队列中堆积
+            self._collect_started()
+            if future.cancelled() or future.exception() is not None:
+                self.stats["failed"] += 1
+            else:
+                self.stats["completed"] += 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.rebuild(broken=executor)
+
+    def health_check(self, timeout=WORKER_HEALTH_TIMEOUT):
+        """
+        派发一个探测任务检查进程池是否可用
+
+        只有进程池损坏（BrokenProcessPool）时才重建。探测任务超时只说明工作进程都在执行耗时较长的任务，
+        此时返回 busy，不能重建：rebuild 会取消进程池中所有排队的任务，包括正常执行中的任务的子任务。
+
+        返回：
+            dict: healthy、state（ok / busy / broken / error）、latency（秒）、工作进程 PID 以及统计信息
+        """
+        start = time.time()
+        executor = self.executor
+        pid, healthy, state, error = None, False, "error", None
+        try:
+            pid = self.submit(_ping).result(timeout=timeout)
+            healthy, state = True, "ok"
+        except FutureTimeoutError:
+            state, error = "busy", f"探测任务 {timeout} 秒内未执行完成，工作进程可能都在执行长任务"
+            logger.warning(f"共享进程池健康检查超时: {error}")
+        except BrokenProcessPool as e:
+            state, error = "broken", str(e) or type(e).__name__
+            logger.error(f"共享进程池已损坏，正在重建: {error}")
+            self.rebuild(broken=executor)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            logger.error(f"共享进程池健康检查失败: {error}")
+        return {
+            "healthy": healthy,
+            "state": state,
+            "latency": round(time.time() - start, 3),
+            "worker_pid": pid,
+            "error": error,
+            **self.status(),
+        }
+
+    def status(self):
+        """进程池配置与统计信息（不派发任务）"""
+        return {
+            "size": self.size,
+            "max_tasks_per_child": self.max_tasks_per_child,
+            "start_method": self.start_method,
+            "in_flight": self._in_flight,
+            **self.stats,
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logger.info("共享进程池已关闭")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """获取进程内共享的进程池单例"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool()
+    return _pool
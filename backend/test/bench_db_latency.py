@@ -0,0 +1,219 @@
+"""
+MongoDB 访问方式的并发延迟压测脚本
+
+对比 async 路由中直接调用同步 db_util（迁移前的写法）与 await async_db_util（Motor）两种方式：
+- 启动一个只包含压测路由的 uvicorn 进程（单进程、单事件循环，与生产中的一个 worker 相同）
+    GET /sync/repos/{repo_id}    async def 中直接调用 db_util.get_repo_by_id
+    GET /async/repos/{repo_id}   await async_db_util.get_repo_by_id
+    GET /ping                    不访问数据库，用来观察事件循环被阻塞时其他请求的延迟
+- 对每种方式以固定并发发送请求，同时以固定间隔探测 /ping，输出 p50 / p95 / p99 / 最大延迟和吞吐量
+
+运行方式（在 backend 目录下，需要可以连接的 MongoDB，地址见 db_config.DB_URL）：
+    python -m test.bench_db_latency --requests 2000 --concurrency 50
+    python -m test.bench_db_latency --url http://localhost:8000 --path /repos/{repo_id} --repo-id <id>
+第二种方式直接压测正在运行的服务，可以在迁移前后的代码上各运行一次进行对比。
+默认会插入一个压测用的仓库文档，结束后删除。
+"""
+import argparse
+import asyncio
+import math
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException
+
+from db import async_db_util, db_util
+
+app = FastAPI()
+
+
+@app.get("/ping")
+async def ping():
+    return {"status": "ok"}
+
+
+@app.get("/sync/repos/{repo_id}")
+async def get_repo_sync(repo_id: str):
+    # 迁移前的写法：同步调用在事件循环线程中等待数据库返回
+    repo = db_util.get_repo_by_id(repo_id)
+    if not repo:
+        raise HTTPException(status_code=404, detail="Repo not found")
+    return {"id": str(repo["_id"]), "name": repo["name"]}
+
+
+@app.get("/async/repos/{repo_id}")
+async def get_repo_async(repo_id: str):
+    repo = await async_db_util.get_repo_by_id(repo_id)
+    if not repo:
+        raise HTTPException(status_code=404, detail="Repo not found")
+    return {"id": str(repo["_id"]), "name": repo["name"]}
+
+
+def percentile(values, q):
+    """最近秩法计算分位数，values 需已排序"""
+    if not values:
+        return float("nan")
+    index = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def summarize(latencies, elapsed=None):
+    values = sorted(latencies)
+    summary = {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else float("nan")) * 1000,
+    }
+    if elapsed:
+        summary["rps"] = len(values) / elapsed
+    return summary
+
+
+async def run_load(client, path, requests, concurrency, probe_interval):
+    """
+    以 concurrency 个并发请求发送 requests 个请求到 path，同时每 probe_interval 秒请求一次 /ping
+    :return: (目标请求的统计, /ping 的统计, 失败数)
+    """
+    latencies, probe_latencies = [], []
+    errors = 0
+    remaining = iter(range(requests))
+    done = asyncio.Event()
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    async def probe():
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                await client.get("/ping")
+                probe_latencies.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(probe_interval)
+
+    probe_task = asyncio.create_task(probe())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await probe_task
+    return summarize(latencies, elapsed), summarize(probe_latencies), errors
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port):
+    """在子进程中启动压测服务，等待端口可用"""
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "test.bench_db_latency:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("压测服务启动失败")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("压测服务启动超时")
+
+
+def create_bench_repo():
+    """插入一个压测用的仓库文档（不关联用户），返回 _id 字符串"""
+    result = db_util.db.repos.insert_one({
+        "name": "bench_db_latency", "owner_id": None, "desc": "", "collaborators": []
+    })
+    return str(result.inserted_id)
+
+
+def format_row(name, summary, errors=None):
+    row = (f"| {name} | {summary['count']} | {summary['p50_ms']:.1f} | {summary['p95_ms']:.1f} | "
+           f"{summary['p99_ms']:.1f} | {summary['max_ms']:.1f} | ")
+    row += f"{summary['rps']:.0f} |" if "rps" in summary else "- |"
+    if errors is not None:
+        row += f" {errors} |"
+    else:
+        row += " - |"
+    return row
+
+
+async def run_benchmark(base_url, paths, requests, concurrency, probe_interval, warmup):
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    rows = []
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        for name, path in paths:
+            # 预热：建立 HTTP 连接和数据库连接池
+            await run_load(client, path, warmup, concurrency, probe_interval)
+            target, probe, errors = await run_load(client, path, requests, concurrency, probe_interval)
+            rows.append(format_row(f"{name} {path}", target, errors))
+            rows.append(format_row(f"{name} /ping（同时）", probe))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="压测同步 / 异步 MongoDB 访问在并发请求下的延迟")
+    parser.add_argument("--requests", type=int, default=2000, help="每种方式发送的请求数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发请求数")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="/ping 探测间隔（秒）")
+    parser.add_argument("--warmup", type=int, default=200, help="每种方式正式计时前的预热请求数")
+    parser.add_argument("--url", default=None, help="压测已经运行的服务，不启动压测服务")
+    parser.add_argument("--path", default="/repos/{repo_id}", help="与 --url 一起使用的请求路径")
+    parser.add_argument("--repo-id", default=None, help="使用已有的仓库，不插入压测数据")
+    args = parser.parse_args(argv)
+
+    repo_id = args.repo_id or create_bench_repo()
+    process = None
+    try:
+        if args.url:
+            base_url = args.url
+            paths = [("target", args.path.format(repo_id=repo_id))]
+        else:
+            port = _free_port()
+            process = start_server(port)
+            base_url = f"http://127.0.0.1:{port}"
+            paths = [("sync", f"/sync/repos/{repo_id}"), ("async", f"/async/repos/{repo_id}")]
+
+        rows = asyncio.run(run_benchmark(base_url, paths, args.requests, args.concurrency,
+                                         args.probe_interval, args.warmup))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if not args.repo_id:
+            db_util.db.repos.delete_one({"_id": db_util.ObjectId(repo_id)})
+
+    print(f"请求数: {args.requests}, 并发: {args.concurrency}, 数据库: {db_util.db_config.DB_URL}")
+    print("| 请求 | 次数 | p50 (ms) | p95 (ms) | p99 (ms) | 最大 (ms) | 请求/秒 | 失败 |")
+    print("|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        print(row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+检查 db_util 中的每个查询是否都能使用索引
+
+做法：
+- 在一个临时数据库（<DB_NAME>_plan_check）中用 db/indexes.py 创建索引
+- 把 db_util 的 db / fs / bucket / files 指向这个数据库，依次调用 db_util 的各个函数（用户、仓库、文件、聊天、json_res）
+- 通过 pymongo 的命令监听记录这些函数实际发出的 find / update / delete / aggregate / findAndModify 命令
+- 对每条命令执行 explain（queryPlanner），如果胜出的执行计划中有 COLLSCAN（全集合扫描）就失败
+
+只读取任意一条文档的空条件查询（例如 GridFS 写入前检查集合是否为空）不需要索引，不算失败。
+
+运行方式（在 backend 目录下，需要可以连接的 MongoDB，地址见 db_config.DB_URL）：
+    python -m test.check_query_plans
+    python -m test.check_query_plans --keep     # 保留临时数据库，便于手动查看
+mongomock 没有查询优化器，无法执行 explain，这个检查需要真实的 mongod。
+有 COLLSCAN 时退出码为 1，可以放在 CI 中运行。
+"""
+import argparse
+import copy
+import io
+import sys
+
+from pymongo import MongoClient, monitoring
+
+from db import db_config, db_util
+from db.file_records import encode_cursor
+from db.indexes import ensure_indexes
+from gridfs import GridFS, GridFSBucket
+from models.chat import Message
+
+# 会读取数据的命令；insert 不需要索引
+QUERY_COMMANDS = {"find", "update", "delete", "aggregate", "findAndModify", "count", "distinct"}
+# 执行 explain 时需要去掉的会话和写入相关字段
+_STRIP_FIELDS = {"lsid", "txnNumber", "writeConcern", "readConcern", "$db", "$clusterTime", "$readPreference",
+                 "autocommit", "startTransaction"}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """记录发往 database_name 的查询命令，以及发出命令时正在执行的 db_util 函数"""
+
+    def __init__(self, database_name):
+        self.database_name = database_name
+        self.current = None
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name == self.database_name and event.command_name in QUERY_COMMANDS:
+            self.commands.append((self.current, event.command_name, copy.deepcopy(dict(event.command))))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def explain_commands(command_name, command):
+    """
+    把记录下的命令拆成可以 explain 的单条命令
+    update / delete 一次可以包含多条语句，explain 只接受一条
+    """
+    command = {key: value for key, value in command.items() if key not in _STRIP_FIELDS}
+    if command_name == "update":
+        return [{**command, "updates": [statement]} for statement in command["updates"]]
+    if command_name == "delete":
+        return [{**command, "deletes": [statement]} for statement in command["deletes"]]
+    return [command]
+
+
+def query_filter(command_name, command):
+    """命令中的查询条件，用于报告"""
+    if command_name == "update":
+        return command["updates"][0].get("q", {})
+    if command_name == "delete":
+        return command["deletes"][0].get("q", {})
+    if command_name == "aggregate":
+        match = next((stage["$match"] for stage in command.get("pipeline", []) if "$match" in stage), {})
+        return match
+    return command.get("filter", command.get("query", {}))
+
+
+def shape(value):
+    """把查询条件中的具体值替换掉，只保留结构，相同结构的查询只报告一次"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value]
+    return "?"
+
+
+def is_any_document(command_name, command):
+    """空条件且只取一条：读取任意一条文档，不需要索引"""
+    return (command_name == "find" and not command.get("filter")
+            and (command.get("limit") == 1 or command.get("singleBatch")))
+
+
+def winning_stages(explain):
+    """explain 结果中所有胜出计划的阶段名（含 aggregate 内部的 $cursor 阶段和 SBE 的 queryPlan）"""
+    stages = []
+
+    def walk_plan(plan):
+        if isinstance(plan, dict):
+            if "stage" in plan:
+                stages.append(plan["stage"])
+            for key in ("queryPlan", "inputStage"):
+                walk_plan(plan.get(key))
+            for child in plan.get("inputStages", []):
+                walk_plan(child)
+
+    def find_plans(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "winningPlan":
+                    walk_plan(value)
+                elif key != "rejectedPlans":
+                    find_plans(value)
+        elif isinstance(node, list):
+            for item in node:
+                find_plans(item)
+
+    find_plans(explain)
+    return stages
+
+
+def run_scenario(recorder):
+    """按正常使用的顺序调用 db_util 的函数，覆盖所有查询"""
+
+    def call(name, *args, **kwargs):
+        recorder.current = name
+        return getattr(db_util, name)(*args, **kwargs)
+
+    user_id = call("create_user", "plan_check_user", "plan_check@example.com", "plan-check-password")
+    collaborator_id = call("create_user", "plan_check_collaborator", "plan_check_2@example.com", "plan-check-password")
+    call("get_user_by_username", "plan_check_user")
+    call("get_user_by_email", "plan_check@example.com")
+    call("authenticate_user", "plan_check_user", "plan-check-password")
+    call("get_user_by_id", user_id)
+
+    repo_id = call("create_repo", user_id, "plan_check_repo", "desc")
+    call("update_repo_name", repo_id, "plan_check_repo_renamed")
+    call("update_repo_desc", repo_id, "desc 2")
+    call("get_repo_by_id", repo_id)
+    call("add_collaborator", repo_id, collaborator_id)
+    call("repo_exists", repo_id)
+
+    file_id = call("upload_source_file", repo_id, io.BytesIO(b"a,b\n1,2\n"), "plan_check.csv")
+    call("upload_source_file", repo_id, io.BytesIO(b"a,b\n3,4\n"), "plan_check_2.csv")
+    result_id = call("upload_res_file", repo_id, io.BytesIO(b"result"), file_id, "plan_check.xlsx", False)
+    call("get_file_metadata_by_id", repo_id, file_id, True)
+    call("get_file_record", repo_id, result_id)
+    call("get_latest_result", repo_id, file_id)
+    records, _ = call("list_files", repo_id, True, 1)
+    call("list_files", repo_id, True, 1, encode_cursor(records[0]))
+    call("count_files", repo_id, False)
+    call("update_file_status", repo_id, file_id, "processing", True)
+    call("file_exists", file_id)
+    call("download_file", file_id)
+    grid_out = call("open_file", file_id)
+    recorder.current = "read_file_chunks"
+    b"".join(db_util.read_file_chunks(grid_out))
+
+    call("create_or_get_chat_history", user_id, repo_id)
+    call("update_chat_history", user_id, repo_id, Message(sayer="user", text="q"), Message(sayer="assistant", text="a"))
+    call("create_or_update_json_res", result_id, {"a": 1})
+    call("create_or_update_json_res", result_id, {"a": 2})
+    call("get_json_res", result_id)
+
+    call("delete_file", result_id)
+    call("delete_repo", repo_id)
+
+
+def check(db, recorder):
+    """
+    :return: [(函数, 集合, 命令, 条件结构, 阶段, 是否通过)]，相同的 (集合, 命令, 条件结构) 只保留一条
+    """
+    rows, seen = [], set()
+    for function, command_name, command in recorder.commands:
+        for single in explain_commands(command_name, command):
+            collection = single[command_name]
+            condition = shape(query_filter(command_name, single))
+            key = (collection, command_name, repr(condition))
+            if key in seen:
+                continue
+            seen.add(key)
+            if is_any_document(command_name, single):
+                rows.append((function, collection, command_name, condition, "-", True))
+                continue
+            explain = db.command({"explain": single, "verbosity": "queryPlanner"})
+            stages = winning_stages(explain)
+            rows.append((function, collection, command_name, condition, " <- ".join(stages), "COLLSCAN" not in stages))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用 explain 检查 db_util 的查询是否使用索引")
+    parser.add_argument("--keep", action="store_true", help="结束后保留临时数据库")
+    args = parser.parse_args(argv)
+
+    database_name = f"{db_config.DB_NAME}_plan_check"
+    recorder = CommandRecorder(database_name)
+    client = MongoClient(db_config.DB_URL, event_listeners=[recorder], **db_config.client_options())
+    client.drop_database(database_name)
+    db = client[database_name]
+
+    # 让 db_util 的函数读写临时数据库，并经过带命令监听的客户端
+    db_util.db = db
+    db_util.fs = GridFS(db)
+    db_util.bucket = GridFSBucket(db)
+    db_util.files = db[db_util.FILES_COLLECTION]
+
+    try:
+        _, failed = ensure_indexes(db)
+        if failed:
+            print(f"创建索引失败: {failed}", file=sys.stderr)
+            return 1
+        recorder.commands.clear()
+        run_scenario(recorder)
+        rows = check(db, recorder)
+    finally:
+        if not args.keep:
+            client.drop_database(database_name)
+        client.close()
+
+    print(f"数据库: {db_config.DB_URL}，查询结构数: {len(rows)}")
+    print("| 函数 | 集合 | 命令 | 条件 | 执行计划 | 结果 |")
+    print("|---|---|---|---|---|---|")
+    for function, collection, command_name, condition, stages, ok in rows:
+        print(f"| {function} | {collection} | {command_name} | `{condition}` | {stages} | {'OK' if ok else 'COLLSCAN'} |")
+    failures = [row for row in rows if not row[-1]]
+    if failures:
+        print(f"{len(failures)} 个查询使用了全集合扫描", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
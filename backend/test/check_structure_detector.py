@@ -0,0 +1,82 @@
+"""
+检查 StructureDetector 的本地预判结果
+
+CASES 中每一项是 (名称, 文本, 期望的分类, 是否应达到 STRUCTURE_CONFIDENCE_THRESHOLD)：
+- 期望直接采用本地结果的文本（CSV、TSV、JSON、键值对等），分类必须一致且置信度达到阈值
+- 折行的正文（中文调查记录、逗号较多的英文邮件）、带时间的聊天记录、HTML 信件
+  不能被高置信度地判为结构化或半结构化数据，置信度不足时交给远程模型判断也可以
+
+运行方式（在 backend 目录下）：
+    python -m test.check_structure_detector
+有不符合预期的文本时退出码为 1。
+"""
+import sys
+
+from services.DataStructuring.DataStructuring.StructureDetector import (
+    SEMI_STRUCTURED, STRUCTURE_CONFIDENCE_THRESHOLD, STRUCTURED, UNSTRUCTURED, detect_structure,
+)
+
+CASES = [
+    ("csv", "交易编号,账户,金额,时间\n"
+            "T001,6222001,1200.50,2024-03-05 10:12\n"
+            "T002,6222002,88.00,2024-03-05 10:15\n"
+            "T003,6222003,35000.00,2024-03-05 11:02\n"
+            "T004,6222001,500.00,2024-03-06 09:30\n",
+     STRUCTURED, True),
+    ("tsv", "姓名\t年龄\t城市\n张三\t34\t上海\n李四\t28\t北京\n王五\t45\t广州\n",
+     STRUCTURED, True),
+    ("csv 末行少一列", "id,name,score\n1,alice,90\n2,bob,85\n3,carol,77\n4,dave\n",
+     STRUCTURED, True),
+    ("markdown 表格", "| 字段 | 值 |\n|---|---|\n| 账户 | 6222001 |\n| 金额 | 1200 |\n| 币种 | CNY |\n",
+     STRUCTURED, True),
+    ("json", '{"账户": "6222001", "交易": [{"金额": 1200.5, "时间": "2024-03-05"}]}',
+     SEMI_STRUCTURED, True),
+    ("键值对", "客户姓名：张三\n证件号码：310101199001011234\n联系电话：13800000000\n"
+               "开户网点：上海分行\n风险等级：中\n",
+     SEMI_STRUCTURED, True),
+    ("中文折行调查记录", "经过调查，当事人于三月五日在我行网点办理了一笔大额转账，金额较大\n"
+                        "柜员按照规定进行了核实，当事人表示资金用于购买房产，并提供了\n"
+                        "购房合同的复印件，经核对合同信息与转账用途基本一致，但收款方\n"
+                        "账户近期交易频繁，建议后续继续关注该账户的资金往来情况\n",
+     UNSTRUCTURED, False),
+    ("英文邮件", "Hi team, following up on the review from Tuesday, we found that\n"
+                "the account, which was opened in March, received several large\n"
+                "transfers, mostly in the evening, from two unrelated parties, and\n"
+                "the customer, when asked, could not explain the source of funds\n",
+     UNSTRUCTURED, False),
+    ("xml 记录", "<transactions><row><id>T001</id><amount>1200.50</amount></row>"
+                "<row><id>T002</id><amount>88.00</amount></row></transactions>",
+     SEMI_STRUCTURED, True),
+    ("聊天记录", "张三 10:31 今天下午开会吗\n李四 10:32 开，三点在三楼会议室\n"
+                "张三 10:33 好的，我把上周的材料带上\n李四 10:35 记得把客户的转账记录也打印出来\n",
+     UNSTRUCTURED, False),
+    ("HTML 信件", "<html><body><p>尊敬的客户：您好！</p><p>您于三月五日提交的大额转账申请已经受理，"
+                 "我行工作人员将在三个工作日内与您联系核实相关信息，请保持电话畅通。</p>"
+                 "<p>如有疑问，请致电客服热线。</p></body></html>",
+     UNSTRUCTURED, False),
+    ("中文正文", "本行于二零二四年三月对该客户的交易进行了专项检查。\n"
+                "检查发现该客户在短时间内多次进行大额现金存取，与其申报的职业和收入明显不符。\n"
+                "根据反洗钱相关规定，建议将该客户列为高风险客户并提交可疑交易报告。\n",
+     UNSTRUCTURED, True),
+]
+
+
+def check(name, text, expected, confident):
+    level, confidence = detect_structure(text)
+    reached = confidence >= STRUCTURE_CONFIDENCE_THRESHOLD
+    if confident:
+        ok = level == expected and reached
+    else:
+        # 不要求本地给出结论，但不能高置信度地判错
+        ok = level == expected or not reached
+    print(f"{'OK  ' if ok else 'FAIL'} {name}: {level} {confidence}（期望 {expected}{'，达到阈值' if confident else ''}）")
+    return ok
+
+
+def main():
+    results = [check(*case) for case in CASES]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+本地 Ollama 桩服务与字段抽取压测脚本
+
+用于在没有真实 Ollama 的环境下离线测量 AsyncOllamaClient 的吞吐量和并发上限：
+- 桩服务实现 POST /api/generate，按固定延迟返回结果，并统计请求数、TCP 连接数和最大并发数
+- JSON 模式的请求按提示词中的字段列表返回一个 JSON 对象，逐字段请求返回单个答案
+- 可以按比例注入 503 错误，验证重试与退避逻辑
+
+运行方式（在 backend 目录下）：
+    python -m test.ollama_stub --docs 20 --concurrency 8 --latency 0.2
+    python -m test.ollama_stub --serve --port 11500      # 只启动桩服务
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+
+FIELD_PATTERN = re.compile(r'^- "(.+?)":', re.MULTILINE)
+
+
+class StubOllamaServer:
+    """基于 asyncio 的极简 HTTP/1.1 服务，支持 keep-alive"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.1, error_rate=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"requests": 0, "connections": 0, "errors": 0, "max_concurrency": 0}
+        self._active = 0
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/api/generate"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle_connection(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                status, payload = await self._generate(json.loads(body or b"{}"))
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _generate(self, request):
+        self.stats["requests"] += 1
+        self._active += 1
+        self.stats["max_concurrency"] = max(self.stats["max_concurrency"], self._active)
+        try:
+            await asyncio.sleep(self.latency)
+            if random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return "503 Service Unavailable", {"error": "stub overloaded"}
+            prompt = request.get("prompt", "")
+            if request.get("format") == "json":
+                fields = FIELD_PATTERN.findall(prompt)
+                answer = json.dumps({field: self._answer(field) for field in fields}, ensure_ascii=False)
+            else:
+                answer = "C" if "交易类型" in prompt[:40] else "100"
+            return "200 OK", {"model": request.get("model"), "response": answer, "done": True}
+        finally:
+            self._active -= 1
+
+    @staticmethod
+    def _answer(field):
+        if field == "交易类型":
+            return "转账"
+        if "余额" in field or "金额" in field:
+            return "1000.00"
+        return "无"
+
+
+async def run_benchmark(docs, concurrency, latency, error_rate):
+    from services.DataStructuring.DataStructuring.OllamaClient import AsyncOllamaClient, extract_documents_async
+
+    server = await StubOllamaServer(latency=latency, error_rate=error_rate).start()
+    contents = [f"测试文档 {i}：一笔转账交易，金额 1000 元。" for i in range(docs)]
+    try:
+        async with AsyncOllamaClient(url=server.url, max_concurrency=concurrency, backoff=0.05) as client:
+            start = time.perf_counter()
+            results = await extract_documents_async(contents, client=client)
+            elapsed = time.perf_counter() - start
+    finally:
+        await server.stop()
+
+    print(f"文档数: {docs}, 并发上限: {concurrency}, 单次延迟: {latency}s, 错误率: {error_rate}")
+    print(f"总耗时: {elapsed:.2f}s, 吞吐量: {docs / elapsed:.2f} 文档/秒, {server.stats['requests'] / elapsed:.2f} 请求/秒")
+    print(f"服务端统计: {server.stats}")
+    print(f"客户端统计: {client.stats}")
+    assert len(results) == docs
+    assert server.stats["max_concurrency"] <= concurrency, "在途请求数超过了并发上限"
+    assert server.stats["connections"] <= concurrency, "连接没有被复用"
+
+
+async def serve(port, latency, error_rate):
+    server = await StubOllamaServer(port=port, latency=latency, error_rate=error_rate).start()
+    print(f"Ollama 桩服务已启动: {server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Ollama 桩服务与字段抽取压测")
+    parser.add_argument("--docs", type=int, default=10, help="压测文档数")
+    parser.add_argument("--concurrency", type=int, default=4, help="客户端并发上限")
+    parser.add_argument("--latency", type=float, default=0.1, help="桩服务每个请求的延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务返回 503 的比例")
+    parser.add_argument("--serve", action="store_true", help="只启动桩服务，不运行压测")
+    parser.add_argument("--port", type=int, default=11434, help="--serve 模式下的监听端口")
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.port, args.latency, args.error_rate))
+    else:
+        asyncio.run(run_benchmark(args.docs, args.concurrency, args.latency, args.error_rate))
@@ -0,0 +1,111 @@
+"""
+文件处理工作进程入口
+
+API 服务（main.py）只把处理任务写入 Redis 任务队列，这个进程负责领取并执行任务：
+
+    cd backend
+    python worker.py
+
+可以在多台机器上各启动若干个工作进程，与 API 服务分别扩容。
+每个工作进程同时执行 WORKER_CONCURRENCY 个任务，多文档任务再分发到共享进程池（services/worker_pool.py）中并行处理。
+每隔 TASK_QUEUE_WORKER_HEALTH_INTERVAL 秒检查一次共享进程池，并把结果上报到 Redis，供 API 的 GET /process/workers/health 查询。
+收到 SIGINT / SIGTERM 后不再领取新任务，等待正在执行的任务完成后退出；
+如果进程被强制杀死，未完成的任务会在租约到期后被其他工作进程重新领取。
+"""
+import asyncio
+import os
+import signal
+import socket
+
+from api.process import execute_task
+from core.config.task_queue_config import task_queue_settings
+from core.logging import logger
+from core.redis_manager import redis_manager
+from core.task_queue import task_queue
+from services.worker_pool import get_worker_pool
+
+# 每个工作进程同时执行的任务数
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+
+
+async def consume(worker_id: str, stop_event: asyncio.Event):
+    """循环领取并执行任务，直到收到停止信号"""
+    while not stop_event.is_set():
+        try:
+            task = await task_queue.lease(worker_id)
+        except Exception as e:
+            logger.error(f"{worker_id} 领取任务失败: {str(e)}")
+            task = None
+
+        if task is None:
+            # 队列为空或 Redis 暂时不可用，等待后再试；收到停止信号时立即返回
+            try:
+                await asyncio.wait_for(stop_event.wait(), timeout=task_queue_settings.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        logger.info(f"{worker_id} 领取任务 {task['task_id']}")
+        try:
+            await execute_task(task)
+        except Exception as e:
+            # execute_task 已经把失败记录到任务队列，这里只防止单个任务的意外异常终止循环
+            logger.error(f"{worker_id} 执行任务 {task['task_id']} 时出现未处理的异常: {str(e)}")
+
+
+async def report_health(worker_id: str, stop_event: asyncio.Event):
+    """定期检查共享进程池并把健康状态上报到 Redis，直到收到停止信号"""
+    worker_pool = get_worker_pool()
+    while not stop_event.is_set():
+        try:
+            # 探测任务需要等待子进程返回，放到线程中执行，避免阻塞任务的续约和领取
+            health = await asyncio.to_thread(worker_pool.health_check)
+            await task_queue.publish_worker_health(worker_id, health)
+        except Exception as e:
+            logger.error(f"{worker_id} 上报进程池健康状态失败: {str(e)}")
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=task_queue_settings.WORKER_HEALTH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+    try:
+        await task_queue.remove_worker_health(worker_id)
+    except Exception as e:
+        logger.warning(f"{worker_id} 删除进程池健康状态失败: {str(e)}")
+
+
+async def main():
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows 不支持 add_signal_handler，只能依赖 KeyboardInterrupt
+            pass
+
+    await redis_manager.init_redis_pool()
+    # 预热共享进程池：提前启动子进程并加载模型
+    worker_pool = get_worker_pool()
+    worker_pool.start()
+
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    consumers = [
+        asyncio.create_task(consume(f"{host}#{i}", stop_event))
+        for i in range(max(1, WORKER_CONCURRENCY))
+    ]
+    reporter = asyncio.create_task(report_health(host, stop_event))
+    logger.info(f"工作进程 {host} 已启动，并发数 {len(consumers)}")
+
+    try:
+        await asyncio.gather(*consumers, reporter)
+    finally:
+        worker_pool.shutdown(wait=True)
+        await redis_manager.close()
+        logger.info(f"工作进程 {host} 已退出")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass